@@ -3,15 +3,54 @@ try:
 except ImportError:
     whisper = None
 
+import asyncio
+import logging
 import os
-import requests
 from enum import Enum
-from dotenv import load_dotenv
+from functools import lru_cache
+from typing import Iterator, Optional, Union
+
+import numpy as np
+
+from audio.language import normalize_language, route_language, routed_models
+from audio.preprocess import PreparedAudio, prepare_audio, prepare_pcm_file
+from audio.timestamps import Segment, Word
+from audio.tuning import asr_batch_size, asr_cpu_threads, default_model
+from audio.upload import aiter_file
+from backends.base import Backend, BackendRegistry, Capabilities
+from providers.client import (
+    get_async_provider_client,
+    get_credentials,
+    get_provider_client,
+)
+from telemetry.metrics import stage
 
 try:
-    from faster_whisper import WhisperModel, BatchedInferencePipeline
+    from faster_whisper import (
+        WhisperModel,
+        BatchedInferencePipeline,
+        available_models,
+        decode_audio,
+    )
 except ImportError:
-    WhisperModel, BatchedInferencePipeline = None, None
+    WhisperModel, BatchedInferencePipeline, decode_audio = None, None, None
+    available_models = None
+
+logger = logging.getLogger(__name__)
+
+# ctranslate2 weight types faster-whisper can run a model in
+COMPUTE_TYPES = (
+    "default",
+    "auto",
+    "int8",
+    "int8_float32",
+    "int8_float16",
+    "int8_bfloat16",
+    "int16",
+    "float16",
+    "bfloat16",
+    "float32",
+)
 
 
 # Enum for transcription method
@@ -22,76 +61,200 @@ class TranscriptionMethod(str, Enum):
     dummy = "dummy"
 
 
-def transcribe_with_faster_whisper_batched(
-    path: str, query_lang=None, query_prompt=None, query_audio_kind=None
-) -> str:
+# models a worker keeps loaded at once, requests for other sizes evict the
+# least recently used one
+ASR_LOADED_MODELS = int(os.getenv("ASR_LOADED_MODELS", "2"))
+
+
+def load_faster_whisper_model(model_size=None, compute_type=None):
+    default_size, default_compute_type = default_model()
+    return _load_faster_whisper_model(
+        model_size or default_size, compute_type or default_compute_type
+    )
+
+
+# models are loaded once per process and reused by every later call, so a
+# long-lived worker only pays the load cost at startup
+@lru_cache(maxsize=ASR_LOADED_MODELS)
+def _load_faster_whisper_model(model_size: str, compute_type: str):
     if WhisperModel is None:
         raise ImportError("Whisperx module is not installed.")
     if BatchedInferencePipeline is None:
         raise ImportError("torch module is not installed.")
 
-    model = WhisperModel(
-        "tiny",
-        device="cpu",
-        compute_type="int8",
+    logger.info("loading faster-whisper %s (%s)", model_size, compute_type)
+    with stage("model_load", TranscriptionMethod.faster_whisper, model=model_size):
+        model = WhisperModel(
+            model_size,
+            device=os.getenv("FASTER_WHISPER_DEVICE", "cpu"),
+            compute_type=compute_type,
+            cpu_threads=asr_cpu_threads(),
+        )
+    return BatchedInferencePipeline(model=model)
+
+
+def whisper_default_model() -> str:
+    return os.getenv("WHISPER_MODEL", "turbo")
+
+
+@lru_cache(maxsize=ASR_LOADED_MODELS)
+def load_whisper_model(model_size=None):
+    if whisper is None:
+        raise ImportError("Whisper module is not installed.")
+
+    model_size = model_size or whisper_default_model()
+    logger.info("loading whisper %s", model_size)
+    with stage("model_load", TranscriptionMethod.whisper, model=model_size):
+        return whisper.load_model(model_size)
+
+
+def _check_model_size(model_size: str, known) -> None:
+    # ASR_ALLOWED_MODELS keeps requests to the sizes this machine can hold
+    allowed = [m.strip() for m in os.getenv("ASR_ALLOWED_MODELS", "").split(",")]
+    allowed = [m for m in allowed if m] or known
+    if allowed and model_size not in allowed:
+        raise ValueError(
+            f"Unknown or disallowed model size {model_size}, "
+            f"choose from {', '.join(allowed)}"
+        )
+
+
+def detect_language_with_faster_whisper(audio) -> str:
+    """
+    Language spoken in the first ASR_DETECT_SEGMENTS 30 second windows of
+    `audio` (a path or 16 kHz samples), by ASR_DETECT_MODEL or the default
+    model.
+    """
+    detector = load_faster_whisper_model(os.getenv("ASR_DETECT_MODEL") or None)
+    if not detector.model.model.is_multilingual:
+        return "en"
+    if isinstance(audio, str):
+        audio = decode_audio(audio, sampling_rate=16000)
+
+    language, probability, _ = detector.model.detect_language(
+        audio, language_detection_segments=int(os.getenv("ASR_DETECT_SEGMENTS", "1"))
     )
-    batched_model = BatchedInferencePipeline(model=model)
+    logger.info("detected language %s (%.2f)", language, probability)
+    return language
+
+
+def _detect_instead(language: str) -> None:
+    # older tokenizers lack newer language tokens (`yue` came with large-v3),
+    # passing one fails, so the model detects the language instead
+    logger.info("the model has no %s token, detecting the language", language)
+    return None
+
+
+def stream_with_faster_whisper_batched(
+    path: Union[str, PreparedAudio],
+    query_lang=None,
+    query_prompt=None,
+    query_audio_kind=None,
+    model_size=None,
+    compute_type=None,
+) -> Iterator[Segment]:
+    """
+    Yield each segment with its words as soon as faster-whisper decodes it,
+    `str(segment)` is its `[start -> end] text` line.
+    Trimmed audio is decoded clip by clip as cut by the preprocessing VAD,
+    and its times are mapped back to the original file.
+    """
+    audio, clips, remap = path, None, None
+    if isinstance(path, PreparedAudio):
+        audio, clips, remap = path.samples, path.clips, path.remap
+
+    # a known language skips whisper's own detection, an unknown one is
+    # detected once here so it can pick the model
+    language = normalize_language(query_lang)
+    if language is None:
+        language = detect_language_with_faster_whisper(audio)
+    if model_size is None:
+        model_size, compute_type = route_language(language, compute_type)
+    batched_model = load_faster_whisper_model(model_size, compute_type)
+    if not batched_model.model.model.is_multilingual:
+        language = None
+    elif language is not None:
+        tokenizer = batched_model.model.hf_tokenizer
+        if tokenizer.token_to_id(f"<|{language}|>") is None:
+            language = _detect_instead(language)
 
     # Build initial_prompt from parameters with null checking
     initial_prompt_parts = []
     if query_prompt is not None:
         initial_prompt_parts.append("user prompt: ")
         initial_prompt_parts.append(query_prompt)
-    if query_lang is not None:
-        initial_prompt_parts.append("lang: ")
-        initial_prompt_parts.append(query_lang)
     if query_audio_kind is not None:
         initial_prompt_parts.append("audio_kind: ")
         initial_prompt_parts.append(query_audio_kind)
     initial_prompt = ", ".join(initial_prompt_parts) if initial_prompt_parts else None
 
+    # segments is a lazy generator, decoding happens while iterating it
     segments, info = batched_model.transcribe(
-        path,
-        batch_size=16,
-        # language=language,
+        audio,
+        batch_size=asr_batch_size(),
+        language=language,
         word_timestamps=True,
         condition_on_previous_text=False,
         initial_prompt=initial_prompt,
+        # speech clips found while trimming, so the pipeline skips its own VAD
+        clip_timestamps=clips,
     )
 
-    segments = list(segments)
-
-    lines = []
     for segment in segments:
-        line = f"[{segment.start:.2f}s -> {segment.end:.2f}s] {segment.text}"
-        lines.append(line)
+        timed = Segment(
+            start=segment.start,
+            end=segment.end,
+            text=segment.text,
+            words=[
+                Word(word.start, word.end, word.word, word.probability)
+                for word in segment.words or []
+            ],
+        )
+        yield timed if remap is None else remap.segment(timed)
 
-    text = "\n".join(lines)
+
+def transcribe_with_faster_whisper_batched(
+    path: str,
+    query_lang=None,
+    query_prompt=None,
+    query_audio_kind=None,
+    model_size=None,
+    compute_type=None,
+) -> str:
+    segments = stream_with_faster_whisper_batched(
+        path, query_lang, query_prompt, query_audio_kind, model_size, compute_type
+    )
+
+    text = "\n".join(str(segment) for segment in segments)
 
     if not isinstance(text, str):
         raise TypeError(
             f"Expected transcription to be a string, got {type(text).__name__}"
         )
 
-    print(f"transcribed the mp3 {text=}")
+    logger.debug("transcribed %d characters", len(text))
     return text
 
+
 def transcribe_with_whisper(
-    path: str, query_lang=None, query_prompt=None, query_audio_kind=None
+    path: str,
+    query_lang=None,
+    query_prompt=None,
+    query_audio_kind=None,
+    model_size=None,
 ) -> str:
-    if whisper is None:
-        raise ImportError("Whisper module is not installed.")
-
-    model = whisper.load_model("turbo")
+    model = load_whisper_model(model_size)
+    # None lets whisper detect it
+    language = normalize_language(query_lang)
+    known = list(whisper.tokenizer.LANGUAGES)[: getattr(model, "num_languages", 99)]
+    if language is not None and model.is_multilingual and language not in known:
+        language = _detect_instead(language)
 
     # Build initial_prompt from parameters with null checking
     initial_prompt_parts = []
     if query_prompt is not None:
         initial_prompt_parts.append("user prompt: ")
         initial_prompt_parts.append(query_prompt)
-    if query_lang is not None:
-        initial_prompt_parts.append("lang: ")
-        initial_prompt_parts.append(query_lang)
     if query_audio_kind is not None:
         initial_prompt_parts.append("audio_kind: ")
         initial_prompt_parts.append(query_audio_kind)
@@ -102,6 +265,7 @@ def transcribe_with_whisper(
         audio=path,
         word_timestamps=True,  # TODO: timestamps are not coming in the output check the code for this
         initial_prompt=initial_prompt,
+        language=language,
     )
     text = result.get("text")
 
@@ -110,67 +274,364 @@ def transcribe_with_whisper(
             f"Expected transcription to be a string, got {type(text).__name__}"
         )
 
-    print(f"transcribed the mp3 {text=}")
+    logger.debug("transcribed %d characters", len(text))
     return text
 
-def transcribe_with_alibaba_asr_api(path: str) -> str:
-    load_dotenv()
-    appkey = os.getenv("ALIBABA_ASR_APPKEY")
-    token = os.getenv("ALIBABA_ASR_TOKEN")
+
+# overridable to point at a regional gateway or a local stub
+ALIBABA_ASR_URL = os.getenv(
+    "ALIBABA_ASR_URL", "http://nls-gateway-ap-southeast-1.aliyuncs.com/stream/v1/asr"
+)
+
+
+def _alibaba_asr_request() -> tuple[str, dict]:
+    credentials = get_credentials()
 
     # TODO: pcm is for wav files --might need to change according to files
     format = "pcm"
 
     url = (
-        f"http://nls-gateway-ap-southeast-1.aliyuncs.com/stream/v1/asr"
-        f"?appkey={appkey}&format={format}&sample_rate=16000"
+        f"{ALIBABA_ASR_URL}?appkey={credentials.alibaba_asr_appkey}"
+        f"&format={format}&sample_rate=16000"
         # f"&enable_punctuation_prediction=true&enable_inverse_text_normalization=true"
     )
     headers = {
-        "X-NLS-Token": token,
+        "X-NLS-Token": credentials.alibaba_asr_token,
         "Content-Type": "application/octet-stream",
     }
+    return url, headers
 
-    with open(path, "rb") as audio_file:
-        data = audio_file.read()
-
-    response = requests.post(url, headers=headers, data=data)
 
-    if response.status_code != 200:
-        print(f"API Error: {response.status_code} {response.text}")
-        response.raise_for_status()
-
-    result = response.json()
+def _alibaba_asr_text(result: dict) -> str:
     if result.get("status") == 20000000:
         text = result.get("result", "")
     else:
         text = f"Error: {result.get('message', 'Unknown error')}"
 
-    print(f"transcribed the audio {text=}")
+    logger.debug("transcribed %d characters", len(text))
     return text
 
+
+def transcribe_with_alibaba_asr_api(path: str) -> str:
+    url, headers = _alibaba_asr_request()
+
+    # requests streams a file body from disk instead of loading it in memory
+    with open(path, "rb") as audio_file:
+        response = get_provider_client().post(url, headers=headers, data=audio_file)
+
+    if response.status_code != 200:
+        logger.error(
+            "alibaba asr api error %s: %s", response.status_code, response.text
+        )
+        response.raise_for_status()
+
+    return _alibaba_asr_text(response.json())
+
+
+async def atranscribe_with_alibaba_asr_api(path: str) -> str:
+    """
+    Async version of `transcribe_with_alibaba_asr_api`, runs on the event loop.
+    """
+    url, headers = _alibaba_asr_request()
+    # a known length avoids chunked transfer encoding for the streamed body
+    headers["Content-Length"] = str(os.path.getsize(path))
+
+    response = await get_async_provider_client().post(
+        url, headers=headers, content_factory=lambda: aiter_file(path)
+    )
+
+    if response.status_code != 200:
+        logger.error(
+            "alibaba asr api error %s: %s", response.status_code, response.text
+        )
+        response.raise_for_status()
+
+    return _alibaba_asr_text(response.json())
+
+
+class TranscriptionBackend(Backend):
+    def transcribe(
+        self,
+        path: str,
+        query_lang=None,
+        query_prompt=None,
+        query_audio_kind=None,
+        model_size=None,
+        compute_type=None,
+    ) -> str:
+        raise NotImplementedError
+
+    def stream(
+        self,
+        path: str,
+        query_lang=None,
+        query_prompt=None,
+        query_audio_kind=None,
+        model_size=None,
+        compute_type=None,
+    ) -> Iterator[Union[str, Segment]]:
+        # backends that cannot stream yield their whole transcription once,
+        # backends with word timestamps yield `Segment`s instead of text
+        yield self.transcribe(
+            path, query_lang, query_prompt, query_audio_kind, model_size, compute_type
+        )
+
+    def resolve_model(
+        self, model_size=None, compute_type=None, query_lang=None
+    ) -> tuple[Optional[str], Optional[str]]:
+        """
+        The model size and compute type a request runs with, the deployment's
+        defaults filled in. Raises `ValueError` on a choice this backend
+        cannot make.
+        """
+        if model_size or compute_type:
+            raise ValueError(f"{self.name} has no model size or compute type choice")
+        return None, None
+
+    def load_audio(self, path: str):
+        """
+        Prepare the audio ahead of `transcribe` / `stream`, which then get the
+        result in place of `path`. Backends that read the file themselves
+        keep the path.
+        """
+        return path
+
+    async def atranscribe(
+        self, path: str, query_lang=None, query_prompt=None, query_audio_kind=None
+    ) -> str:
+        raise NotImplementedError(f"{self.name} has no async transcription")
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    name = TranscriptionMethod.faster_whisper.value
+    capabilities = Capabilities(
+        local=True, streaming=True, max_concurrency=4, timestamps=True
+    )
+
+    def warmup(self) -> None:
+        # the default model and every model requests may be routed to
+        models = [(None, None), *routed_models()]
+        if len(models) > ASR_LOADED_MODELS:
+            logger.warning(
+                "%d models are routed to but ASR_LOADED_MODELS keeps %d, "
+                "the rest load on first use",
+                len(models),
+                ASR_LOADED_MODELS,
+            )
+        for model_size, compute_type in models[:ASR_LOADED_MODELS]:
+            load_faster_whisper_model(model_size, compute_type)
+
+    def resolve_model(
+        self, model_size=None, compute_type=None, query_lang=None
+    ) -> tuple[Optional[str], Optional[str]]:
+        if compute_type and compute_type not in COMPUTE_TYPES:
+            raise ValueError(
+                f"Unknown compute type {compute_type}, "
+                f"choose from {', '.join(COMPUTE_TYPES)}"
+            )
+        if model_size:
+            _check_model_size(
+                model_size, list(available_models()) if available_models else []
+            )
+        else:
+            language = normalize_language(query_lang)
+            if language is None:
+                # picked by the worker once it has detected the language
+                return None, compute_type
+            model_size, compute_type = route_language(language, compute_type)
+
+        default_size, default_compute_type = default_model()
+        model_size = model_size or default_size
+        compute_type = compute_type or default_compute_type
+        if compute_type not in COMPUTE_TYPES:
+            raise ValueError(
+                f"Unknown compute type {compute_type}, "
+                f"choose from {', '.join(COMPUTE_TYPES)}"
+            )
+        return model_size, compute_type
+
+    def transcribe(
+        self,
+        path: str,
+        query_lang=None,
+        query_prompt=None,
+        query_audio_kind=None,
+        model_size=None,
+        compute_type=None,
+    ) -> str:
+        return transcribe_with_faster_whisper_batched(
+            path, query_lang, query_prompt, query_audio_kind, model_size, compute_type
+        )
+
+    def stream(
+        self,
+        path: str,
+        query_lang=None,
+        query_prompt=None,
+        query_audio_kind=None,
+        model_size=None,
+        compute_type=None,
+    ) -> Iterator[Segment]:
+        yield from stream_with_faster_whisper_batched(
+            path, query_lang, query_prompt, query_audio_kind, model_size, compute_type
+        )
+
+    def load_audio(self, path: str):
+        # chunks of a long recording are saved already decoded and trimmed
+        if path.endswith(".npy"):
+            return np.load(path)
+        # decoded to 16 kHz samples with the silence cut, which the pipeline
+        # takes instead of a path
+        prepared = prepare_audio(path)
+        if isinstance(prepared, str) and decode_audio is not None:
+            return decode_audio(path, sampling_rate=16000)
+        return prepared
+
+    def close(self) -> None:
+        _load_faster_whisper_model.cache_clear()
+
+
+class WhisperBackend(TranscriptionBackend):
+    name = TranscriptionMethod.whisper.value
+    capabilities = Capabilities(local=True, max_concurrency=1)
+
+    def warmup(self) -> None:
+        load_whisper_model()
+
+    def resolve_model(
+        self, model_size=None, compute_type=None, query_lang=None
+    ) -> tuple[Optional[str], Optional[str]]:
+        if compute_type:
+            raise ValueError(f"{self.name} has no compute type choice")
+        model_size = model_size or whisper_default_model()
+        _check_model_size(model_size, whisper.available_models() if whisper else [])
+        return model_size, None
+
+    def transcribe(
+        self,
+        path: str,
+        query_lang=None,
+        query_prompt=None,
+        query_audio_kind=None,
+        model_size=None,
+        compute_type=None,
+    ) -> str:
+        return transcribe_with_whisper(
+            path, query_lang, query_prompt, query_audio_kind, model_size
+        )
+
+    def load_audio(self, path: str):
+        # whisper takes 16 kHz float samples as well as a path; it only
+        # returns text, so the cut times need no mapping back
+        prepared = prepare_audio(path)
+        return prepared.samples if isinstance(prepared, PreparedAudio) else path
+
+    def close(self) -> None:
+        load_whisper_model.cache_clear()
+
+
+class AlibabaAsrBackend(TranscriptionBackend):
+    name = TranscriptionMethod.alibaba_asr_api.value
+    capabilities = Capabilities(local=False, max_concurrency=8)
+
+    def transcribe(
+        self,
+        path: str,
+        query_lang=None,
+        query_prompt=None,
+        query_audio_kind=None,
+        model_size=None,
+        compute_type=None,
+    ) -> str:
+        # the api bills per second of audio, so it is sent as trimmed pcm
+        trimmed = prepare_pcm_file(path)
+        try:
+            return transcribe_with_alibaba_asr_api(trimmed or path)
+        finally:
+            if trimmed:
+                os.remove(trimmed)
+
+    async def atranscribe(
+        self, path: str, query_lang=None, query_prompt=None, query_audio_kind=None
+    ) -> str:
+        trimmed = await asyncio.to_thread(prepare_pcm_file, path)
+        try:
+            return await atranscribe_with_alibaba_asr_api(trimmed or path)
+        finally:
+            if trimmed:
+                os.remove(trimmed)
+
+
+class DummyTranscriptionBackend(TranscriptionBackend):
+    name = TranscriptionMethod.dummy.value
+    capabilities = Capabilities(local=False, max_concurrency=64)
+
+    def transcribe(
+        self,
+        path: str,
+        query_lang=None,
+        query_prompt=None,
+        query_audio_kind=None,
+        model_size=None,
+        compute_type=None,
+    ) -> str:
+        return "dummy notes"
+
+    async def atranscribe(
+        self, path: str, query_lang=None, query_prompt=None, query_audio_kind=None
+    ) -> str:
+        return "dummy notes"
+
+
+transcription_backends = BackendRegistry[TranscriptionBackend]("transcription")
+for backend_class in (
+    WhisperBackend,
+    FasterWhisperBackend,
+    AlibabaAsrBackend,
+    DummyTranscriptionBackend,
+):
+    transcription_backends.register(backend_class())
+
+
+def get_transcription_backend(method: TranscriptionMethod) -> TranscriptionBackend:
+    return transcription_backends.get(method)
+
+
+def warmup_transcription_model(method: TranscriptionMethod) -> None:
+    """
+    Load the model used by `method` into this process, so the first request
+    does not pay for it. Methods without a local model are a no-op.
+    """
+    get_transcription_backend(method).warmup()
+
+
 def transcribe_mp3(
     path: str,
     method: TranscriptionMethod = TranscriptionMethod.alibaba_asr_api,
     query_lang=None,
     query_prompt=None,
     query_audio_kind=None,
+    model_size=None,
+    compute_type=None,
 ) -> str:
-    transcription = ""
+    return get_transcription_backend(method).transcribe(
+        path, query_lang, query_prompt, query_audio_kind, model_size, compute_type
+    )
 
-    if method == TranscriptionMethod.whisper:
-        transcription = transcribe_with_whisper(
-            path, query_lang, query_prompt, query_audio_kind
-        )
-    elif method == TranscriptionMethod.faster_whisper:
-        transcription = transcribe_with_faster_whisper_batched(
-            path, query_lang, query_prompt, query_audio_kind
-        )
-    elif method == TranscriptionMethod.alibaba_asr_api:
-        transcription = transcribe_with_alibaba_asr_api(path)
-    elif method == TranscriptionMethod.dummy:
-        transcription = "dummy notes"
-    else:
-        assert 0
 
-    return transcription
+def stream_transcription(
+    path: str,
+    method: TranscriptionMethod = TranscriptionMethod.alibaba_asr_api,
+    query_lang=None,
+    query_prompt=None,
+    query_audio_kind=None,
+    model_size=None,
+    compute_type=None,
+) -> Iterator[Union[str, Segment]]:
+    """
+    Yield the transcription piece by piece. Methods that cannot stream
+    yield their whole transcription once.
+    """
+    yield from get_transcription_backend(method).stream(
+        path, query_lang, query_prompt, query_audio_kind, model_size, compute_type
+    )
@@ -0,0 +1,139 @@
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from audio.preprocess import (
+    SAMPLE_RATE,
+    PreparedAudio,
+    TimeRemap,
+    decode_audio,
+    prepare_audio,
+    speech_spans,
+)
+from audio.timestamps import Segment, TimedTranscript
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_seconds() -> float:
+    # 0 keeps every file in one piece
+    return float(os.getenv("ASR_CHUNK_SECONDS", "0"))
+
+
+def chunk_overlap_seconds() -> float:
+    return float(os.getenv("ASR_CHUNK_OVERLAP_SECONDS", "2"))
+
+
+@dataclass
+class AudioChunk:
+    # decoded 16 kHz samples of the chunk, saved with np.save
+    path: str
+    # where the chunk's samples start in the (trimmed) audio, in seconds
+    offset: float
+    # the chunk owns the segments centered in [keep_start, keep_end), the
+    # rest of it is overlap with its neighbours
+    keep_start: float
+    keep_end: float
+
+
+def _cut_points(length: int, silences: np.ndarray, chunk_samples: int) -> list[int]:
+    # one cut near every multiple of chunk_samples, moved to the closest
+    # silence within a quarter chunk so no word is cut in half
+    cuts = []
+    for target in range(chunk_samples, length - chunk_samples // 2, chunk_samples):
+        cut = target
+        if len(silences):
+            nearest = int(silences[np.abs(silences - target).argmin()])
+            if abs(nearest - target) <= chunk_samples // 4:
+                cut = nearest
+        if cuts and cut <= cuts[-1]:
+            continue
+        cuts.append(cut)
+    return cuts
+
+
+def split_audio(path: str) -> Optional[tuple[list[AudioChunk], TimeRemap]]:
+    """
+    Split a recording longer than ASR_CHUNK_SECONDS into chunks cut at
+    silence, each overlapping its neighbours by ASR_CHUNK_OVERLAP_SECONDS, and
+    save them next to `path`. The audio is decoded and trimmed once here.
+    Returns None when the file is short enough to transcribe in one piece.
+    """
+    seconds = chunk_seconds()
+    if seconds <= 0 or decode_audio is None:
+        return None
+
+    prepared = prepare_audio(path)
+    if isinstance(prepared, PreparedAudio):
+        samples, remap = prepared.samples, prepared.remap
+        # the joins between kept spans are where silence was cut
+        silences = (remap.trimmed_starts[1:] * SAMPLE_RATE).astype(np.int64)
+    else:
+        samples = decode_audio(path, sampling_rate=SAMPLE_RATE)
+        remap = TimeRemap(np.zeros(1), np.zeros(1))
+        spans = speech_spans(samples)
+        silences = np.array(
+            [(a["end"] + b["start"]) // 2 for a, b in zip(spans, spans[1:])],
+            dtype=np.int64,
+        )
+
+    chunk_samples = int(seconds * SAMPLE_RATE)
+    if len(samples) < chunk_samples * 1.5:
+        return None
+
+    overlap = int(chunk_overlap_seconds() * SAMPLE_RATE)
+    bounds = [0, *_cut_points(len(samples), silences, chunk_samples), len(samples)]
+    chunks = []
+    for i, (keep_start, keep_end) in enumerate(zip(bounds, bounds[1:])):
+        start = max(0, keep_start - overlap)
+        end = min(len(samples), keep_end + overlap)
+        chunk_path = f"{path}.chunk{i}.npy"
+        np.save(chunk_path, samples[start:end])
+        chunks.append(
+            AudioChunk(
+                path=chunk_path,
+                offset=start / SAMPLE_RATE,
+                keep_start=keep_start / SAMPLE_RATE,
+                keep_end=keep_end / SAMPLE_RATE,
+            )
+        )
+    logger.info(
+        "split %.1fs of audio into %d chunks", len(samples) / SAMPLE_RATE, len(chunks)
+    )
+    return chunks, remap
+
+
+def chunk_segments(
+    chunk: AudioChunk, timings: Optional[bytes], remap: TimeRemap
+) -> list[Segment]:
+    """
+    The segments a chunk owns, in original file time. A segment in the
+    overlap is kept only by the chunk its middle falls in, so it is never
+    stitched in twice.
+    """
+    if timings is None:
+        return []
+
+    transcript = TimedTranscript(timings)
+    segments = []
+    for i in range(transcript.segment_count):
+        segment = transcript.segment(i)
+        segment.start += chunk.offset
+        segment.end += chunk.offset
+        for word in segment.words:
+            word.start += chunk.offset
+            word.end += chunk.offset
+
+        middle = (segment.start + segment.end) / 2
+        if chunk.keep_start <= middle < chunk.keep_end:
+            segments.append(remap.segment(segment))
+    return segments
+
+
+def remove_chunks(chunks: list[AudioChunk]) -> None:
+    for chunk in chunks:
+        if os.path.exists(chunk.path):
+            os.remove(chunk.path)
@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+from typing import Optional
+
+from audio.tuning import default_model
+
+try:
+    from faster_whisper.tokenizer import _LANGUAGE_CODES as LANGUAGE_CODES
+except ImportError:
+    LANGUAGE_CODES = ()
+
+logger = logging.getLogger(__name__)
+
+# names the ui and api clients send as query_lang, to whisper language codes
+LANGUAGE_NAMES = {
+    "english": "en",
+    "mandarin": "zh",
+    "chinese": "zh",
+    "simplified_chinese": "zh",
+    "traditional_chinese": "zh",
+    "cantonese": "yue",
+    "french": "fr",
+    "spanish": "es",
+    "portuguese": "pt",
+    "japanese": "ja",
+    "german": "de",
+    "korean": "ko",
+    "italian": "it",
+    "russian": "ru",
+    "arabic": "ar",
+    "hindi": "hi",
+    "dutch": "nl",
+    "turkish": "tr",
+    "vietnamese": "vi",
+    "indonesian": "id",
+}
+
+# values that mean the language is not known up front
+_UNKNOWN = ("", "auto", "unknown", "detect")
+
+# faster-whisper sizes that have an english-only version, which decodes
+# english faster and better than the multilingual model of the same size
+_ENGLISH_VARIANTS = ("tiny", "base", "small", "medium")
+
+
+def normalize_language(query_lang: Optional[str]) -> Optional[str]:
+    """
+    The whisper language code of `query_lang`, which may be a code (`en`) or
+    a name (`english`). None when it is unknown or asks for detection.
+    """
+    if query_lang is None:
+        return None
+    value = query_lang.strip().lower().replace("-", "_").replace(" ", "_")
+    if value in _UNKNOWN:
+        return None
+    if value in LANGUAGE_NAMES:
+        return LANGUAGE_NAMES[value]
+    if value in LANGUAGE_CODES or value in LANGUAGE_NAMES.values():
+        return value
+    logger.warning("unknown query_lang %r, the language will be detected", query_lang)
+    return None
+
+
+def load_language_models() -> dict[str, dict]:
+    """
+    Per language model table, language code to `model_size` and optionally
+    `compute_type`. With ASR_ENGLISH_MODEL=1 english goes to the english-only
+    variant of the default model; ASR_LANGUAGE_MODELS_FILE adds or overrides
+    entries, e.g.
+    `{"en": {"model_size": "distil-small.en"}, "ja": {"model_size": "small"}}`.
+    Every model in the table is loaded when a worker warms up.
+    """
+    if os.getenv("ASR_LANGUAGE_ROUTING", "1") != "1":
+        return {}
+
+    models = {}
+    default_size, _ = default_model()
+    # off by default: it is a second model in every worker, and one that may
+    # not be downloaded yet
+    if os.getenv("ASR_ENGLISH_MODEL", "0") == "1" and default_size in _ENGLISH_VARIANTS:
+        models["en"] = {"model_size": f"{default_size}.en"}
+
+    path = os.getenv("ASR_LANGUAGE_MODELS_FILE")
+    if path:
+        with open(path) as f:
+            models.update(json.load(f))
+    return models
+
+
+LANGUAGE_MODELS = load_language_models()
+
+
+def route_language(
+    language: Optional[str], compute_type: Optional[str] = None
+) -> tuple[Optional[str], Optional[str]]:
+    """
+    Model size and compute type for `language` from the table, None for
+    either one the table leaves to the deployment default.
+    """
+    entry = LANGUAGE_MODELS.get(language or "", {})
+    return entry.get("model_size"), compute_type or entry.get("compute_type")
+
+
+def routed_models() -> list[tuple[Optional[str], Optional[str]]]:
+    """
+    Every distinct model size and compute type `route_language` can return,
+    so workers can load them ahead of the first request.
+    """
+    models = []
+    for entry in LANGUAGE_MODELS.values():
+        model = (entry.get("model_size"), entry.get("compute_type"))
+        if model not in models:
+            models.append(model)
+    return models
@@ -0,0 +1,174 @@
+import logging
+import os
+import uuid
+from dataclasses import dataclass, replace
+from typing import Optional, Union
+
+import numpy as np
+
+from audio.timestamps import Segment, Word
+
+try:
+    from faster_whisper import decode_audio
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+except ImportError:
+    decode_audio, VadOptions, get_speech_timestamps = None, None, None
+
+logger = logging.getLogger(__name__)
+
+# every backend takes 16 kHz mono, and alibaba is sent raw pcm at this rate
+SAMPLE_RATE = 16000
+
+# longest clip faster-whisper decodes at once
+CLIP_SECONDS = 30
+
+
+def vad_trim_enabled() -> bool:
+    return os.getenv("AUDIO_VAD_TRIM", "1") == "1"
+
+
+def _vad_options() -> "VadOptions":
+    # silence longer than min_silence splits speech; each span keeps pad_ms of
+    # its silence on both sides, so a long pause shrinks to 2 * pad_ms instead
+    # of words running into each other
+    pad_ms = int(os.getenv("AUDIO_VAD_PAD_MS", "200"))
+    return VadOptions(
+        threshold=float(os.getenv("AUDIO_VAD_THRESHOLD", "0.5")),
+        min_silence_duration_ms=int(os.getenv("AUDIO_VAD_MIN_SILENCE_MS", "500")),
+        speech_pad_ms=pad_ms,
+        # a padded span must still fit in one clip
+        max_speech_duration_s=CLIP_SECONDS - 2 * pad_ms / 1000,
+    )
+
+
+class TimeRemap:
+    """
+    Maps times in trimmed audio back to the original file. Kept span `i`
+    starts at `trimmed_starts[i]` in the trimmed audio and at
+    `original_starts[i]` in the original, the audio between spans was cut.
+    """
+
+    def __init__(self, trimmed_starts: np.ndarray, original_starts: np.ndarray):
+        self.trimmed_starts = trimmed_starts
+        self.original_starts = original_starts
+
+    def to_original(self, time: float, end: bool = False) -> float:
+        # an end that falls on a cut belongs to the span before it
+        side = "left" if end else "right"
+        span = int(np.searchsorted(self.trimmed_starts, time, side=side)) - 1
+        span = max(span, 0)
+        return float(self.original_starts[span] + (time - self.trimmed_starts[span]))
+
+    def segment(self, segment: Segment) -> Segment:
+        return replace(
+            segment,
+            start=self.to_original(segment.start),
+            end=self.to_original(segment.end, end=True),
+            words=[
+                Word(
+                    self.to_original(word.start),
+                    self.to_original(word.end, end=True),
+                    word.word,
+                    word.probability,
+                )
+                for word in segment.words
+            ],
+        )
+
+
+@dataclass
+class PreparedAudio:
+    # 16 kHz mono float32 samples with the silence trimmed
+    samples: np.ndarray
+    remap: TimeRemap
+    # speech spans in `samples`, as faster-whisper clip timestamps
+    clips: list[dict]
+    original_seconds: float
+
+    @property
+    def seconds(self) -> float:
+        return len(self.samples) / SAMPLE_RATE
+
+
+def _clips(span_lengths: list[int]) -> list[dict]:
+    # pack consecutive spans of the trimmed audio into clips of at most
+    # CLIP_SECONDS, spans are already shorter than that
+    limit = CLIP_SECONDS * SAMPLE_RATE
+    clips = []
+    position = 0
+    for length in span_lengths:
+        if clips and position + length - clips[-1]["start"] <= limit:
+            clips[-1]["end"] = position + length
+        else:
+            clips.append({"start": position, "end": position + length})
+        position += length
+    return clips
+
+
+def speech_spans(samples: np.ndarray) -> list[dict]:
+    """
+    [start, end) sample ranges of speech in 16 kHz `samples`, padded with
+    AUDIO_VAD_PAD_MS of silence on each side.
+    """
+    return get_speech_timestamps(samples, _vad_options(), sampling_rate=SAMPLE_RATE)
+
+
+def prepare_audio(path: str) -> Union[PreparedAudio, str]:
+    """
+    Decode `path` once to 16 kHz mono and cut its silence with the Silero VAD
+    bundled with faster-whisper. Returns `path` itself when faster-whisper is
+    not installed or AUDIO_VAD_TRIM=0, so callers fall back to the raw file.
+    """
+    if decode_audio is None or not vad_trim_enabled():
+        return path
+
+    samples = decode_audio(path, sampling_rate=SAMPLE_RATE)
+    original_seconds = len(samples) / SAMPLE_RATE
+    spans = speech_spans(samples)
+    if not spans:
+        # nothing sounded like speech, let the model judge the whole file
+        spans = [{"start": 0, "end": len(samples)}]
+
+    lengths = [span["end"] - span["start"] for span in spans]
+    trimmed_starts = np.zeros(len(spans))
+    trimmed_starts[1:] = np.cumsum(lengths[:-1])
+    remap = TimeRemap(
+        trimmed_starts / SAMPLE_RATE,
+        np.array([span["start"] for span in spans]) / SAMPLE_RATE,
+    )
+
+    prepared = PreparedAudio(
+        samples=np.concatenate([samples[s["start"] : s["end"]] for s in spans]),
+        remap=remap,
+        clips=_clips(lengths),
+        original_seconds=original_seconds,
+    )
+    logger.info(
+        "trimmed %.1fs of silence from %.1fs of audio",
+        original_seconds - prepared.seconds,
+        original_seconds,
+    )
+    return prepared
+
+
+def write_pcm(prepared: PreparedAudio, path: str) -> str:
+    """
+    Write the trimmed audio as raw 16 bit little endian pcm, the format the
+    alibaba asr api is asked for.
+    """
+    pcm = (np.clip(prepared.samples, -1.0, 1.0) * 32767).astype("<i2")
+    with open(path, "wb") as f:
+        f.write(pcm.tobytes())
+    return path
+
+
+def prepare_pcm_file(path: str) -> Optional[str]:
+    """
+    Trim `path` into a pcm file next to it and return its path, or None when
+    trimming is off and the original file should be sent.
+    """
+    prepared = prepare_audio(path)
+    if isinstance(prepared, str):
+        return None
+    # unique, two transcriptions of the same file may run at once
+    return write_pcm(prepared, f"{path}.{uuid.uuid4().hex}.trimmed.pcm")
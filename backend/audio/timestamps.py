@@ -0,0 +1,176 @@
+import struct
+import zlib
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+# layout of an encoded transcript, all little endian:
+#   header: magic, version, segment count, word count, compressed text size
+#   float32 segment starts, float32 segment ends
+#   uint32 first word of every segment, plus the total word count
+#   float32 word starts, float32 word ends, float32 word probabilities
+#   uint32 text offsets of every segment and word, plus the text length
+#   zlib compressed utf-8 text of all segments, then all words
+_MAGIC = b"WTS"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<3sBIII")
+
+
+@dataclass
+class Word:
+    start: float
+    end: float
+    word: str
+    probability: float
+
+
+@dataclass
+class Segment:
+    start: float
+    end: float
+    text: str
+    words: list[Word] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        # the `[start -> end] text` line stored as transcription text
+        return f"[{self.start:.2f}s -> {self.end:.2f}s] {self.text}"
+
+
+@dataclass
+class TranscriptionResult:
+    text: str
+    # encoded segments and words, None for methods without timestamps
+    timings: Optional[bytes] = None
+
+
+def encode_segments(segments: list[Segment]) -> bytes:
+    """
+    Pack segments and their words into one compact blob, one array per
+    field, so a time range can be found without reading every word.
+    """
+    words = [word for segment in segments for word in segment.words]
+
+    first_word = np.zeros(len(segments) + 1, dtype="<u4")
+    first_word[1:] = np.cumsum([len(segment.words) for segment in segments])
+
+    texts = [segment.text for segment in segments] + [word.word for word in words]
+    encoded_texts = [text.encode("utf-8") for text in texts]
+    text_offsets = np.zeros(len(texts) + 1, dtype="<u4")
+    text_offsets[1:] = np.cumsum([len(text) for text in encoded_texts])
+    compressed = zlib.compress(b"".join(encoded_texts))
+
+    parts = [
+        _HEADER.pack(
+            _MAGIC, FORMAT_VERSION, len(segments), len(words), len(compressed)
+        ),
+        np.array([s.start for s in segments], dtype="<f4").tobytes(),
+        np.array([s.end for s in segments], dtype="<f4").tobytes(),
+        first_word.tobytes(),
+        np.array([w.start for w in words], dtype="<f4").tobytes(),
+        np.array([w.end for w in words], dtype="<f4").tobytes(),
+        np.array([w.probability for w in words], dtype="<f4").tobytes(),
+        text_offsets.tobytes(),
+        compressed,
+    ]
+    return b"".join(parts)
+
+
+class TimedTranscript:
+    """
+    Read side of `encode_segments`. The arrays are views into the blob, and
+    the text is only decompressed when a range of it is asked for.
+    """
+
+    def __init__(self, data: bytes):
+        magic, version, segment_count, word_count, compressed_size = (
+            _HEADER.unpack_from(data)
+        )
+        if magic != _MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not an encoded transcript of a known version")
+
+        offset = _HEADER.size
+
+        def take(dtype: str, count: int) -> np.ndarray:
+            nonlocal offset
+            array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes
+            return array
+
+        self.segment_starts = take("<f4", segment_count)
+        self.segment_ends = take("<f4", segment_count)
+        self.first_word = take("<u4", segment_count + 1)
+        self.word_starts = take("<f4", word_count)
+        self.word_ends = take("<f4", word_count)
+        self.word_probabilities = take("<f4", word_count)
+        self.text_offsets = take("<u4", segment_count + word_count + 1)
+        self._compressed = data[offset : offset + compressed_size]
+        self._text: Optional[bytes] = None
+
+    @property
+    def segment_count(self) -> int:
+        return len(self.segment_starts)
+
+    @property
+    def word_count(self) -> int:
+        return len(self.word_starts)
+
+    @property
+    def duration(self) -> float:
+        return float(self.segment_ends.max()) if self.segment_count else 0.0
+
+    def _text_at(self, index: int) -> str:
+        if self._text is None:
+            self._text = zlib.decompress(self._compressed)
+        start, end = self.text_offsets[index], self.text_offsets[index + 1]
+        return self._text[start:end].decode("utf-8")
+
+    def word(self, index: int) -> Word:
+        return Word(
+            start=round(float(self.word_starts[index]), 3),
+            end=round(float(self.word_ends[index]), 3),
+            word=self._text_at(self.segment_count + index),
+            probability=round(float(self.word_probabilities[index]), 4),
+        )
+
+    def segment(self, index: int, with_words: bool = True) -> Segment:
+        first, last = self.first_word[index], self.first_word[index + 1]
+        return Segment(
+            start=round(float(self.segment_starts[index]), 3),
+            end=round(float(self.segment_ends[index]), 3),
+            text=self._text_at(index),
+            words=[self.word(i) for i in range(first, last)] if with_words else [],
+        )
+
+    def segments_between(
+        self, start: float = 0.0, end: Optional[float] = None, with_words: bool = True
+    ) -> list[Segment]:
+        """
+        Segments overlapping [start, end), both bounds found by binary search.
+        """
+        # the first segment that ends after `start`; segment ends are sorted
+        # too, faster-whisper never overlaps segments
+        first = int(np.searchsorted(self.segment_ends, start, side="right"))
+        last = (
+            self.segment_count
+            if end is None
+            else int(np.searchsorted(self.segment_starts, end, side="left"))
+        )
+        return [self.segment(i, with_words) for i in range(first, last)]
+
+    def word_at(self, time: float) -> Optional[int]:
+        """
+        Index of the word spoken at `time`, or of the next one after it.
+        None past the last word.
+        """
+        index = int(np.searchsorted(self.word_ends, time, side="right"))
+        return index if index < self.word_count else None
+
+    def segment_of_word(self, index: int) -> int:
+        return int(np.searchsorted(self.first_word, index, side="right")) - 1
+
+    def to_text(self) -> str:
+        # the transcription text is derived from the timings
+        return "\n".join(
+            str(self.segment(i, with_words=False)) for i in range(self.segment_count)
+        )
@@ -0,0 +1,86 @@
+import json
+import os
+import platform
+from functools import lru_cache
+from typing import Optional
+
+# settings measured by worker/autotune.py, one entry per machine and model
+TUNING_FILE = os.getenv("ASR_TUNING_FILE", "./db_file/asr_tuning.json")
+
+
+def _cpu_name() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def machine_key(model_size: str, compute_type: str) -> str:
+    # tuned numbers only carry over to the same cpu, core count and model
+    return f"{_cpu_name()}|{os.cpu_count()}|{model_size}|{compute_type}"
+
+
+def _read() -> dict:
+    try:
+        with open(TUNING_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+@lru_cache(maxsize=None)
+def load_tuning(key: str) -> Optional[dict]:
+    return _read().get(key)
+
+
+def save_tuning(key: str, settings: dict) -> None:
+    tunings = _read()
+    tunings[key] = settings
+    os.makedirs(os.path.dirname(TUNING_FILE) or ".", exist_ok=True)
+    with open(TUNING_FILE, "w") as f:
+        json.dump(tunings, f, indent=2)
+    load_tuning.cache_clear()
+
+
+def default_model() -> tuple[str, str]:
+    # the deployment's faster-whisper model, requests may pick another one
+    return (
+        os.getenv("FASTER_WHISPER_MODEL", "tiny"),
+        os.getenv("FASTER_WHISPER_COMPUTE_TYPE", "int8"),
+    )
+
+
+def tuned_setting(env_name: str, name: str, default: int) -> int:
+    """
+    An explicitly set `env_name` wins, then the value tuned for this machine
+    and the default model, then `default`.
+    """
+    value = os.getenv(env_name)
+    if value:
+        return int(value)
+    tuning = load_tuning(machine_key(*default_model()))
+    if tuning and name in tuning:
+        return int(tuning[name])
+    return default
+
+
+def asr_pool_workers() -> int:
+    return tuned_setting("ASR_POOL_WORKERS", "num_workers", 1)
+
+
+def asr_batch_size() -> int:
+    return tuned_setting("ASR_BATCH_SIZE", "batch_size", 16)
+
+
+def asr_cpu_threads() -> int:
+    # split the cores between the pool workers instead of every worker
+    # starting its own full set of threads
+    return tuned_setting(
+        "ASR_CPU_THREADS",
+        "cpu_threads",
+        max(1, (os.cpu_count() or 1) // asr_pool_workers()),
+    )
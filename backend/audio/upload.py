@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import os
+import uuid
+import zipfile
+from dataclasses import dataclass
+
+from fastapi import UploadFile
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class SavedUpload:
+    path: str
+    filename: str
+    sha256: str
+    size_bytes: int
+
+
+def _unique_path(upload_dir: str, filename: str) -> str:
+    # only keep the base name so a crafted filename cannot leave upload_dir,
+    # and prefix it so uploads with the same name do not overwrite each other
+    return os.path.join(upload_dir, f"{uuid.uuid4().hex}_{os.path.basename(filename)}")
+
+
+async def save_upload(
+    file: UploadFile, upload_dir: str, chunk_size: int = CHUNK_SIZE
+) -> SavedUpload:
+    """
+    Copy an upload to a uniquely named file in `upload_dir`, one chunk at a
+    time, hashing it on the way. The upload is read back from the temporary
+    file Starlette spooled it to while parsing the form, so it is never held in
+    memory at once. Disk writes run in a thread so the event loop keeps serving
+    other requests. A partial file is removed if the copy fails.
+    """
+    path = _unique_path(upload_dir, file.filename)
+    digest = hashlib.sha256()
+    size_bytes = 0
+
+    out = await asyncio.to_thread(open, path, "wb")
+    try:
+        while chunk := await file.read(chunk_size):
+            digest.update(chunk)
+            size_bytes += len(chunk)
+            await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        out.close()
+        os.remove(path)
+        raise
+    out.close()
+
+    return SavedUpload(
+        path=path,
+        filename=file.filename,
+        sha256=digest.hexdigest(),
+        size_bytes=size_bytes,
+    )
+
+
+# files inside a zip archive that are taken as recordings, the rest is skipped
+AUDIO_EXTENSIONS = {
+    ".aac",
+    ".flac",
+    ".m4a",
+    ".mka",
+    ".mkv",
+    ".mov",
+    ".mp3",
+    ".mp4",
+    ".oga",
+    ".ogg",
+    ".opus",
+    ".wav",
+    ".webm",
+    ".wma",
+}
+
+
+class BatchLimitError(Exception):
+    """
+    A batch with more files, or more bytes once unpacked, than allowed.
+    """
+
+
+def _audio_members(archive: zipfile.ZipFile) -> list[zipfile.ZipInfo]:
+    members = []
+    for member in archive.infolist():
+        filename = os.path.basename(member.filename)
+        # folders and the metadata macOS adds to its archives
+        if member.is_dir() or not filename or filename.startswith("."):
+            continue
+        if member.filename.startswith("__MACOSX/"):
+            continue
+        if os.path.splitext(filename)[1].lower() not in AUDIO_EXTENSIONS:
+            continue
+        members.append(member)
+    return members
+
+
+def count_zip_audio(zip_path: str) -> int:
+    """
+    Recordings in a zip archive, read from its directory without unpacking.
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        return len(_audio_members(archive))
+
+
+def _extract_zip(zip_path: str, upload_dir: str, max_bytes: int) -> list[SavedUpload]:
+    uploads = []
+    # every file written so far, removed again when unpacking fails
+    paths = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            members = _audio_members(archive)
+            # the sizes an archive states are checked before anything is
+            # written, and the bytes actually unpacked while writing
+            if sum(member.file_size for member in members) > max_bytes:
+                raise BatchLimitError(f"unpacks to more than {max_bytes} bytes")
+            written = 0
+            for member in members:
+                filename = os.path.basename(member.filename)
+                path = _unique_path(upload_dir, filename)
+                digest = hashlib.sha256()
+                size_bytes = 0
+                paths.append(path)
+                with archive.open(member) as src, open(path, "wb") as dst:
+                    while chunk := src.read(CHUNK_SIZE):
+                        written += len(chunk)
+                        if written > max_bytes:
+                            raise BatchLimitError(
+                                f"unpacks to more than {max_bytes} bytes"
+                            )
+                        digest.update(chunk)
+                        size_bytes += len(chunk)
+                        dst.write(chunk)
+                uploads.append(
+                    SavedUpload(
+                        path=path,
+                        filename=filename,
+                        sha256=digest.hexdigest(),
+                        size_bytes=size_bytes,
+                    )
+                )
+    except BaseException:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return uploads
+
+
+def remove_uploads(uploads: list[SavedUpload]) -> None:
+    for upload in uploads:
+        try:
+            os.remove(upload.path)
+        except FileNotFoundError:
+            pass
+
+
+def is_zip_upload(file: UploadFile) -> bool:
+    return (file.filename or "").lower().endswith(".zip") or file.content_type in (
+        "application/zip",
+        "application/x-zip-compressed",
+    )
+
+
+async def extract_zip_upload(
+    upload: SavedUpload, upload_dir: str, max_bytes: int
+) -> list[SavedUpload]:
+    """
+    Unpack the recordings of a saved zip archive, each one an upload of its
+    own, raising `BatchLimitError` past `max_bytes`. Nothing is left behind
+    when unpacking fails; the archive itself stays for the caller to remove.
+    """
+    return await asyncio.to_thread(_extract_zip, upload.path, upload_dir, max_bytes)
+
+
+async def aiter_file(path: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Read a file as an async stream of chunks, for request bodies that should
+    not be loaded into memory at once.
+    """
+    with open(path, "rb") as f:
+        while chunk := await asyncio.to_thread(f.read, chunk_size):
+            yield chunk
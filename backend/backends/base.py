@@ -0,0 +1,83 @@
+import os
+from dataclasses import dataclass
+from typing import Generic, Iterator, TypeVar
+
+
+@dataclass(frozen=True)
+class Capabilities:
+    # runs a model inside the process, so it needs a warm worker process;
+    # remote backends are called from the event loop instead
+    local: bool
+    # yields partial results while it runs
+    streaming: bool = False
+    # default number of calls the scheduler lets run at the same time
+    max_concurrency: int = 1
+    # yields timed `Segment`s, so a long file can be transcribed in chunks
+    # and stitched back together by time
+    timestamps: bool = False
+
+
+class Backend:
+    """
+    Shared interface of every transcription and notes provider.
+    Subclasses set `name` and `capabilities`, and implement the batch and
+    stream calls of their kind. Remote backends also implement the async calls.
+    """
+
+    name: str
+    capabilities: Capabilities
+
+    def warmup(self) -> None:
+        """Load models or open connections ahead of the first call."""
+
+    def close(self) -> None:
+        """Release whatever `warmup` or the calls acquired."""
+
+    @property
+    def max_concurrency(self) -> int:
+        # BACKEND_CONCURRENCY=faster_whisper=2,qwen_openrouter_api=8 overrides the default
+        for entry in os.getenv("BACKEND_CONCURRENCY", "").split(","):
+            name, _, limit = entry.partition("=")
+            if name.strip() == self.name and limit:
+                return int(limit)
+        return self.capabilities.max_concurrency
+
+
+B = TypeVar("B", bound=Backend)
+
+
+class BackendRegistry(Generic[B]):
+    """
+    Backends of one kind, keyed by their method name.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._backends: dict[str, B] = {}
+
+    def register(self, backend: B) -> B:
+        self._backends[backend.name] = backend
+        return backend
+
+    def get(self, name: str) -> B:
+        try:
+            return self._backends[str(getattr(name, "value", name))]
+        except KeyError:
+            raise ValueError(f"Unknown {self.kind} backend {name}")
+
+    def names(self) -> list[str]:
+        return list(self._backends)
+
+    def __iter__(self) -> Iterator[B]:
+        return iter(self._backends.values())
+
+    def describe(self) -> list[dict]:
+        return [
+            {
+                "name": backend.name,
+                "local": backend.capabilities.local,
+                "streaming": backend.capabilities.streaming,
+                "max_concurrency": backend.max_concurrency,
+            }
+            for backend in self
+        ]
@@ -0,0 +1,223 @@
+"""
+End to end latency benchmark: transcribe_mp3 then generate_notes_from_transcript
+over synthetic recordings, with OpenRouter and Alibaba replaced by a local stub.
+
+    python -m bench.benchmark --save-baseline      # on the base commit
+    python -m bench.benchmark                      # on the change, compares
+
+Exits with 1 when a metric regressed past --tolerance against the baseline.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from audio.preprocess import SAMPLE_RATE
+from bench.stub_server import StubServer
+
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+BASELINE_FILE = os.getenv("BENCH_BASELINE_FILE", "./db_file/benchmark_baseline.json")
+
+# transcription method : notes method pairs, the alibaba and openrouter
+# methods talk to the stub
+DEFAULT_SCENARIOS = "dummy:dummy,alibaba_asr_api:qwen_openrouter_api"
+
+# lower is better for every metric but throughput
+HIGHER_IS_BETTER = ("throughput",)
+
+# runs faster than this many seconds are too short to time, only their
+# memory is compared
+LATENCY_FLOOR = 0.005
+
+
+def write_synthetic_audio(path: str, seconds: float) -> None:
+    """
+    A 16 kHz wav of speech-like bursts, harmonics modulated at syllable rate,
+    with a second of silence every five so the VAD has something to cut.
+    """
+    rng = np.random.default_rng(int(seconds))
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = 120 + 30 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    syllables = 0.5 * (1 + np.sin(2 * np.pi * 4 * t))
+    samples = 0.2 * voice * syllables + 0.01 * rng.standard_normal(len(t))
+    samples[(t % 5) >= 4] = 0
+
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _run_pipeline(path: str, transcription_method: str, notes_method: str) -> float:
+    from audio.audio import transcribe_mp3
+    from model.model import generate_notes_from_transcript
+
+    started = time.perf_counter()
+    transcript = transcribe_mp3(path, transcription_method)
+    generate_notes_from_transcript(transcript, notes_method)
+    return time.perf_counter() - started
+
+
+def _run_scenario(
+    path: str,
+    seconds: float,
+    transcription_method: str,
+    notes_method: str,
+    runs: int,
+    clients: int,
+) -> dict:
+    # runs in a fresh process, so model loads and peak rss belong to this
+    # scenario alone
+    first_run = _run_pipeline(path, transcription_method, notes_method)
+    latencies = [
+        _run_pipeline(path, transcription_method, notes_method) for _ in range(runs)
+    ]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(
+            executor.map(
+                lambda _: _run_pipeline(path, transcription_method, notes_method),
+                range(clients * runs),
+            )
+        )
+    elapsed = time.perf_counter() - started
+
+    p50 = float(np.percentile(latencies, 50))
+    return {
+        "first_run": round(first_run, 4),
+        "p50": round(p50, 4),
+        "p95": round(float(np.percentile(latencies, 95)), 4),
+        # seconds of processing per second of audio
+        "rtf": round(p50 / seconds, 5),
+        # seconds of audio through the pipeline per second, `clients` at once
+        "throughput": round(clients * runs * seconds / elapsed, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_benchmark(
+    durations: list[float], scenarios: list[tuple[str, str]], runs: int, clients: int
+) -> dict[str, dict]:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, StubServer() as stub:
+        # read by the provider modules when the scenario process imports them
+        os.environ["OPENROUTER_URL"] = f"{stub.url}/api/v1/chat/completions"
+        os.environ["ALIBABA_ASR_URL"] = f"{stub.url}/stream/v1/asr"
+        os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+
+        for seconds in durations:
+            path = os.path.join(tmp, f"synthetic_{seconds:g}s.wav")
+            write_synthetic_audio(path, seconds)
+
+            for transcription_method, notes_method in scenarios:
+                key = f"{transcription_method}+{notes_method}@{seconds:g}s"
+                with ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context("spawn")
+                ) as executor:
+                    results[key] = executor.submit(
+                        _run_scenario,
+                        path,
+                        seconds,
+                        transcription_method,
+                        notes_method,
+                        runs,
+                        clients,
+                    ).result()
+                print(f"{key}: {results[key]}")
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    One line per metric that got worse than the baseline by more than
+    `tolerance` (a fraction).
+    """
+    regressions = []
+    for key, metrics in results.items():
+        old = baseline.get(key, {})
+        too_fast = max(metrics["p50"], old.get("p50", 0)) < LATENCY_FLOOR
+        for name, value in metrics.items():
+            before = old.get(name)
+            if value is None or before is None:
+                continue
+            if too_fast and name != "peak_rss_mb":
+                continue
+            if name in HIGHER_IS_BETTER:
+                worse = value < before * (1 - tolerance)
+            else:
+                worse = value > before * (1 + tolerance)
+            if worse:
+                regressions.append(f"{key} {name}: {before} -> {value}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--durations", default="10,60,300", help="audio seconds")
+    parser.add_argument(
+        "--scenarios",
+        default=DEFAULT_SCENARIOS,
+        help="comma separated transcription_method:notes_method pairs",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="runs per percentile")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent clients")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        [float(d) for d in args.durations.split(",")],
+        [tuple(s.split(":")) for s in args.scenarios.split(",")],
+        args.runs,
+        args.clients,
+    )
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved the baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, save one with --save-baseline")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for line in regressions:
+        print(f"regression {line}")
+    if not regressions:
+        print("no regressions against the baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+Local stand-in for OpenRouter and the Alibaba ASR api, so the benchmark
+measures this code and a fixed provider latency instead of the internet.
+"""
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from audio.preprocess import SAMPLE_RATE
+
+
+def stub_latency() -> float:
+    # seconds every stubbed provider call takes, on top of the per audio cost
+    return float(os.getenv("BENCH_STUB_LATENCY_MS", "50")) / 1000
+
+
+def stub_asr_realtime_factor() -> float:
+    # seconds the stubbed asr takes per second of audio it is sent
+    return float(os.getenv("BENCH_STUB_ASR_RTF", "0.02"))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if self.path.startswith("/api/v1/chat/completions"):
+            time.sleep(stub_latency())
+            payload = {
+                "choices": [{"message": {"content": f"# notes\n- {len(body)} bytes"}}]
+            }
+        elif self.path.startswith("/stream/v1/asr"):
+            # the body is 16 bit pcm, or the original file when not trimmed
+            seconds = len(body) / (2 * SAMPLE_RATE)
+            time.sleep(stub_latency() + seconds * stub_asr_realtime_factor())
+            payload = {"status": 20000000, "result": f"{seconds:.1f} seconds of audio"}
+        else:
+            self.send_error(404)
+            return
+
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """
+    The stub on a free localhost port, served from a background thread.
+    """
+
+    def __init__(self, port: int = 0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StubServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
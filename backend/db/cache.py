@@ -0,0 +1,180 @@
+from db.db_setup import CacheEntry, SessionLocal
+
+import hashlib
+import logging
+import os
+import threading
+from collections import Counter
+from typing import Optional
+
+from sqlalchemy import func
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPTION = "transcription"
+NOTES = "notes"
+# word timestamps of a cached transcription, base64 of the encoded blob
+TIMINGS = "timings"
+
+# hit / miss counters of this process, keyed by (kind, "hits" | "misses")
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def cache_enabled() -> bool:
+    return os.getenv("CACHE_ENABLED", "1") == "1"
+
+
+def _max_bytes() -> int:
+    return int(os.getenv("CACHE_MAX_MB", "256")) * 1024 * 1024
+
+
+def _hash_parts(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        value = "" if part is None else str(part)
+        # length prefix so ("ab", "c") and ("a", "bc") hash differently
+        digest.update(f"{len(value)}:{value}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def transcription_cache_key(
+    audio_hash: str,
+    method,
+    query_lang=None,
+    query_prompt=None,
+    query_audio_kind=None,
+    model_size=None,
+    compute_type=None,
+) -> str:
+    return _hash_parts(
+        TRANSCRIPTION,
+        audio_hash,
+        method,
+        query_lang,
+        query_prompt,
+        query_audio_kind,
+        model_size,
+        compute_type,
+    )
+
+
+def timings_cache_key(transcription_key: str) -> str:
+    return _hash_parts(TIMINGS, transcription_key)
+
+
+def notes_cache_key(transcript: str, method, query_prompt=None, mode=None) -> str:
+    transcript_hash = hashlib.sha256(transcript.encode("utf-8")).hexdigest()
+    return _hash_parts(NOTES, transcript_hash, method, query_prompt, mode)
+
+
+def _count(kind: str, outcome: str) -> None:
+    with _counters_lock:
+        _counters[(kind, outcome)] += 1
+
+
+def cache_get(kind: str, key: str) -> Optional[str]:
+    """
+    Return the cached value for `key`, or None on a miss.
+    """
+    if not cache_enabled():
+        return None
+
+    db = SessionLocal()
+    try:
+        entry = db.query(CacheEntry).filter(CacheEntry.key == key).first()
+        if entry is None:
+            _count(kind, "misses")
+            return None
+
+        entry.hits += 1
+        entry.last_used_time = func.now()
+        value = entry.value
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning("cache read failed: %s", e)
+        return None
+    finally:
+        db.close()
+
+    _count(kind, "hits")
+    return value
+
+
+def cache_put(kind: str, key: str, value: str) -> None:
+    """
+    Store `value` under `key`, then evict the least recently used entries
+    until the cache is back under CACHE_MAX_MB.
+    """
+    if not cache_enabled():
+        return
+
+    db = SessionLocal()
+    try:
+        size_bytes = len(value.encode("utf-8"))
+        entry = db.query(CacheEntry).filter(CacheEntry.key == key).first()
+        if entry:
+            entry.value = value
+            entry.size_bytes = size_bytes
+            entry.last_used_time = func.now()
+        else:
+            db.add(CacheEntry(key=key, kind=kind, value=value, size_bytes=size_bytes))
+        db.flush()
+
+        total = db.query(func.coalesce(func.sum(CacheEntry.size_bytes), 0)).scalar()
+        max_bytes = _max_bytes()
+        if total > max_bytes:
+            oldest = db.query(CacheEntry.key, CacheEntry.size_bytes).order_by(
+                CacheEntry.last_used_time, CacheEntry.created_time
+            )
+            evict = []
+            for entry_key, size_bytes in oldest:
+                if total <= max_bytes:
+                    break
+                evict.append(entry_key)
+                total -= size_bytes
+            db.query(CacheEntry).filter(CacheEntry.key.in_(evict)).delete()
+
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning("cache write failed: %s", e)
+    finally:
+        db.close()
+
+
+def cache_stats() -> dict:
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(
+                CacheEntry.kind,
+                func.count(CacheEntry.key),
+                func.coalesce(func.sum(CacheEntry.size_bytes), 0),
+            )
+            .group_by(CacheEntry.kind)
+            .all()
+        )
+    finally:
+        db.close()
+
+    stored = {kind: (entries, size) for kind, entries, size in rows}
+    with _counters_lock:
+        return {
+            kind: {
+                "hits": _counters[(kind, "hits")],
+                "misses": _counters[(kind, "misses")],
+                "entries": stored.get(kind, (0, 0))[0],
+                "size_bytes": stored.get(kind, (0, 0))[1],
+            }
+            for kind in (TRANSCRIPTION, TIMINGS, NOTES)
+        }
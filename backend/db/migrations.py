@@ -0,0 +1,239 @@
+from db.db_setup import Base, TranscriptTiming
+
+import logging
+from typing import Callable
+
+from sqlalchemy import (
+    Column,
+    Connection,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    func,
+    inspect,
+    text,
+)
+
+from db.search import setup_search_index
+
+logger = logging.getLogger(__name__)
+
+
+def _initial_schema(conn: Connection) -> None:
+    # an empty database gets the models of db_setup.py, the latest schema
+    Base.metadata.create_all(bind=conn)
+    setup_search_index(conn)
+
+
+# the tables as they were at version 1, frozen here: the models in db_setup.py
+# always describe the latest version, so creating those would run ahead of
+# the migrations that follow
+_v1 = MetaData()
+Table(
+    "audio_sessions",
+    _v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("session_name", String, nullable=False),
+    Column(
+        "created_time",
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    ),
+    Column("query_lang", String, nullable=False),
+    Column("query_file", String, nullable=False),
+    Column("query_prompt", String, nullable=False),
+    Column("query_audio_kind", String, nullable=False),
+    Index("ix_audio_sessions_created", "created_time", "id"),
+    Index("ix_audio_sessions_lang_created", "query_lang", "created_time", "id"),
+    Index("ix_audio_sessions_kind_created", "query_audio_kind", "created_time", "id"),
+)
+Table(
+    "outputs",
+    _v1,
+    Column("id", Integer, primary_key=True, index=True),
+    Column(
+        "created_time",
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    ),
+    Column("transcription_text", String, nullable=False),
+    Column("notes_text", String, nullable=False),
+    Column(
+        "audio_session_id",
+        Integer,
+        ForeignKey("audio_sessions.id"),
+        unique=True,
+        nullable=False,
+    ),
+)
+Table(
+    "jobs",
+    _v1,
+    Column("id", String, primary_key=True),
+    Column(
+        "created_time",
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    ),
+    Column(
+        "updated_time",
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    ),
+    Column("status", String, index=True, nullable=False),
+    Column(
+        "audio_session_id", Integer, ForeignKey("audio_sessions.id"), nullable=False
+    ),
+    Column("batch_id", String, index=True),
+    Column("file_path", String, nullable=False),
+    Column("audio_hash", String),
+    Column("query_file", String, nullable=False),
+    Column("transcription_method", String, nullable=False),
+    Column("notes_method", String, nullable=False),
+    Column("notes_mode", String, nullable=False),
+    Column("session_name", String, nullable=False),
+    Column("query_lang", String, nullable=False),
+    Column("query_prompt", String, nullable=False),
+    Column("query_audio_kind", String, nullable=False),
+    Column("transcription_text", String),
+    Column("notes_text", String),
+    Column("error", String),
+    Column("time_to_first_segment", Float),
+)
+Table(
+    "cache_entries",
+    _v1,
+    Column("key", String, primary_key=True),
+    Column("kind", String, index=True, nullable=False),
+    Column("value", String, nullable=False),
+    Column("size_bytes", Integer, nullable=False),
+    Column(
+        "created_time",
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    ),
+    Column(
+        "last_used_time",
+        DateTime(timezone=True),
+        server_default=func.now(),
+        index=True,
+        nullable=False,
+    ),
+    Column("hits", Integer, nullable=False),
+)
+
+
+def _baseline_schema(conn: Connection) -> None:
+    # databases from before migrations have some of these tables already,
+    # without the indexes added since, and are at version 0: whatever is
+    # missing is created, what is there is kept
+    _v1.create_all(bind=conn, checkfirst=True)
+    for table in _v1.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    setup_search_index(conn)
+
+
+def _add_column(conn: Connection, table: str, column: Column) -> None:
+    # a no-op when the column is there already, so an upgrade that ran
+    # before its version was stamped can run again
+    if column.name in {c["name"] for c in inspect(conn).get_columns(table)}:
+        return
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column.name} {column_type}"))
+
+
+def _job_model_columns(conn: Connection) -> None:
+    _add_column(conn, "jobs", Column("model_size", String))
+    _add_column(conn, "jobs", Column("compute_type", String))
+
+
+def _job_lease_columns(conn: Connection) -> None:
+    _add_column(conn, "jobs", Column("owner", String))
+    _add_column(conn, "jobs", Column("heartbeat_time", DateTime(timezone=True)))
+
+
+# (version, description, upgrade) in order. The schema version of a database
+# is kept in `PRAGMA user_version` on sqlite; every upgrade takes the schema
+# from the version before it to its own. Only ever append: released entries
+# must not change, a new column or index gets a new entry with its own
+# ALTER / CREATE.
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "initial schema", _baseline_schema),
+    (
+        2,
+        "word timestamps",
+        lambda conn: TranscriptTiming.__table__.create(conn, checkfirst=True),
+    ),
+    (3, "per job transcription model", _job_model_columns),
+    (4, "job leases", _job_lease_columns),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: Connection) -> int:
+    if conn.dialect.name == "sqlite":
+        return conn.execute(text("PRAGMA user_version")).scalar()
+
+    # other databases keep it in a one row table
+    conn.execute(
+        text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    )
+    return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def _set_schema_version(conn: Connection, version: int) -> None:
+    if conn.dialect.name == "sqlite":
+        # pragmas take no bound parameters, the version is always our own int
+        conn.execute(text(f"PRAGMA user_version = {int(version)}"))
+        return
+
+    conn.execute(text("DELETE FROM schema_version"))
+    conn.execute(
+        text("INSERT INTO schema_version (version) VALUES (:version)"),
+        {"version": version},
+    )
+
+
+def migrate(engine) -> int:
+    """
+    Bring the database to `LATEST_VERSION` and return that version.
+    An empty database gets the current schema in one go, an older one runs
+    each pending upgrade in its own transaction.
+    """
+    with engine.begin() as conn:
+        version = schema_version(conn)
+        tables = set(inspect(conn).get_table_names()) - {"schema_version"}
+        if version == 0 and not tables:
+            _initial_schema(conn)
+            _set_schema_version(conn, LATEST_VERSION)
+            logger.info("created database schema version %s", LATEST_VERSION)
+            return LATEST_VERSION
+
+    if version > LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than this code "
+            f"({LATEST_VERSION}), update the app before using this database"
+        )
+
+    for target, description, upgrade in MIGRATIONS:
+        if target <= version:
+            continue
+        with engine.begin() as conn:
+            logger.info("migrating database to version %s: %s", target, description)
+            upgrade(conn)
+            _set_schema_version(conn, target)
+        version = target
+
+    return version
@@ -0,0 +1,200 @@
+from db.db_setup import IS_SQLITE, AudioSession, Output
+
+import re
+from typing import Optional
+
+from sqlalchemy import Connection, case, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# full-text index over the outputs table. It is an external content table, so
+# the text is stored once in `outputs` and the triggers below keep the index
+# in sync with every insert, update and delete
+FTS_TABLE = "outputs_fts"
+FTS_COLUMNS = ("transcription_text", "notes_text")
+
+# markers around matches in snippets, stripped again into highlight offsets
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+
+SNIPPET_TOKENS = 16
+
+_SESSION_COLUMNS = [column.name for column in AudioSession.__table__.columns]
+
+_SETUP_STATEMENTS = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        transcription_text,
+        notes_text,
+        content='outputs',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS outputs_fts_insert AFTER INSERT ON outputs BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, transcription_text, notes_text)
+        VALUES (new.id, new.transcription_text, new.notes_text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS outputs_fts_delete AFTER DELETE ON outputs BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, transcription_text, notes_text)
+        VALUES ('delete', old.id, old.transcription_text, old.notes_text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS outputs_fts_update AFTER UPDATE ON outputs BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, transcription_text, notes_text)
+        VALUES ('delete', old.id, old.transcription_text, old.notes_text);
+        INSERT INTO {FTS_TABLE}(rowid, transcription_text, notes_text)
+        VALUES (new.id, new.transcription_text, new.notes_text);
+    END
+    """,
+]
+
+
+def setup_search_index(conn: Connection) -> None:
+    """
+    Create the FTS5 index and its triggers. An index created next to existing
+    outputs is filled from them once. FTS5 is sqlite only, other databases
+    search without an index.
+    """
+    if conn.dialect.name != "sqlite":
+        return
+
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": FTS_TABLE},
+    ).first()
+    for statement in _SETUP_STATEMENTS:
+        conn.execute(text(statement))
+    if not exists:
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def to_fts_query(search_text: str) -> Optional[str]:
+    """
+    Turn free text from the search box into an FTS5 query: every word must
+    match, the last one also as a prefix so results show up while typing.
+    FTS5 syntax in the input is quoted away instead of interpreted.
+    """
+    words = re.findall(r"\w+", search_text)
+    if not words:
+        return None
+
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _highlights(snippet: Optional[str]) -> Optional[dict]:
+    # turn the match markers into [start, end) character offsets in the
+    # clean snippet
+    if snippet is None:
+        return None
+
+    clean, highlights = [], []
+    start = None
+    position = 0
+    for char in snippet:
+        if char == _MATCH_START:
+            start = position
+        elif char == _MATCH_END:
+            if start is not None:
+                highlights.append([start, position])
+            start = None
+        else:
+            clean.append(char)
+            position += 1
+
+    return {"text": "".join(clean), "highlights": highlights}
+
+
+async def search_outputs(
+    db: AsyncSession,
+    search_text: str,
+    limit: int = 100,
+    fields: Optional[list[str]] = None,
+) -> list[dict]:
+    """
+    AudioSessions whose transcription or notes match `search_text`, best
+    BM25 match first then newest first, with a highlighted snippet per column.
+    """
+    query = to_fts_query(search_text)
+    if query is None:
+        return []
+    fields = fields or _SESSION_COLUMNS
+
+    if not IS_SQLITE:
+        return await _scan_outputs(db, search_text, limit, fields)
+
+    snippet_columns = ", ".join(
+        f"snippet({FTS_TABLE}, {i}, :start, :end, '…', {SNIPPET_TOKENS}) AS {column}"
+        for i, column in enumerate(FTS_COLUMNS)
+    )
+    statement = text(f"""
+        SELECT outputs.audio_session_id, bm25({FTS_TABLE}) AS rank, {snippet_columns}
+        FROM {FTS_TABLE}
+        JOIN outputs ON outputs.id = {FTS_TABLE}.rowid
+        JOIN audio_sessions ON audio_sessions.id = outputs.audio_session_id
+        WHERE {FTS_TABLE} MATCH :query
+        ORDER BY rank, audio_sessions.created_time DESC
+        LIMIT :limit
+        """)
+
+    rows = (
+        await db.execute(
+            statement,
+            {
+                "query": query,
+                "start": _MATCH_START,
+                "end": _MATCH_END,
+                "limit": limit,
+            },
+        )
+    ).all()
+
+    # only the requested columns, as plain rows instead of ORM objects
+    sessions = {
+        session.id: session._mapping
+        for session in await db.execute(
+            select(
+                AudioSession.id, *[getattr(AudioSession, field) for field in fields]
+            ).where(AudioSession.id.in_([row.audio_session_id for row in rows]))
+        )
+    }
+
+    return [
+        {
+            **{field: sessions[row.audio_session_id][field] for field in fields},
+            # bm25 is lower for better matches, flip it so higher is better
+            "score": -row.rank,
+            "snippets": {
+                column: _highlights(getattr(row, column)) for column in FTS_COLUMNS
+            },
+        }
+        for row in rows
+    ]
+
+
+async def _scan_outputs(
+    db: AsyncSession, search_text: str, limit: int, fields: list[str]
+) -> list[dict]:
+    # databases without FTS5: substring match, ranked by matching fields
+    pattern = f"%{search_text}%"
+    matches = [getattr(Output, column).ilike(pattern) for column in FTS_COLUMNS]
+    score = sum(case((match, 1), else_=0) for match in matches)
+
+    rows = await db.execute(
+        select(
+            *[getattr(AudioSession, field) for field in fields], score.label("score")
+        )
+        .join(Output)
+        .where(or_(*matches))
+        .order_by(score.desc(), AudioSession.created_time.desc())
+        .limit(limit)
+    )
+    return [
+        {**{field: row._mapping[field] for field in fields}, "score": row.score}
+        for row in rows
+    ]
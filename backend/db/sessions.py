@@ -0,0 +1,155 @@
+from db.db_setup import IS_SQLITE, AudioSession
+
+import base64
+import datetime
+import json
+from typing import Optional
+
+from sqlalchemy import String, and_, or_, select, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# columns a listing may project, in table order
+SESSION_FIELDS = [column.name for column in AudioSession.__table__.columns]
+
+# the keyset columns, always read so the next cursor can be built
+_KEY_FIELDS = ("created_time", "id")
+
+# created_time compared as the stored text on sqlite: it keeps it as a string,
+# and binding a parsed datetime back could differ from it in the fractional
+# seconds. Other databases store a real timestamp
+_created_text = (
+    type_coerce(AudioSession.created_time, String)
+    if IS_SQLITE
+    else AudioSession.created_time
+)
+
+
+def _time_bound(value: datetime.datetime):
+    """
+    `value` bound the way created_time is stored. On sqlite that is the UTC
+    text of CURRENT_TIMESTAMP, without fractions: a bound datetime would be
+    rendered with `.000000` and without its offset, which compares wrong on
+    whole seconds and in other time zones.
+    """
+    if not IS_SQLITE:
+        return value
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.isoformat(
+        sep=" ", timespec="microseconds" if value.microsecond else "seconds"
+    )
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def parse_fields(fields: Optional[str]) -> list[str]:
+    """
+    Columns requested as `id,session_name,...`, all of them when empty.
+    Raises `ValueError` on unknown names.
+    """
+    if not fields:
+        return list(SESSION_FIELDS)
+
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in SESSION_FIELDS]
+    if unknown:
+        raise ValueError(
+            f"Unknown fields {', '.join(unknown)}, "
+            f"choose from {', '.join(SESSION_FIELDS)}"
+        )
+    return requested
+
+
+def encode_cursor(created_time: str, session_id: int) -> str:
+    raw = json.dumps([created_time, session_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        created_time, session_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return str(created_time), int(session_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {e}")
+
+
+async def list_audio_sessions(
+    db: AsyncSession,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    fields: Optional[list[str]] = None,
+    query_lang: Optional[str] = None,
+    query_audio_kind: Optional[str] = None,
+    created_after: Optional[datetime.datetime] = None,
+    created_before: Optional[datetime.datetime] = None,
+) -> tuple[list[dict], Optional[str]]:
+    """
+    One page of AudioSessions, newest first, as plain dicts of the requested
+    `fields`. Pages are keyset paginated on (created_time, id), so every page
+    costs the same however deep it is. Returns the rows and the cursor of the
+    next page, None on the last page.
+    """
+    fields = fields or list(SESSION_FIELDS)
+    columns = [
+        getattr(AudioSession, field) for field in fields if field not in _KEY_FIELDS
+    ]
+
+    statement = select(_created_text.label("_created_text"), AudioSession.id, *columns)
+
+    if query_lang is not None:
+        statement = statement.where(AudioSession.query_lang == query_lang)
+    if query_audio_kind is not None:
+        statement = statement.where(AudioSession.query_audio_kind == query_audio_kind)
+    if created_after is not None:
+        statement = statement.where(_created_text >= _time_bound(created_after))
+    if created_before is not None:
+        statement = statement.where(_created_text < _time_bound(created_before))
+
+    if cursor is not None:
+        cursor_time, cursor_id = decode_cursor(cursor)
+        if not IS_SQLITE:
+            cursor_time = datetime.datetime.fromisoformat(cursor_time)
+        statement = statement.where(
+            or_(
+                _created_text < cursor_time,
+                and_(_created_text == cursor_time, AudioSession.id < cursor_id),
+            )
+        )
+
+    # one row more than asked tells whether there is a next page
+    statement = statement.order_by(
+        AudioSession.created_time.desc(), AudioSession.id.desc()
+    ).limit(limit + 1)
+
+    rows = (await db.execute(statement)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_time = rows[-1]._created_text
+        if isinstance(last_time, datetime.datetime):
+            last_time = last_time.isoformat()
+        next_cursor = encode_cursor(last_time, rows[-1].id)
+
+    sessions = []
+    for row in rows:
+        values = row._mapping
+        sessions.append(
+            {
+                field: (
+                    _parse_time(values["_created_text"])
+                    if field == "created_time"
+                    else values[field]
+                )
+                for field in fields
+            }
+        )
+    return sessions, next_cursor
+
+
+def _parse_time(value) -> Optional[datetime.datetime]:
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value
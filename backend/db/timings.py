@@ -0,0 +1,62 @@
+from db.db_setup import TranscriptTiming
+
+from dataclasses import asdict
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from audio.timestamps import TimedTranscript
+
+
+async def load_timed_transcript(
+    db: AsyncSession, audio_session_id: int
+) -> Optional[TimedTranscript]:
+    """
+    The word timestamps of a session, None when it has none (sessions
+    transcribed before they were kept, or by a method without them).
+    """
+    data = await db.scalar(
+        select(TranscriptTiming.data).where(
+            TranscriptTiming.audio_session_id == audio_session_id
+        )
+    )
+    return None if data is None else TimedTranscript(data)
+
+
+def timings_range(
+    transcript: TimedTranscript,
+    start: float = 0.0,
+    end: Optional[float] = None,
+    with_words: bool = True,
+) -> dict:
+    segments = transcript.segments_between(start, end, with_words)
+    return {
+        "duration": transcript.duration,
+        "segment_count": transcript.segment_count,
+        "word_count": transcript.word_count,
+        "segments": [{**asdict(segment), "line": str(segment)} for segment in segments],
+    }
+
+
+def timings_seek(
+    transcript: TimedTranscript,
+    time: Optional[float] = None,
+    word_index: Optional[int] = None,
+) -> Optional[dict]:
+    """
+    The word spoken at `time` (or the next one), or the word at `word_index`,
+    with the segment around it. None when there is no such word.
+    """
+    if word_index is None:
+        word_index = transcript.word_at(time or 0.0)
+    if word_index is None or not 0 <= word_index < transcript.word_count:
+        return None
+
+    segment_index = transcript.segment_of_word(word_index)
+    return {
+        "word_index": word_index,
+        "word": asdict(transcript.word(word_index)),
+        "segment_index": segment_index,
+        "segment": asdict(transcript.segment(segment_index)),
+    }
@@ -1,28 +1,104 @@
-from fastapi import FastAPI, File, HTTPException, Query, Request, UploadFile
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import (
+    Depends,
+    FastAPI,
+    File,
+    HTTPException,
+    Query,
+    Request,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
+    WebSocketException,
+    status,
+)
+from fastapi.requests import HTTPConnection
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
-import shutil
 import os
+import json
+import logging
+import asyncio
 import datetime
+import uuid
+import zipfile
+from contextlib import asynccontextmanager
 from typing import Optional
 from dotenv import load_dotenv
-from multiprocessing import Process, Queue
 from fastapi.middleware.cors import CORSMiddleware
 
-from sqlalchemy import desc, or_, case
 
-from audio.audio import TranscriptionMethod
-from model.model import NotesMethod
-
-from db.db_setup import AudioSession, Output, SessionLocal, setup_db
+from audio.audio import TranscriptionMethod, transcription_backends
+from audio.tuning import asr_pool_workers
+from audio.upload import (
+    BatchLimitError,
+    SavedUpload,
+    count_zip_audio,
+    extract_zip_upload,
+    is_zip_upload,
+    remove_uploads,
+    save_upload,
+)
+from model.model import NotesMethod, NotesMode, notes_backends, openrouter_router
+from providers.client import close_provider_clients
+from telemetry import metrics
+from telemetry.logs import configure_logging
+from telemetry.tracing import configure_tracing
+
+from db.db_setup import AudioSession, JobStatus, async_engine, get_db, setup_db
+from db.cache import cache_stats
+from db.search import search_outputs
+from db.sessions import InvalidCursorError, list_audio_sessions, parse_fields
+from db.timings import load_timed_transcript, timings_range, timings_seek
 from db.db_util import add_dummy_data, view_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
-
-app = FastAPI()
+from worker.admission import AdmissionController, AdmissionError, Reservation
+from worker.autotune import ensure_tuned
+from worker.jobs import JobRunner
+from worker.live import LiveSession, audio_session_exists
+from worker.pool import PoolFullError, TranscriptionWorkerPool
 
 load_dotenv(dotenv_path="./.env")
+# before the pool forks its workers, so they log the same way
+configure_logging()
+configure_tracing()
+logger = logging.getLogger(__name__)
+
+# warm transcription workers shared by every request, sized from ASR_POOL_* env vars
+transcription_pool = TranscriptionWorkerPool.from_env()
+# background transcription + notes jobs, persisted in the jobs table
+job_runner = JobRunner.from_env(transcription_pool)
+# queue bound, per-client rate limits and memory guard for new jobs
+admission = AdmissionController(job_runner)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # creates or migrates the database, existing sessions are kept
+    setup_db()
+    # ASR_AUTOTUNE=1 benchmarks this machine once, its worker count applies
+    # to the pool started right after
+    if await asyncio.to_thread(ensure_tuned):
+        transcription_pool.num_workers = asr_pool_workers()
+    transcription_pool.start()
+    await job_runner.start()
+    yield
+    await job_runner.stop()
+    transcription_pool.stop()
+    await close_provider_clients()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 allowed_origins = [os.getenv("CORS_ALLOW_ORIGIN"), "http://localhost:5173"]
 
@@ -32,6 +108,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # let the browser read the headers our routes return
+    expose_headers=["X-Job-Id", "X-Next-Cursor", "Retry-After"],
 )
 
 
@@ -44,29 +122,59 @@ async def root():
 # TODO: save to a db correctly, probably not can remove the tempfile and send the filename directly to the function
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+# most files a single batch upload may hold, zip contents included
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "200"))
+# most a batch's zip archives may unpack to, against zip bombs
+BATCH_MAX_UNPACKED_MB = int(os.getenv("BATCH_MAX_UNPACKED_MB", "4096"))
 
 
-# TODO: make it accept the query options to be used later
-def transcribe_worker(
-    q, file_path, method, query_lang=None, query_prompt=None, query_audio_kind=None
-):
-    from audio.audio import transcribe_mp3
-
-    result = transcribe_mp3(
-        file_path,
-        method,
-        query_lang=query_lang,
-        query_prompt=query_prompt,
-        query_audio_kind=query_audio_kind,
-    )
-    q.put(result)
-
-
-def notes_worker(q, transcription, method, query_prompt=None):
-    from model.model import generate_notes_from_transcript
+def resolve_transcription_model(
+    method: TranscriptionMethod, model_size=None, compute_type=None, query_lang=None
+) -> tuple[Optional[str], Optional[str]]:
+    """
+    Fill in the deployment's default model for `method`, or the one routed to
+    `query_lang`, 400 on a choice the method does not offer.
+    """
+    try:
+        return transcription_backends.get(method).resolve_model(
+            model_size, compute_type, query_lang
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def run_transcription(
+    file_path,
+    method,
+    query_lang=None,
+    query_prompt=None,
+    query_audio_kind=None,
+    model_size=None,
+    compute_type=None,
+) -> str:
+    """
+    Run a transcription on the warm worker pool without blocking the event loop.
+    """
+    try:
+        future = transcription_pool.submit(
+            file_path,
+            method,
+            query_lang=query_lang,
+            query_prompt=query_prompt,
+            query_audio_kind=query_audio_kind,
+            model_size=model_size,
+            compute_type=compute_type,
+        )
+    except PoolFullError:
+        raise HTTPException(
+            status_code=503, detail="Transcription queue is full, try again later"
+        )
 
-    result = generate_notes_from_transcript(transcription, method, query_prompt)
-    q.put(result)
+    try:
+        result = await asyncio.wrap_future(future)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Transcription failed: {e}")
+    return result.text
 
 
 # DEPRECATED: use only for local testing
@@ -74,6 +182,8 @@ def notes_worker(q, transcription, method, query_prompt=None):
 async def transcribe_audio(
     file: UploadFile = File(),
     method: TranscriptionMethod = Query(default=TranscriptionMethod.alibaba_asr_api),
+    model_size: Optional[str] = Query(default=None),
+    compute_type: Optional[str] = Query(default=None),
 ):
     """
     to check this route use this curl cmd with a sample file
@@ -83,35 +193,30 @@ async def transcribe_audio(
     ``
     """
 
-    print(f"transcribe_audio route called with {file=}, {method=}")
+    logger.info("transcribe_audio route called with %s, %s", file.filename, method)
 
     if file.filename is None:
         return JSONResponse(
             status_code=400, content={"error": "filename cannot be None"}
         )
-
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
+    model_size, compute_type = resolve_transcription_model(
+        method, model_size, compute_type
+    )
 
     # Save uploaded file to disk
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # Step 1: Run transcription in isolated process
-    transcribe_q = Queue()
-    transcribe_p = Process(
-        target=transcribe_worker, args=(transcribe_q, file_path, method)
-    )
-    transcribe_p.start()
-    transcribe_p.join()
+    with metrics.stage("upload", method):
+        upload = await save_upload(file, UPLOAD_DIR)
 
-    # Remove file
-    os.remove(file_path)
+    # Step 1: Run transcription on the worker pool
+    try:
+        transcription = await run_transcription(
+            upload.path, method, model_size=model_size, compute_type=compute_type
+        )
+    finally:
+        # Remove file
+        os.remove(upload.path)
 
-    if not transcribe_q.empty():
-        transcription = transcribe_q.get()
-        print(f"got the transcription {transcription=}")
-    else:
-        raise HTTPException(status_code=500, detail="Transcription failed")
+    logger.debug("transcribed %d characters", len(transcription))
 
     return {"transcription": transcription}
 
@@ -126,6 +231,7 @@ class TranscriptionInput(BaseModel):
 async def notes_from_transcription_text(
     input_data: TranscriptionInput,
     method: NotesMethod = Query(default=NotesMethod.qwen_openrouter_api),
+    mode: NotesMode = Query(default=NotesMode.single),
 ):
     """
     to check notes generation from transcription only
@@ -137,38 +243,146 @@ async def notes_from_transcription_text(
            }'
     ``
     """
-    print(f"hello from route {input_data.transcription_text=}")
+    try:
+        notes = await job_runner.generate_notes(
+            input_data.transcription_text, method, mode=mode
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Notes generation failed: {e}")
+
+    return {"notes": notes}
+
+
+class JobRead(BaseModel):
+    id: str
+    status: JobStatus
+    audio_session_id: int
+    created_time: datetime.datetime
+    updated_time: datetime.datetime
+    transcription_method: str
+    model_size: Optional[str] = None
+    compute_type: Optional[str] = None
+    notes_method: str
+    notes_mode: str
+    transcription_text: Optional[str] = None
+    notes_text: Optional[str] = None
+    error: Optional[str] = None
+    time_to_first_segment: Optional[float] = None
+
+    class Config:
+        from_attributes = True  # Pydantic v2
 
-    notes_q = Queue()
-    notes_p = Process(
-        target=notes_worker, args=(notes_q, input_data.transcription_text, method)
+
+def admit_client(
+    connection: HTTPConnection,
+    transcription_method: TranscriptionMethod,
+    notes_method: NotesMethod,
+    jobs: int = 1,
+) -> Reservation:
+    """
+    Room for new jobs of the client on `connection`, or `AdmissionError`.
+    """
+    local = (
+        transcription_backends.get(transcription_method).capabilities.local
+        or notes_backends.get(notes_method).capabilities.local
+    )
+    client = admission.client_key(
+        connection.client.host if connection.client else None,
+        connection.headers.get("X-Forwarded-For"),
     )
-    notes_p.start()
-    notes_p.join()
+    return admission.admit(client, jobs, local)
 
-    if not notes_q.empty():
-        notes = notes_q.get()
-    else:
-        raise HTTPException(status_code=500, detail="Notes generation failed")
 
-    return {"notes": notes}
+def admit_jobs(
+    request: Request,
+    transcription_method: TranscriptionMethod,
+    notes_method: NotesMethod,
+    jobs: int = 1,
+) -> Reservation:
+    """
+    Room for new jobs of the calling client, or a 429 / 503 with `Retry-After`.
+    """
+    try:
+        return admit_client(request, transcription_method, notes_method, jobs)
+    except AdmissionError as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+async def submit_job(
+    request: Request,
+    session_id: int,
+    file: UploadFile,
+    transcription_method: TranscriptionMethod,
+    notes_method: NotesMethod,
+    notes_mode: NotesMode,
+    session_name: str,
+    query_lang: str,
+    query_prompt: str,
+    query_audio_kind: str,
+    model_size: Optional[str] = None,
+    compute_type: Optional[str] = None,
+) -> str:
+    """
+    Save the upload and queue a transcription + notes job for it, if
+    admission control lets it in.
+    """
+    if file.filename is None:
+        raise HTTPException(status_code=400, detail="filename cannot be None")
+    model_size, compute_type = resolve_transcription_model(
+        transcription_method, model_size, compute_type, query_lang
+    )
+
+    with admit_jobs(request, transcription_method, notes_method):
+        # Save file to disk (do not delete later), hashed on the way for the cache
+        with metrics.stage("upload", transcription_method):
+            upload = await save_upload(file, UPLOAD_DIR)
+
+        try:
+            return await job_runner.submit(
+                audio_session_id=session_id,
+                file_path=upload.path,
+                audio_hash=upload.sha256,
+                query_file=upload.filename,
+                transcription_method=transcription_method,
+                notes_method=notes_method,
+                notes_mode=notes_mode,
+                session_name=session_name,
+                query_lang=query_lang,
+                query_prompt=query_prompt,
+                query_audio_kind=query_audio_kind,
+                model_size=model_size,
+                compute_type=compute_type,
+            )
+        except LookupError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
 @app.post("/api/transcribe-and-generate-notes/")
 async def transcribe_and_generate_notes(
+    request: Request,
     session_id: int = Query(...),
     file: UploadFile = File(...),
     transcription_method: TranscriptionMethod = Query(
         default=TranscriptionMethod.faster_whisper
     ),
     notes_method: NotesMethod = Query(default=NotesMethod.qwen_openrouter_api),
+    notes_mode: NotesMode = Query(default=NotesMode.single),
     session_name: str = Query(default="default-session-name"),
     query_lang: str = Query(default="en"),
     query_prompt: str = Query(default=""),
     query_audio_kind: str = Query(default="meeting"),
+    model_size: Optional[str] = Query(default=None),
+    compute_type: Optional[str] = Query(default=None),
 ):
     """
     Does both transcription and notes generation, and returns both.
+    Runs as a job (see `/api/jobs/`) and waits for it to finish.
     Usage:
     ``sh
     curl -X POST "localhost:5000/api/transcribe-and-generate-notes/?notes_method=dummy&transcription_method=dummy&session_id=XXX&session_name=XXX&query_lang=XXX" \
@@ -176,122 +390,518 @@ async def transcribe_and_generate_notes(
         -H "Content-Type: multipart/form-data"
     ``
     """
+    logger.info(
+        "transcribe_and_generate_notes route called with %s, session %s",
+        file.filename,
+        session_id,
+    )
+
+    job_id = await submit_job(
+        request,
+        session_id,
+        file,
+        transcription_method,
+        notes_method,
+        notes_mode,
+        session_name,
+        query_lang,
+        query_prompt,
+        query_audio_kind,
+        model_size,
+        compute_type,
+    )
+    job = await job_runner.wait(job_id)
+
+    if job.status != JobStatus.done:
+        raise HTTPException(status_code=500, detail=f"Job failed: {job.error}")
+
+    return {"transcription": job.transcription_text, "notes": job.notes_text}
+
+
+@app.post("/api/jobs/", status_code=202)
+async def create_job(
+    request: Request,
+    session_id: int = Query(...),
+    file: UploadFile = File(...),
+    transcription_method: TranscriptionMethod = Query(
+        default=TranscriptionMethod.faster_whisper
+    ),
+    notes_method: NotesMethod = Query(default=NotesMethod.qwen_openrouter_api),
+    notes_mode: NotesMode = Query(default=NotesMode.single),
+    session_name: str = Query(default="default-session-name"),
+    query_lang: str = Query(default="en"),
+    query_prompt: str = Query(default=""),
+    query_audio_kind: str = Query(default="meeting"),
+    model_size: Optional[str] = Query(default=None),
+    compute_type: Optional[str] = Query(default=None),
+):
+    """
+    Queue transcription and notes generation, and return the job id right away.
+    Poll `/api/jobs/{job_id}/` or wait on `/api/jobs/{job_id}/wait/` for the result.
+    ``sh
+    curl -X POST "localhost:5000/api/jobs/?notes_method=dummy&transcription_method=dummy&session_id=XXX" \
+        -F "file=@voice_sample.mp3"
+    ``
+    """
+    job_id = await submit_job(
+        request,
+        session_id,
+        file,
+        transcription_method,
+        notes_method,
+        notes_mode,
+        session_name,
+        query_lang,
+        query_prompt,
+        query_audio_kind,
+        model_size,
+        compute_type,
+    )
+    return {"job_id": job_id, "status": JobStatus.queued}
 
-    if not session_id:
-        raise HTTPException(
-            status_code=400, detail="Missing session_id in query parameters"
-        )
 
+@app.post("/api/batches/", status_code=202)
+async def create_batch(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    transcription_method: TranscriptionMethod = Query(
+        default=TranscriptionMethod.faster_whisper
+    ),
+    notes_method: NotesMethod = Query(default=NotesMethod.qwen_openrouter_api),
+    notes_mode: NotesMode = Query(default=NotesMode.single),
+    query_lang: str = Query(default="en"),
+    query_prompt: str = Query(default=""),
+    query_audio_kind: str = Query(default="meeting"),
+    model_size: Optional[str] = Query(default=None),
+    compute_type: Optional[str] = Query(default=None),
+):
+    """
+    Queue many recordings at once, one AudioSession and job per file. A zip
+    archive counts as all the files inside it. Follow the batch on
+    `/api/batches/{batch_id}/`.
+    ``sh
+    curl -X POST "localhost:5000/api/batches/?notes_method=dummy&transcription_method=dummy" \
+        -F "files=@monday_standup.mp3" -F "files=@recordings.zip"
+    ``
+    """
+    model_size, compute_type = resolve_transcription_model(
+        transcription_method, model_size, compute_type, query_lang
+    )
+
+    # every file as it was uploaded, zip archives flagged, and the recordings
+    # that become jobs; whatever no submitted job took is removed at the end
+    saved: list[tuple[SavedUpload, bool]] = []
+    uploads: list[SavedUpload] = []
+    submitted = set()
     try:
-        session_id = int(session_id)
-    except ValueError:
-        raise HTTPException(status_code=400, detail="session_id must be an integer")
+        for file in files:
+            if file.filename is None:
+                raise HTTPException(status_code=400, detail="filename cannot be None")
+            with metrics.stage("upload", transcription_method):
+                saved.append((await save_upload(file, UPLOAD_DIR), is_zip_upload(file)))
+
+        # a zip's recordings are counted from its directory, so a batch that is
+        # too big or turned away is refused before anything is unpacked
+        count = 0
+        for upload, zipped in saved:
+            try:
+                count += (
+                    await asyncio.to_thread(count_zip_audio, upload.path)
+                    if zipped
+                    else 1
+                )
+            except zipfile.BadZipFile as e:
+                raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+        if not count:
+            raise HTTPException(status_code=400, detail="No audio files in the batch")
+        if count > BATCH_MAX_FILES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"A batch holds at most {BATCH_MAX_FILES} files, got {count}",
+            )
+
+        with admit_jobs(request, transcription_method, notes_method, count):
+            budget = BATCH_MAX_UNPACKED_MB * 1024 * 1024
+            for upload, zipped in saved:
+                if not zipped:
+                    uploads.append(upload)
+                    continue
+                try:
+                    with metrics.stage("upload", transcription_method):
+                        unpacked = await extract_zip_upload(upload, UPLOAD_DIR, budget)
+                except BatchLimitError:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"A batch unpacks to at most {BATCH_MAX_UNPACKED_MB} MB",
+                    )
+                uploads.extend(unpacked)
+                budget -= sum(file.size_bytes for file in unpacked)
+
+            batch_id = uuid.uuid4().hex
+            jobs = []
+            try:
+                for upload in uploads:
+                    session_id = await job_runner.create_audio_session()
+                    job_id = await job_runner.submit(
+                        audio_session_id=session_id,
+                        file_path=upload.path,
+                        audio_hash=upload.sha256,
+                        query_file=upload.filename,
+                        transcription_method=transcription_method,
+                        notes_method=notes_method,
+                        notes_mode=notes_mode,
+                        session_name=os.path.splitext(upload.filename)[0],
+                        query_lang=query_lang,
+                        query_prompt=query_prompt,
+                        query_audio_kind=query_audio_kind,
+                        batch_id=batch_id,
+                        model_size=model_size,
+                        compute_type=compute_type,
+                    )
+                    submitted.add(upload.path)
+                    jobs.append(
+                        {
+                            "job_id": job_id,
+                            "audio_session_id": session_id,
+                            "query_file": upload.filename,
+                        }
+                    )
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    finally:
+        # the zip archives once unpacked, and everything after an error
+        remove_uploads(
+            [
+                upload
+                for upload in [*(upload for upload, _ in saved), *uploads]
+                if upload.path not in submitted
+            ]
+        )
 
-    print(f"transcribe_and_generate_notes route called with {file=}, {session_id}")
+    return {"batch_id": batch_id, "jobs": jobs}
 
-    if file.filename is None:
-        return JSONResponse(
-            status_code=400, content={"error": "filename cannot be None"}
+
+@app.get("/api/batches/{batch_id}/")
+async def get_batch(batch_id: str):
+    """
+    Aggregate progress of a batch: job counts per status, the finished share
+    and the state of every job in it.
+    ``sh
+    curl localhost:5000/api/batches/XXX/
+    ``
+    """
+    progress = await job_runner.batch_progress(batch_id)
+    if progress is None:
+        raise HTTPException(
+            status_code=404, detail=f"No batch found with id {batch_id}"
         )
+    return progress
 
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
 
-    # Save file to disk (do not delete later)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+def sse_event(event: str, data=None) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    # Step 1: Run transcription in isolated process
-    transcribe_q = Queue()
-    transcribe_p = Process(
-        target=transcribe_worker,
-        args=(
-            transcribe_q,
-            file_path,
-            transcription_method,
-            query_lang,
-            query_prompt,
-            query_audio_kind,
-        ),
+
+async def stream_job_events(job_id: str, events: Optional[asyncio.Queue] = None):
+    """
+    Yield a job's progress as Server-Sent Events until it finishes, from
+    `events` when already subscribed. A job that is already finished, or
+    running in another server process, only gets its final state.
+    """
+    if events is None:
+        events = job_runner.subscribe(job_id)
+
+    if events is None:
+        job = await job_runner.wait(job_id)
+        yield sse_event("status", job.status)
+        if job.transcription_text is not None:
+            yield sse_event("transcription", job.transcription_text)
+        if job.status == JobStatus.done:
+            yield sse_event("notes", job.notes_text)
+            yield sse_event("done")
+        else:
+            yield sse_event("failed", job.error)
+        return
+
+    try:
+        while True:
+            event, data = await events.get()
+            yield sse_event(event, data)
+            if event in ("done", "failed", "interrupted"):
+                return
+    finally:
+        job_runner.unsubscribe(job_id, events)
+
+
+@app.post("/api/transcribe-and-generate-notes/stream/")
+async def transcribe_and_generate_notes_stream(
+    request: Request,
+    session_id: int = Query(...),
+    file: UploadFile = File(...),
+    transcription_method: TranscriptionMethod = Query(
+        default=TranscriptionMethod.faster_whisper
+    ),
+    notes_method: NotesMethod = Query(default=NotesMethod.qwen_openrouter_api),
+    notes_mode: NotesMode = Query(default=NotesMode.single),
+    session_name: str = Query(default="default-session-name"),
+    query_lang: str = Query(default="en"),
+    query_prompt: str = Query(default=""),
+    query_audio_kind: str = Query(default="meeting"),
+    model_size: Optional[str] = Query(default=None),
+    compute_type: Optional[str] = Query(default=None),
+):
+    """
+    Same as `/api/transcribe-and-generate-notes/`, but streams Server-Sent Events:
+    one `segment` event per transcribed segment as soon as it is decoded,
+    a `metrics` event with the time to first segment, then `transcription`,
+    a `notes_token` event per piece of notes as the model writes it, `notes`
+    and `done` (or `failed`).
+    ``sh
+    curl -N -X POST "localhost:5000/api/transcribe-and-generate-notes/stream/?notes_method=dummy&transcription_method=faster_whisper&session_id=XXX" \
+        -F "file=@voice_sample.mp3"
+    ``
+    """
+    job_id = await submit_job(
+        request,
+        session_id,
+        file,
+        transcription_method,
+        notes_method,
+        notes_mode,
+        session_name,
+        query_lang,
+        query_prompt,
+        query_audio_kind,
+        model_size,
+        compute_type,
     )
-    transcribe_p.start()
-    transcribe_p.join()
-
-    if not transcribe_q.empty():
-        transcription = transcribe_q.get()
-        print(f"got the transcription {transcription=}")
-    else:
-        raise HTTPException(status_code=500, detail="Transcription failed")
-
-    # Step 2: Run notes generation in isolated process
-    notes_q = Queue()
-    notes_p = Process(
-        target=notes_worker, args=(notes_q, transcription, notes_method, query_prompt)
+    # subscribe now, the response body only starts once the job already runs
+    events = job_runner.subscribe(job_id)
+    return StreamingResponse(
+        stream_job_events(job_id, events),
+        media_type="text/event-stream",
+        headers={"X-Job-Id": job_id, "Cache-Control": "no-cache"},
     )
-    notes_p.start()
-    notes_p.join()
 
-    if not notes_q.empty():
-        notes = notes_q.get()
-    else:
-        raise HTTPException(status_code=500, detail="Notes generation failed")
 
-    # Database operations
-    db = SessionLocal()
+async def send_live_events(websocket: WebSocket, live: LiveSession) -> None:
+    while True:
+        event, data = await live.events.get()
+        try:
+            await websocket.send_json({"event": event, "data": data})
+        except (WebSocketDisconnect, RuntimeError):
+            # the client is gone, the session is still finished and stored
+            return
+        if event == "done":
+            return
+
+
+@app.websocket("/api/live-notes/")
+async def live_notes(
+    websocket: WebSocket,
+    session_id: int = Query(...),
+    transcription_method: TranscriptionMethod = Query(
+        default=TranscriptionMethod.faster_whisper
+    ),
+    notes_method: NotesMethod = Query(default=NotesMethod.qwen_openrouter_api),
+    session_name: str = Query(default="default-session-name"),
+    query_lang: str = Query(default="en"),
+    query_prompt: str = Query(default=""),
+    query_audio_kind: str = Query(default="meeting"),
+    model_size: Optional[str] = Query(default=None),
+    compute_type: Optional[str] = Query(default=None),
+    notes_every: Optional[int] = Query(default=None, ge=1),
+):
+    """
+    Notes of a recording while it is still going on. Send the audio as binary
+    messages of 16 kHz mono 16 bit little endian pcm, of any size, then the
+    text message `stop`. The server sends json `{"event", "data"}` messages:
+    `segment` per transcribed segment, `notes` with the whole updated draft
+    every `notes_every` segments (LIVE_NOTES_EVERY), `error` for a window or
+    update that failed, and `done` with the final transcription and notes,
+    which are stored on the session.
+    ``sh
+    websocat -b "ws://localhost:5000/api/live-notes/?session_id=XXX&notes_method=dummy" < meeting.pcm
+    ``
+    """
     try:
-        audio_session = (
-            db.query(AudioSession).filter(AudioSession.id == session_id).first()
+        model_size, compute_type = resolve_transcription_model(
+            transcription_method, model_size, compute_type, query_lang
+        )
+    except HTTPException as e:
+        raise WebSocketException(status.WS_1008_POLICY_VIOLATION, e.detail)
+    if not await asyncio.to_thread(audio_session_exists, session_id):
+        raise WebSocketException(
+            status.WS_1008_POLICY_VIOLATION,
+            f"No AudioSession found with id {session_id}",
         )
-        if not audio_session:
-            db.close()
-            raise HTTPException(
-                status_code=404, detail=f"No AudioSession found with id {session_id}"
-            )
 
-        # Update session fields
-        audio_session.session_name = session_name
-        audio_session.query_file = file.filename
-        audio_session.query_lang = query_lang
-        audio_session.query_prompt = query_prompt
-        audio_session.query_audio_kind = query_audio_kind
+    try:
+        reservation = admit_client(websocket, transcription_method, notes_method)
+    except AdmissionError as e:
+        raise WebSocketException(
+            status.WS_1013_TRY_AGAIN_LATER, f"{e}, retry after {e.retry_after}s"
+        )
 
-        # Check for existing output in this session
-        existing_output = (
-            db.query(Output).filter(Output.audio_session_id == audio_session.id).first()
+    # the session counts as a job against the queue until it ends
+    with reservation:
+        await websocket.accept()
+        live = LiveSession(
+            job_runner,
+            session_id,
+            transcription_method,
+            notes_method,
+            UPLOAD_DIR,
+            session_name=session_name,
+            query_lang=query_lang,
+            query_prompt=query_prompt,
+            query_audio_kind=query_audio_kind,
+            model_size=model_size,
+            compute_type=compute_type,
+            notes_every=notes_every,
         )
+        sender = asyncio.create_task(send_live_events(websocket, live))
+        connected = True
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    connected = False
+                    break
+                if message.get("bytes"):
+                    live.add_audio(message["bytes"])
+                elif message.get("text") == "stop":
+                    break
+            # a client that drops without `stop` still gets its meeting stored
+            await live.finish()
+        except Exception as e:
+            logger.exception("live notes for session %s failed", session_id)
+            await live.close()
+            sender.cancel()
+            if connected:
+                await websocket.close(status.WS_1011_INTERNAL_ERROR, str(e)[:120])
+            return
+
+        await sender
+        if connected:
+            await websocket.close()
+
+
+@app.get("/api/jobs/{job_id}/events/")
+async def get_job_events(job_id: str):
+    """
+    Follow a job's progress as Server-Sent Events.
+    ``sh
+    curl -N localhost:5000/api/jobs/XXX/events/
+    ``
+    """
+    if await job_runner.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
 
-        # Update existing output or create new if none exists
-        if existing_output:
-            existing_output.transcription_text = transcription
-            existing_output.notes_text = notes
-        else:
-            output = Output(
-                transcription_text=transcription,
-                notes_text=notes,
-                audio_session_id=audio_session.id,
-            )
-            db.add(output)
+    return StreamingResponse(
+        stream_job_events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/api/jobs/{job_id}/", response_model=JobRead)
+async def get_job(job_id: str):
+    """
+    Get the current status of a job, with its results once done.
+    ``sh
+    curl localhost:5000/api/jobs/XXX/
+    ``
+    """
+    job = await job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.get("/api/jobs/{job_id}/wait/", response_model=JobRead)
+async def wait_for_job(job_id: str, timeout: float = Query(default=30, ge=0, le=600)):
+    """
+    Wait up to `timeout` seconds for a job to finish, then return its status.
+    ``sh
+    curl "localhost:5000/api/jobs/XXX/wait/?timeout=60"
+    ``
+    """
+    job = await job_runner.wait(job_id, timeout)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.get("/api/workers/health/")
+async def get_workers_health():
+    """
+    Report the state of every transcription worker in the pool.
+    ``sh
+    curl localhost:5000/api/workers/health/
+    ``
+    """
+    return transcription_pool.health()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Stage timings, job counts, queue depth and pool workers in the Prometheus
+    text format, for a scraper.
+    ``sh
+    curl localhost:5000/metrics
+    ``
+    """
+    workers = transcription_pool.health()
+    metrics.QUEUE_DEPTH.set(transcription_pool.queue_depth())
+    metrics.JOBS_RUNNING.set(job_runner.running_jobs)
+    metrics.JOBS_QUEUED.set(job_runner.queued_jobs)
+    metrics.POOL_WORKERS.set(sum(w["alive"] for w in workers), state="alive")
+    metrics.POOL_WORKERS.set(sum(w["ready"] for w in workers), state="ready")
+    metrics.POOL_WORKERS.set(sum(w["busy"] for w in workers), state="busy")
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/api/backends/")
+async def get_backends():
+    """
+    List the registered transcription and notes backends with their capabilities,
+    and the stats the notes failover is steered by.
+    ``sh
+    curl localhost:5000/api/backends/
+    ``
+    """
+    return {
+        "transcription": transcription_backends.describe(),
+        "notes": notes_backends.describe(),
+        # recent calls, error rate and latency of each OpenRouter model
+        "notes_routing": openrouter_router.describe(),
+    }
 
-        # Commit changes (updates or new output)
-        db.commit()
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    db.close()
 
-    return {"transcription": transcription, "notes": notes}
+@app.get("/api/cache/stats/")
+async def get_cache_stats():
+    """
+    Hit / miss counters of this server process and stored size of the
+    transcription and notes caches.
+    ``sh
+    curl localhost:5000/api/cache/stats/
+    ``
+    """
+    return await asyncio.to_thread(cache_stats)
 
 
 @app.get("/api/audio-sessions/new/", response_model=int)
-async def create_empty_audio_session():
+async def create_empty_audio_session(db: AsyncSession = Depends(get_db)):
     """
     Create an empty AudioSession with default empty values and return its ID.
     ``sh
     curl -X GET localhost:5000/api/audio-sessions/new
     ``
     """
-    db = SessionLocal()
-    session_id = None
-
     try:
         # Create new session with empty required fields
         new_session = AudioSession(
@@ -303,19 +913,16 @@ async def create_empty_audio_session():
         )
 
         db.add(new_session)
-        db.commit()
-        db.refresh(new_session)  # Refresh to get the auto-generated ID
-
-        session_id = new_session.id
+        await db.commit()
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500, detail=f"Failed to create audio session: {str(e)}"
         )
 
-    db.close()
-    return session_id
+    # the auto-generated ID is set by the insert
+    return new_session.id
 
 
 class AudioSessionRead(BaseModel):
@@ -332,26 +939,50 @@ class AudioSessionRead(BaseModel):
 
 
 @app.get("/api/audio-sessions/")
-async def get_audio_sessions():
+async def get_audio_sessions(
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: Optional[str] = Query(default=None),
+    fields: Optional[str] = Query(default=None),
+    query_lang: Optional[str] = Query(default=None),
+    query_audio_kind: Optional[str] = Query(default=None),
+    created_after: Optional[datetime.datetime] = Query(default=None),
+    created_before: Optional[datetime.datetime] = Query(default=None),
+):
     """
-    Retrieve a list of all audio sessions with their details,
+    Retrieve a page of audio sessions with their details, newest first,
     excluding the output data.
+    `fields` picks the columns, e.g. `id,session_name,created_time`.
+    When there are more sessions, the `X-Next-Cursor` response header holds
+    the `cursor` of the next page.
     ``sh
-    curl localhost:5000/api/audio-sessions/
+    curl -i "localhost:5000/api/audio-sessions/?limit=20&fields=id,session_name&query_lang=en"
     ``
     """
-    # Query the database to get all AudioSession objects
-    db = SessionLocal()
-
     try:
-        sessions = db.query(AudioSession).all()
+        selected = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+    try:
+        sessions, next_cursor = await list_audio_sessions(
+            db,
+            limit=limit,
+            cursor=cursor,
+            fields=selected,
+            query_lang=query_lang,
+            query_audio_kind=query_audio_kind,
+            created_after=created_after,
+            created_before=created_before,
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed: {str(e)}")
 
-    db.close()
-
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
     return sessions
 
 
@@ -385,7 +1016,7 @@ class AudioSessionDetail(BaseModel):
 
 
 @app.get("/api/audio-sessions/{session_id}/", response_model=AudioSessionDetail)
-async def get_session_detail(session_id: int):
+async def get_session_detail(session_id: int, db: AsyncSession = Depends(get_db)):
     """
     Retrieve details for a specific audio session, including its output data,
     by the session's ID.
@@ -393,41 +1024,107 @@ async def get_session_detail(session_id: int):
     curl localhost:5000/api/audio-sessions/XX/
     ``
     """
-    db = SessionLocal()
-
     try:
         # Query the database for the specific AudioSession by its ID
         # Use joinedload to eagerly load the related 'output' data in the same query
-        # This avoids a separate query for the output data later (N+1 problem)
-        session = (
-            db.query(AudioSession)
+        # This avoids a separate query for the output data later (N+1 problem),
+        # and async sessions cannot lazy load it afterwards anyway
+        session = await db.scalar(
+            select(AudioSession)
             .options(joinedload(AudioSession.output))
-            .filter(AudioSession.id == session_id)
-            .first()
-        )  # Use .first() as ID should be unique
-
-        # If no session is found with the given ID, raise a 404 Not Found error
-        if session is None:
-            raise HTTPException(
-                status_code=404, detail=f"Audio session with id {session_id} not found"
-            )
-
+            .where(AudioSession.id == session_id)
+        )
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed: {str(e)}")
 
-    db.close()
+    # If no session is found with the given ID, raise a 404 Not Found error
+    if session is None:
+        raise HTTPException(
+            status_code=404, detail=f"Audio session with id {session_id} not found"
+        )
 
     # FastAPI will automatically serialize the 'session' object
     # using the 'AudioSessionDetail' Pydantic model, including the nested 'output'.
     return session
 
 
+async def _timed_transcript(db: AsyncSession, session_id: int):
+    try:
+        transcript = await load_timed_transcript(db, session_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed: {str(e)}")
+    if transcript is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Audio session with id {session_id} has no word timestamps",
+        )
+    return transcript
+
+
+@app.get("/api/audio-sessions/{session_id}/timings/")
+async def get_session_timings(
+    session_id: int,
+    start: float = Query(default=0.0, ge=0),
+    end: Optional[float] = Query(default=None, ge=0),
+    words: bool = Query(default=True),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Segments of a session's transcription overlapping [start, end) seconds,
+    with the start, end and probability of every word.
+    ``sh
+    curl "localhost:5000/api/audio-sessions/XX/timings/?start=60&end=90"
+    ``
+    """
+    transcript = await _timed_transcript(db, session_id)
+    return timings_range(transcript, start, end, words)
+
+
+@app.get("/api/audio-sessions/{session_id}/timings/seek/")
+async def seek_session_timings(
+    session_id: int,
+    t: Optional[float] = Query(default=None, ge=0),
+    word_index: Optional[int] = Query(default=None, ge=0),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    The word spoken at `t` seconds (or the next one), or the word at
+    `word_index`, with its segment.
+    ``sh
+    curl "localhost:5000/api/audio-sessions/XX/timings/seek/?t=75.5"
+    ``
+    """
+    transcript = await _timed_transcript(db, session_id)
+    word = timings_seek(transcript, t, word_index)
+    if word is None:
+        raise HTTPException(status_code=404, detail="No word at that position")
+    return word
+
+
+@app.get("/api/audio-sessions/{session_id}/timings/text/")
+async def get_session_timings_text(session_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    The `[start -> end] text` transcription, derived from the timestamps.
+    ``sh
+    curl localhost:5000/api/audio-sessions/XX/timings/text/
+    ``
+    """
+    transcript = await _timed_transcript(db, session_id)
+    return PlainTextResponse(transcript.to_text())
+
+
 @app.get("/api/outputs/search/")
-async def search_audio_sessions(search_text: str = Query(..., min_length=1)):
+async def search_audio_sessions(
+    search_text: str = Query(..., min_length=1),
+    limit: int = Query(default=100, ge=1, le=1000),
+    fields: Optional[str] = Query(default=None),
+    db: AsyncSession = Depends(get_db),
+):
     """
     Search audio sessions by text in transcription or notes
-    Returns list of AudioSessions that contain the search text in their output
+    Returns list of AudioSessions that contain the search text in their output,
+    best match first, each with a `score` and highlighted `snippets`.
+    `fields` picks the session columns like on `/api/audio-sessions/`
     ``sh
     curl "localhost:5000/api/outputs/search/?search_text=XXX"
     ``
@@ -435,50 +1132,16 @@ async def search_audio_sessions(search_text: str = Query(..., min_length=1)):
     if not search_text.strip():
         return []
 
-    db = SessionLocal()
-
-    search_pattern = f"%{search_text}%"
-
-    # Calculate match score (1 point per matching field)
-    field_score = case(
-        (
-            Output.transcription_text.ilike(search_pattern),
-            1,
-        ),
-        else_=0,
-    ) + case(
-        (
-            Output.notes_text.ilike(search_pattern),
-            1,
-        ),
-        else_=0,
-    )
+    try:
+        selected = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     try:
-        results = (
-            db.query(AudioSession)
-            .join(Output)
-            .filter(
-                or_(
-                    Output.transcription_text.ilike(search_pattern),
-                    Output.notes_text.ilike(search_pattern),
-                )
-            )
-            # TODO: this is a diy method to get ranking - change to good method later
-            .order_by(
-                desc(field_score),  # Primary sort: most matching fields
-                desc(AudioSession.created_time),  # Secondary sort: newest first
-            )
-            .all()
-        )
+        return await search_outputs(db, search_text, limit, selected)
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed: {str(e)}")
 
-    db.close()
-
-    return results
-
 
 # TODO: sometimes all of these fails - there could be redundancy too,  modify later
 frontend_dist = os.path.join(os.path.dirname(__file__), "..", "frontend", "dist")
@@ -502,11 +1165,13 @@ if __name__ == "__main__":
     import sys
     import os
 
-    # Run the DB setup (this will create tables)
+    # Run the DB setup (creates or migrates the tables, keeps the data)
     setup_db()
 
-    add_dummy_data()
-    view_db()
+    # sample sessions and a dump of the db, for local development only
+    if "--dev" in sys.argv:
+        add_dummy_data()
+        view_db()
 
     is_prod = "--prod" in sys.argv
     host = "0.0.0.0" if is_prod else "localhost"
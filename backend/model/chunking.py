@@ -0,0 +1,135 @@
+import math
+import re
+from typing import Callable
+
+# rough averages with the tokenizers our models use, good enough to size
+# windows without loading a tokenizer: english and other ascii text
+CHARS_PER_TOKEN = 4
+# accented latin, cyrillic, greek, arabic...
+NON_ASCII_CHARS_PER_TOKEN = 2
+
+# scripts written without spaces, about a token per character:
+# thai, hangul, cjk punctuation, kana, cjk ideographs and fullwidth forms
+_WIDE_CHARS = re.compile(
+    "[\u0e00-\u0e7f\u1100-\u11ff\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff"
+    "\uac00-\ud7af\uf900-\ufaff\uff00-\uffef\U00020000-\U0002ffff]"
+)
+_NON_ASCII_CHARS = re.compile("[^\x00-\x7f]")
+
+
+def estimate_tokens(text: str) -> int:
+    if text.isascii():
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    wide = len(_WIDE_CHARS.findall(text))
+    non_ascii = len(_NON_ASCII_CHARS.findall(text)) - wide
+    plain = len(text) - wide - non_ascii
+    return math.ceil(
+        plain / CHARS_PER_TOKEN + non_ascii / NON_ASCII_CHARS_PER_TOKEN + wide
+    )
+
+
+def _split_by_characters(
+    text: str, max_tokens: int, count_tokens: Callable[[str], int]
+) -> list[str]:
+    # the longest prefix that fits, found by bisection, then the same again
+    pieces, start = [], 0
+    while start < len(text):
+        low, high = start + 1, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(text[start:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        pieces.append(text[start:low])
+        start = low
+    return pieces
+
+
+def _split_long_line(
+    line: str, max_tokens: int, count_tokens: Callable[[str], int]
+) -> list[str]:
+    # a single segment over the budget is cut on word boundaries, and a word
+    # longer than a window, like a sentence of chinese, on characters
+    pieces, current = [], ""
+    for word in re.split("(?<= )", line):
+        if count_tokens(current + word) <= max_tokens:
+            current += word
+        elif current and count_tokens(word) <= max_tokens:
+            pieces.append(current.strip())
+            current = word
+        else:
+            # the last piece starts the next window
+            *full, current = _split_by_characters(
+                current + word, max_tokens, count_tokens
+            )
+            pieces.extend(piece.strip() for piece in full)
+    if current.strip():
+        pieces.append(current.strip())
+    return pieces
+
+
+def split_transcript(
+    transcript: str,
+    max_tokens: int,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+) -> list[str]:
+    """
+    Split a timestamped transcript into windows of at most `max_tokens`, as
+    counted by `count_tokens`. Windows only break between
+    `[start -> end] text` segment lines, so no segment is cut in half unless
+    it is longer than a window on its own.
+    """
+    windows, current, current_tokens = [], [], 0
+
+    for line in transcript.splitlines():
+        if not line.strip():
+            continue
+
+        line_tokens = count_tokens(line) + 1  # + newline
+        if line_tokens > max_tokens:
+            if current:
+                windows.append("\n".join(current))
+                current, current_tokens = [], 0
+            windows.extend(_split_long_line(line, max_tokens, count_tokens))
+            continue
+
+        if current and current_tokens + line_tokens > max_tokens:
+            windows.append("\n".join(current))
+            current, current_tokens = [], 0
+
+        current.append(line)
+        current_tokens += line_tokens
+
+    if current:
+        windows.append("\n".join(current))
+
+    return windows
+
+
+def group_partial_notes(
+    partial_notes: list[str],
+    max_tokens: int,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+) -> list[list[str]]:
+    """
+    Group consecutive partial notes so each group fits in `max_tokens`,
+    keeping at least one item per group.
+    """
+    groups, current, current_tokens = [], [], 0
+    for notes in partial_notes:
+        tokens = count_tokens(notes)
+        if current and current_tokens + tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(notes)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def format_partial_notes(partial_notes: list[str]) -> str:
+    return "\n\n".join(
+        f"--- Part {i} ---\n{notes}" for i, notes in enumerate(partial_notes, 1)
+    )
@@ -0,0 +1,155 @@
+try:
+    from llama_cpp import Llama
+except ImportError:
+    Llama = None
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# other models that work well:
+# ../gguf_models/Qwen2.5-7B-Instruct-Q5_K_M/qwen2.5-7b-instruct-q5_k_m.gguf
+# ../gguf_models/DeepSeek-R1-Distill-Qwen-7B-Q5_K_M.gguf
+DEFAULT_MODEL_PATH = "../gguf_models/DeepSeek-R1-Distill-Llama-8B-Q4_K_M.gguf"
+
+# settings shared by every model the registry loads
+DEFAULT_LLAMA_KWARGS = {
+    "n_gpu_layers": 32,  # Uncomment to use GPU acceleration
+    "n_ctx": 1024,  # Uncomment to increase the context window
+    "n_threads": 8,  # Matches your 8-core CPU
+    "n_threads_batch": 16,  # Utilize all 16 threads for batch processing
+    "n_batch": 512,  # Good balance for GPU memory (RTX 2060)
+    "seed": 1337,
+    "temperature": 0.4,  # More deterministic output for note-taking
+    "top_p": 0.9,  # Balanced creativity vs focus
+    "verbose": False,  # Disable verbose output unless debugging
+    # map the gguf file instead of reading it, so the OS page cache is shared
+    # between every process that loads the same model
+    "use_mmap": True,
+}
+
+
+class _LoadedModel:
+    def __init__(self, llm, size_bytes: int):
+        self.llm = llm
+        self.size_bytes = size_bytes
+        self.lock = threading.Lock()
+        # borrowers holding or waiting for the model, guarded by the registry lock
+        self.users = 0
+
+
+class LlamaRegistry:
+    """
+    Per-process cache of loaded GGUF models.
+    Each model is loaded once and shared by every later request. When loading
+    one more model would go over `memory_budget_bytes`, the least recently
+    used models that are not in use are evicted first.
+    """
+
+    def __init__(
+        self,
+        model_paths: Optional[list[str]] = None,
+        default_model: str = DEFAULT_MODEL_PATH,
+        memory_budget_bytes: int = 0,
+        llama_kwargs: Optional[dict] = None,
+    ):
+        self.default_model = default_model
+        self.model_paths = list(model_paths or [default_model])
+        if default_model not in self.model_paths:
+            self.model_paths.insert(0, default_model)
+        self.memory_budget_bytes = memory_budget_bytes
+        self.llama_kwargs = {**DEFAULT_LLAMA_KWARGS, **(llama_kwargs or {})}
+
+        self._models: OrderedDict[str, _LoadedModel] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "LlamaRegistry":
+        paths = os.getenv("LLAMA_MODEL_PATHS", "")
+        budget_mb = int(os.getenv("LLAMA_MEMORY_BUDGET_MB", "0"))
+        return cls(
+            model_paths=[p for p in paths.split(",") if p],
+            default_model=os.getenv("LLAMA_DEFAULT_MODEL", DEFAULT_MODEL_PATH),
+            memory_budget_bytes=budget_mb * 1024 * 1024,
+        )
+
+    @contextmanager
+    def use(self, model_path: Optional[str] = None) -> Iterator["Llama"]:
+        """
+        Borrow a loaded model, loading it first if needed.
+        A Llama instance is not thread safe, so callers of the same model
+        take turns.
+        """
+        loaded = self._get(model_path or self.default_model)
+        try:
+            with loaded.lock:
+                yield loaded.llm
+        finally:
+            with self._lock:
+                loaded.users -= 1
+
+    def prewarm(self, model_path: Optional[str] = None) -> None:
+        with self.use(model_path):
+            pass
+
+    def loaded_models(self) -> list[str]:
+        with self._lock:
+            return list(self._models)
+
+    def _get(self, model_path: str) -> _LoadedModel:
+        if model_path not in self.model_paths:
+            raise ValueError(
+                f"Model {model_path} is not configured in LLAMA_MODEL_PATHS"
+            )
+
+        with self._lock:
+            loaded = self._models.get(model_path)
+            if loaded is not None:
+                self._models.move_to_end(model_path)
+                loaded.users += 1
+                return loaded
+
+            if Llama is None:
+                raise ImportError("llama_cpp module is not installed.")
+
+            size_bytes = os.path.getsize(model_path)
+            self._evict_for(size_bytes)
+
+            logger.info("loading llama model %s", model_path)
+            loaded = _LoadedModel(
+                Llama(model_path=model_path, **self.llama_kwargs), size_bytes
+            )
+            self._models[model_path] = loaded
+            loaded.users += 1
+            return loaded
+
+    def _evict_for(self, size_bytes: int) -> None:
+        """
+        Drop least recently used idle models until `size_bytes` more fits in
+        the budget. Must be called with the registry lock held.
+        """
+        if not self.memory_budget_bytes:
+            return
+
+        used = sum(m.size_bytes for m in self._models.values())
+        for path in list(self._models):
+            if used + size_bytes <= self.memory_budget_bytes:
+                return
+            loaded = self._models[path]
+            # a model in use by another thread stays loaded
+            if loaded.users:
+                continue
+            logger.info(
+                "evicting llama model %s to stay within the memory budget", path
+            )
+            del self._models[path]
+            loaded.llm.close()
+            used -= loaded.size_bytes
+
+        if used + size_bytes > self.memory_budget_bytes:
+            logger.warning("llama models are over the memory budget, loading anyway")
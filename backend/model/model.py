@@ -1,58 +1,157 @@
-try:
-    from llama_cpp import Llama
-except ImportError:
-    Llama = None
-
 from enum import Enum
 
+import logging
 import os
 import json
-import requests
+import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Iterator, Optional
 from dotenv import load_dotenv
 
+from backends.base import Backend, BackendRegistry, Capabilities
+from model.chunking import (
+    estimate_tokens,
+    format_partial_notes,
+    group_partial_notes,
+    split_transcript,
+)
+from model.llama_registry import LlamaRegistry
+from model.routing import ProviderRouter
+from providers.client import (
+    get_async_provider_client,
+    get_credentials,
+    get_provider_client,
+)
+
+logger = logging.getLogger(__name__)
+
+# built-in OpenRouter notes methods. More models are config, not code: point
+# OPENROUTER_MODELS_FILE at a json file of entries with the same shape
+DEFAULT_OPENROUTER_MODELS = {
+    "deepseek_openrouter_api": {"model": "deepseek/deepseek-chat-v3-0324:free"},
+    "gemini_openrouter_api": {
+        "model": "google/gemini-2.0-flash-exp:free",
+        # gemini only takes the list form of message content
+        "content_parts": True,
+    },
+    "qwen_openrouter_api": {"model": "qwen/qwq-32b:free"},
+}
+
 
-# Enum for transcription method
-class NotesMethod(str, Enum):
-    llama_cpp_local = "llama_cpp_local"
-    deepseek_openrouter_api = "deepseek_openrouter_api"
-    gemini_openrouter_api = "gemini_openrouter_api"
-    qwen_openrouter_api = "qwen_openrouter_api"
-    dummy = "dummy"
-
-
-def generate_notes_from_transcript_llama_cpp_local(transcript: str) -> str:
-    if Llama is None:
-        raise ImportError("Whisper module is not installed.")
-
-    llm = Llama(
-        # model_path="../gguf_models/Qwen2.5-7B-Instruct-Q5_K_M/qwen2.5-7b-instruct-q5_k_m.gguf",
-        model_path="../gguf_models/DeepSeek-R1-Distill-Llama-8B-Q4_K_M.gguf",
-        # model_path="../gguf_models/DeepSeek-R1-Distill-Qwen-7B-Q5_K_M.gguf",
-        n_gpu_layers=32,  # Uncomment to use GPU acceleration
-        n_ctx=1024,  # Uncomment to increase the context window
-        n_threads=8,  # Matches your 8-core CPU
-        n_threads_batch=16,  # Utilize all 16 threads for batch processing
-        n_batch=512,  # Good balance for GPU memory (RTX 2060)
-        seed=1337,
-        temperature=0.4,  # More deterministic output for note-taking
-        top_p=0.9,  # Balanced creativity vs focus
-        verbose=False,  # Disable verbose output unless debugging
-    )
+def load_openrouter_models() -> dict[str, dict]:
+    load_dotenv()
+    models = dict(DEFAULT_OPENROUTER_MODELS)
+
+    models_file = os.getenv("OPENROUTER_MODELS_FILE")
+    if models_file:
+        with open(models_file) as f:
+            models.update(json.load(f))
+
+    return models
+
+
+OPENROUTER_MODELS = load_openrouter_models()
+
+
+@lru_cache(maxsize=None)
+def get_llama_registry() -> LlamaRegistry:
+    """
+    Process wide registry of loaded GGUF models, configured from LLAMA_* env vars.
+    """
+    load_dotenv()
+    return LlamaRegistry.from_env()
+
+
+def load_llama_models() -> dict[str, str]:
+    """
+    Notes method of every gguf file in LLAMA_MODEL_PATHS besides the default,
+    which is `llama_cpp_local`: `llama_cpp_local_` and the file name, e.g.
+    `llama_cpp_local_qwen2_5_7b_instruct_q5_k_m` for
+    `qwen2.5-7b-instruct-q5_k_m.gguf`.
+    """
+    registry = get_llama_registry()
+    models = {}
+    for path in registry.model_paths:
+        if path == registry.default_model:
+            continue
+        stem = os.path.splitext(os.path.basename(path))[0]
+        models["llama_cpp_local_" + re.sub(r"[^a-z0-9]+", "_", stem.lower())] = path
+    return models
+
+
+LLAMA_MODELS = load_llama_models()
+
+# Enum for notes method, with one member per configured OpenRouter model and
+# gguf file
+NotesMethod = Enum(
+    "NotesMethod",
+    {
+        "llama_cpp_local": "llama_cpp_local",
+        **{name: name for name in LLAMA_MODELS},
+        **{name: name for name in OPENROUTER_MODELS},
+        "dummy": "dummy",
+    },
+    type=str,
+    module=__name__,
+)
+
+
+class NotesMode(str, Enum):
+    # whole transcript in one prompt
+    single = "single"
+    # notes per transcript window, merged in a reduce step
+    map_reduce = "map_reduce"
+
+
+REDUCE_PROMPT = (
+    "The transcript is made of partial notes taken from consecutive parts of "
+    "one recording. Merge them into a single set of notes, in order, "
+    "without repeating points."
+)
+
+
+def warmup_notes_model() -> None:
+    """
+    Load the default llama model into this process when LLAMA_PREWARM is set,
+    so the first llama_cpp_local request does not pay for it.
+    """
+    load_dotenv()
+    if os.getenv("LLAMA_PREWARM", "0") != "1":
+        return
+
+    try:
+        get_llama_registry().prewarm()
+    except Exception as e:
+        logger.warning("could not prewarm the llama model: %s", e)
+
+
+def _llama_completion_args(transcript: str, query_prompt=None) -> dict:
+    user_requests = f"\n            - {query_prompt}" if query_prompt else ""
 
-    output = llm(
+    return dict(
         prompt=f"""Q: Convert the below transcription to organized notes
-        - just output the final notes - do not output your thinking
-        ---
-        {transcript}
-        ---
-        A: """,  # Prompt
+            - just output the final notes - do not output your thinking{user_requests}
+            ---
+            {transcript}
+            ---
+            A: """,  # Prompt
         max_tokens=1024,  # Generate up to 32 tokens, set to None to generate up to the end of the context window
         stop=[
             "Q:",
             # "\n\n",
         ],  # Stop generating just before the model would generate a new question
         echo=False,  # Echo the prompt back in the output
-    )  # Generate a completion, can also call create_completion
+    )
+
+
+def generate_notes_from_transcript_llama_cpp_local(
+    transcript: str, query_prompt=None, model_path: Optional[str] = None
+) -> str:
+    with get_llama_registry().use(model_path) as llm:
+        # Generate a completion, can also call create_completion
+        output = llm(**_llama_completion_args(transcript, query_prompt))
 
     if not isinstance(output, dict):
         raise TypeError(
@@ -62,18 +161,31 @@ def generate_notes_from_transcript_llama_cpp_local(transcript: str) -> str:
     return output["choices"][0]["text"]
 
 
-def generate_notes_from_transcript_deepseek_openrouter_api(
-    transcript: str, query_prompt=None
-) -> str:
-    load_dotenv()
+def stream_notes_from_transcript_llama_cpp_local(
+    transcript: str, query_prompt=None, model_path: Optional[str] = None
+) -> Iterator[str]:
+    # the model stays checked out of the registry until the last token
+    with get_llama_registry().use(model_path) as llm:
+        for chunk in llm(
+            **_llama_completion_args(transcript, query_prompt), stream=True
+        ):
+            text = chunk["choices"][0]["text"]
+            if text:
+                yield text
+
+
+OPENROUTER_URL = os.getenv(
+    "OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions"
+)
 
-    print(f"hello from openrouter deepseek api call, {transcript=}")
 
-    api_key = os.getenv("OPENROUTER_API_KEY")
+def _openrouter_request(
+    model: str, transcript: str, query_prompt=None, content_parts=False, stream=False
+) -> tuple[dict, dict]:
+    api_key = get_credentials().openrouter_api_key
     if not api_key:
         raise ValueError("OPENROUTER_API_KEY not found in .env")
 
-    url = "https://openrouter.ai/api/v1/chat/completions"
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
@@ -87,128 +199,441 @@ def generate_notes_from_transcript_deepseek_openrouter_api(
         f"Output only formatted notes:\n\nTranscript:{transcript}\nUser requests:{query_prompt}"
     )
 
+    # some models only take the list form of message content
+    content = [{"type": "text", "text": prompt}] if content_parts else prompt
     payload = {
-        "model": "deepseek/deepseek-chat-v3-0324:free",
-        "messages": [{"role": "user", "content": prompt}],
+        "model": model,
+        "messages": [{"role": "user", "content": content}],
     }
+    if stream:
+        payload["stream"] = True
+    return headers, payload
 
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
 
-    print(f"got {response=}")
-
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"].strip()
+def _openrouter_notes(status_code: int, body: str) -> str:
+    if status_code == 200:
+        return json.loads(body)["choices"][0]["message"]["content"].strip()
     else:
-        raise RuntimeError(f"Request failed: {response.status_code} - {response.text}")
+        raise RuntimeError(f"Request failed: {status_code} - {body}")
+
+
+def _openrouter_token(line: str) -> str:
+    """
+    The text of one line of an OpenRouter event stream, empty for keep-alive
+    comments and the closing `[DONE]`.
+    """
+    if not line.startswith("data:"):
+        return ""
+    data = line[len("data:") :].strip()
+    if data == "[DONE]":
+        return ""
+    chunk = json.loads(data)
+    # errors after the 200 arrive as a chunk of their own
+    if "error" in chunk:
+        raise RuntimeError(f"Stream failed: {chunk['error']}")
+    choices = chunk.get("choices") or [{}]
+    return choices[0].get("delta", {}).get("content") or ""
+
+
+def _routed_retries() -> Optional[int]:
+    """
+    Client retries for a call to one OpenRouter model. While other models
+    can stand in, the router moves on instead of waiting out retries.
+    """
+    if openrouter_router.settings.fallback and len(openrouter_router.providers) > 1:
+        return int(os.getenv("NOTES_ROUTED_RETRIES", "0"))
+    return None
+
+
+def _call_openrouter(
+    model: str, transcript: str, query_prompt=None, content_parts=False
+) -> str:
+    headers, payload = _openrouter_request(
+        model, transcript, query_prompt, content_parts
+    )
+    response = get_provider_client(_routed_retries()).post(
+        OPENROUTER_URL, headers=headers, data=json.dumps(payload)
+    )
 
+    logger.debug("openrouter %s answered %s", model, response.status_code)
 
-def generate_notes_from_transcript_gemini_openrouter_api(
-    transcript: str, query_prompt=None
+    return _openrouter_notes(response.status_code, response.text)
+
+
+async def _acall_openrouter(
+    model: str, transcript: str, query_prompt=None, content_parts=False
 ) -> str:
-    load_dotenv()
+    headers, payload = _openrouter_request(
+        model, transcript, query_prompt, content_parts
+    )
+    response = await get_async_provider_client(_routed_retries()).post(
+        OPENROUTER_URL, headers=headers, content=json.dumps(payload)
+    )
 
-    print(f"hello from openrouter gemini api call, {transcript=}")
+    logger.debug("openrouter %s answered %s", model, response.status_code)
 
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        raise ValueError("OPENROUTER_API_KEY not found in .env")
+    return _openrouter_notes(response.status_code, response.text)
 
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        # Optional headers
-        # "HTTP-Referer": "https://example.com",
-        # "X-Title": "Transcript Note Taker",
-    }
 
-    prompt = (
-        "Create structured English notes from this transcript using bullet points/headings. "
-        "Apply relevant formatting requests from user (if about organization/style). "
-        f"Output only formatted notes:\n\nTranscript:{transcript}\nUser requests:{query_prompt}"
+def _stream_openrouter(
+    model: str, transcript: str, query_prompt=None, content_parts=False
+) -> Iterator[str]:
+    headers, payload = _openrouter_request(
+        model, transcript, query_prompt, content_parts, stream=True
+    )
+    response = get_provider_client(_routed_retries()).post(
+        OPENROUTER_URL, headers=headers, data=json.dumps(payload), stream=True
     )
+    with response:
+        if response.status_code != 200:
+            _openrouter_notes(response.status_code, response.text)
+        # event streams are always utf-8, whatever the headers say
+        response.encoding = "utf-8"
+        for line in response.iter_lines(decode_unicode=True):
+            token = _openrouter_token(line)
+            if token:
+                yield token
+
+
+async def _astream_openrouter(
+    model: str, transcript: str, query_prompt=None, content_parts=False
+) -> AsyncIterator[str]:
+    headers, payload = _openrouter_request(
+        model, transcript, query_prompt, content_parts, stream=True
+    )
+    response = await get_async_provider_client(_routed_retries()).post(
+        OPENROUTER_URL, headers=headers, content=json.dumps(payload), stream=True
+    )
+    try:
+        if response.status_code != 200:
+            await response.aread()
+            _openrouter_notes(response.status_code, response.text)
+        async for line in response.aiter_lines():
+            token = _openrouter_token(line)
+            if token:
+                yield token
+    finally:
+        await response.aclose()
+
+
+class NotesBackend(Backend):
+    # transcript tokens per prompt in map_reduce mode, leaves room for the
+    # instructions and the answer in the model's context window
+    chunk_tokens: int = 8000
+
+    def count_tokens(self, text: str) -> int:
+        # an estimate, backends with a tokenizer at hand count exactly
+        return estimate_tokens(text)
+
+    def generate(self, transcript: str, query_prompt=None) -> str:
+        raise NotImplementedError
+
+    def stream(self, transcript: str, query_prompt=None) -> Iterator[str]:
+        # backends that cannot stream yield their whole notes once
+        yield self.generate(transcript, query_prompt)
+
+    async def agenerate(self, transcript: str, query_prompt=None) -> str:
+        raise NotImplementedError(f"{self.name} has no async notes generation")
+
+    async def astream(self, transcript: str, query_prompt=None) -> AsyncIterator[str]:
+        yield await self.agenerate(transcript, query_prompt)
+
+
+class LlamaCppBackend(NotesBackend):
+    capabilities = Capabilities(local=True, streaming=True, max_concurrency=1)
+    chunk_tokens = 384
+
+    def __init__(self, name: str = "llama_cpp_local", model_path: Optional[str] = None):
+        self.name = name
+        # None is the registry's default model
+        self.model_path = model_path
+
+    def warmup(self) -> None:
+        get_llama_registry().prewarm(self.model_path)
+
+    def count_tokens(self, text: str) -> int:
+        # windows are sized with the model's own tokenizer, the context is
+        # only n_ctx tokens and estimates are far off for some scripts
+        with get_llama_registry().use(self.model_path) as llm:
+            return len(llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def generate(self, transcript: str, query_prompt=None) -> str:
+        return generate_notes_from_transcript_llama_cpp_local(
+            transcript, query_prompt, self.model_path
+        )
 
-    payload = {
-        "model": "google/gemini-2.0-flash-exp:free",
-        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
-    }
+    def stream(self, transcript: str, query_prompt=None) -> Iterator[str]:
+        return stream_notes_from_transcript_llama_cpp_local(
+            transcript, query_prompt, self.model_path
+        )
 
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
 
-    print(f"got {response=}")
+class OpenRouterBackend(NotesBackend):
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        content_parts: bool = False,
+        chunk_tokens: int = 8000,
+        max_concurrency: int = 4,
+    ):
+        self.name = name
+        self.model = model
+        self.content_parts = content_parts
+        self.chunk_tokens = chunk_tokens
+        self.capabilities = Capabilities(
+            local=False, streaming=True, max_concurrency=max_concurrency
+        )
 
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"].strip()
-    else:
-        raise RuntimeError(f"Request failed: {response.status_code} - {response.text}")
+    # every call goes through the router, which may hand it to another
+    # OpenRouter model when this one fails or is slow
 
+    def generate(self, transcript: str, query_prompt=None) -> str:
+        return openrouter_router.call(
+            self.name, _on_openrouter_model(_call_openrouter, transcript, query_prompt)
+        )
 
-def generate_notes_from_transcript_qwen_openrouter_api(
-    transcript: str, query_prompt=None
-) -> str:
-    load_dotenv()
+    async def agenerate(self, transcript: str, query_prompt=None) -> str:
+        return await openrouter_router.acall(
+            self.name, _on_openrouter_model(_acall_openrouter, transcript, query_prompt)
+        )
 
-    print(f"hello from openrouter qwen api call, {transcript=}")
+    def stream(self, transcript: str, query_prompt=None) -> Iterator[str]:
+        return openrouter_router.stream(
+            self.name,
+            _on_openrouter_model(_stream_openrouter, transcript, query_prompt),
+        )
 
-    api_key = os.environ.get("OPENROUTER_API_KEY")
-    if not api_key:
-        raise ValueError("OPENROUTER_API_KEY not found in .env")
+    def astream(self, transcript: str, query_prompt=None) -> AsyncIterator[str]:
+        return openrouter_router.astream(
+            self.name,
+            _on_openrouter_model(_astream_openrouter, transcript, query_prompt),
+        )
 
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        # Optional headers
-        # "HTTP-Referer": "https://example.com",
-        # "X-Title": "Transcript Note Taker",
-    }
 
-    prompt = (
-        "Create structured English notes from this transcript using bullet points/headings. "
-        "Apply relevant formatting requests from user (if about organization/style). "
-        f"Output only formatted notes:\n\nTranscript:{transcript}\nUser requests:{query_prompt}"
-    )
+def _on_openrouter_model(call, transcript: str, query_prompt=None):
+    # `call` bound to the request, taking the name of the model to send it to
+    def on_model(name: str):
+        backend = notes_backends.get(name)
+        return call(backend.model, transcript, query_prompt, backend.content_parts)
 
-    payload = {
-        "model": "qwen/qwq-32b:free",
-        "messages": [{"role": "user", "content": prompt}],
-    }
-    print(f"request headers {headers=}")
+    return on_model
 
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
 
-    print(f"got {response=}")
+class DummyNotesBackend(NotesBackend):
+    name = "dummy"
+    capabilities = Capabilities(local=False, max_concurrency=64)
 
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"].strip()
-    else:
-        raise RuntimeError(f"Request failed: {response.status_code} - {response.text}")
+    def generate(self, transcript: str, query_prompt=None) -> str:
+        return "dummy transcript"
 
+    async def agenerate(self, transcript: str, query_prompt=None) -> str:
+        return "dummy transcript"
 
-def generate_notes_from_transcript(
+
+notes_backends = BackendRegistry[NotesBackend]("notes")
+notes_backends.register(LlamaCppBackend())
+for name, model_path in LLAMA_MODELS.items():
+    notes_backends.register(LlamaCppBackend(name, model_path))
+for name, config in OPENROUTER_MODELS.items():
+    notes_backends.register(OpenRouterBackend(name, **config))
+notes_backends.register(DummyNotesBackend())
+
+# the OpenRouter models stand in for each other, see NOTES_FALLBACK
+openrouter_router = ProviderRouter(list(OPENROUTER_MODELS))
+
+
+def get_notes_backend(method: NotesMethod) -> NotesBackend:
+    return notes_backends.get(method)
+
+
+async def agenerate_notes_from_transcript(
     transcript: str,
     method: NotesMethod = NotesMethod.deepseek_openrouter_api,
     query_prompt=None,
+    mode: NotesMode = NotesMode.single,
 ) -> str:
-    notes = ""
+    """
+    Async version of `generate_notes_from_transcript` for remote methods,
+    it calls the provider straight from the event loop.
+    """
+    backend = get_notes_backend(method)
+    if backend.capabilities.local:
+        raise ValueError(f"{method} does not run remotely")
+
+    if mode == NotesMode.map_reduce:
+        return await agenerate_notes_map_reduce(transcript, method, query_prompt)
+
+    return await backend.agenerate(transcript, query_prompt)
+
+
+def _map_reduce_settings(
+    method: NotesMethod,
+) -> tuple[int, int, Callable[[str], int]]:
+    backend = get_notes_backend(method)
+    max_tokens = int(os.getenv("NOTES_CHUNK_TOKENS", "0")) or backend.chunk_tokens
+    max_workers = int(os.getenv("NOTES_MAP_CONCURRENCY", "4"))
+    return max_tokens, max_workers, backend.count_tokens
+
+
+def _reduce_prompt(query_prompt=None) -> str:
+    if query_prompt:
+        return f"{REDUCE_PROMPT} {query_prompt}"
+    return REDUCE_PROMPT
+
 
-    if method == NotesMethod.llama_cpp_local:
-        notes = generate_notes_from_transcript_llama_cpp_local(transcript)
-    elif method == NotesMethod.deepseek_openrouter_api:
-        notes = generate_notes_from_transcript_deepseek_openrouter_api(
-            transcript, query_prompt
+def generate_notes_map_reduce(
+    transcript: str,
+    method: NotesMethod = NotesMethod.deepseek_openrouter_api,
+    query_prompt=None,
+) -> str:
+    """
+    Notes for transcripts too long for one prompt: the transcript is split on
+    segment boundaries into windows that fit the method's token budget, each
+    window is summarized concurrently, then the partial notes are merged.
+    Merging repeats in rounds while the partial notes are still too long.
+    """
+    text, prompt = _map_reduce_input(transcript, method, query_prompt)
+    return generate_notes_from_transcript(text, method, prompt)
+
+
+def _map_reduce_input(
+    transcript: str, method: NotesMethod, query_prompt=None
+) -> tuple[str, Optional[str]]:
+    # everything but the final merge: the text and prompt of that last call
+    max_tokens, max_workers, count_tokens = _map_reduce_settings(method)
+
+    windows = split_transcript(transcript, max_tokens, count_tokens)
+    if len(windows) <= 1:
+        return transcript, query_prompt
+
+    reduce_prompt = _reduce_prompt(query_prompt)
+
+    logger.info("generating notes for %d transcript windows", len(windows))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # map: notes for every window
+        partial_notes = list(
+            executor.map(
+                lambda window: generate_notes_from_transcript(
+                    window, method, query_prompt
+                ),
+                windows,
+            )
         )
-    elif method == NotesMethod.gemini_openrouter_api:
-        notes = generate_notes_from_transcript_gemini_openrouter_api(
-            transcript, query_prompt
+
+        # reduce: merge groups of partial notes until they fit in one prompt
+        while count_tokens(format_partial_notes(partial_notes)) > max_tokens:
+            groups = group_partial_notes(partial_notes, max_tokens, count_tokens)
+            if len(groups) == len(partial_notes):
+                # every part is already a window on its own, merging cannot shrink it
+                break
+            partial_notes = list(
+                executor.map(
+                    lambda group: generate_notes_from_transcript(
+                        format_partial_notes(group), method, reduce_prompt
+                    ),
+                    groups,
+                )
+            )
+
+    return format_partial_notes(partial_notes), reduce_prompt
+
+
+async def agenerate_notes_map_reduce(
+    transcript: str,
+    method: NotesMethod = NotesMethod.deepseek_openrouter_api,
+    query_prompt=None,
+) -> str:
+    """
+    Async version of `generate_notes_map_reduce` for remote methods, windows
+    are summarized as concurrent requests instead of threads.
+    """
+    text, prompt = await _amap_reduce_input(transcript, method, query_prompt)
+    return await agenerate_notes_from_transcript(text, method, prompt)
+
+
+async def _amap_reduce_input(
+    transcript: str, method: NotesMethod, query_prompt=None
+) -> tuple[str, Optional[str]]:
+    max_tokens, max_workers, count_tokens = _map_reduce_settings(method)
+
+    windows = split_transcript(transcript, max_tokens, count_tokens)
+    if len(windows) <= 1:
+        return transcript, query_prompt
+
+    reduce_prompt = _reduce_prompt(query_prompt)
+    limit = asyncio.Semaphore(max_workers)
+
+    async def summarize(text: str, prompt) -> str:
+        async with limit:
+            return await agenerate_notes_from_transcript(text, method, prompt)
+
+    logger.info("generating notes for %d transcript windows", len(windows))
+
+    # map: notes for every window
+    partial_notes = await asyncio.gather(
+        *(summarize(window, query_prompt) for window in windows)
+    )
+
+    # reduce: merge groups of partial notes until they fit in one prompt
+    while count_tokens(format_partial_notes(partial_notes)) > max_tokens:
+        groups = group_partial_notes(partial_notes, max_tokens, count_tokens)
+        if len(groups) == len(partial_notes):
+            # every part is already a window on its own, merging cannot shrink it
+            break
+        partial_notes = await asyncio.gather(
+            *(summarize(format_partial_notes(group), reduce_prompt) for group in groups)
         )
-    elif method == NotesMethod.qwen_openrouter_api:
-        notes = generate_notes_from_transcript_qwen_openrouter_api(
-            transcript, query_prompt
+
+    return format_partial_notes(partial_notes), reduce_prompt
+
+
+def generate_notes_from_transcript(
+    transcript: str,
+    method: NotesMethod = NotesMethod.deepseek_openrouter_api,
+    query_prompt=None,
+    mode: NotesMode = NotesMode.single,
+) -> str:
+    if mode == NotesMode.map_reduce:
+        return generate_notes_map_reduce(transcript, method, query_prompt)
+
+    return get_notes_backend(method).generate(transcript, query_prompt)
+
+
+def stream_notes_from_transcript(
+    transcript: str,
+    method: NotesMethod = NotesMethod.deepseek_openrouter_api,
+    query_prompt=None,
+    mode: NotesMode = NotesMode.single,
+) -> Iterator[str]:
+    """
+    Notes as the model writes them, piece by piece. In map_reduce mode the
+    windows are summarized first and only the final merge is streamed.
+    """
+    if mode == NotesMode.map_reduce:
+        transcript, query_prompt = _map_reduce_input(transcript, method, query_prompt)
+
+    yield from get_notes_backend(method).stream(transcript, query_prompt)
+
+
+async def astream_notes_from_transcript(
+    transcript: str,
+    method: NotesMethod = NotesMethod.deepseek_openrouter_api,
+    query_prompt=None,
+    mode: NotesMode = NotesMode.single,
+) -> AsyncIterator[str]:
+    """
+    Async version of `stream_notes_from_transcript` for remote methods.
+    """
+    backend = get_notes_backend(method)
+    if backend.capabilities.local:
+        raise ValueError(f"{method} does not run remotely")
+
+    if mode == NotesMode.map_reduce:
+        transcript, query_prompt = await _amap_reduce_input(
+            transcript, method, query_prompt
         )
-    elif method == NotesMethod.dummy:
-        notes = "dummy transcript"
-    else:
-        assert 0
 
-    return notes
+    async for token in backend.astream(transcript, query_prompt):
+        yield token
@@ -0,0 +1,413 @@
+"""
+Failover and hedging across interchangeable notes providers, steered by the
+recent latency and error rate of each one.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional, TypeVar
+
+from telemetry.metrics import PROVIDER_CALLS, PROVIDER_HEDGES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# what a stream gives when it ends without a single token
+_END = object()
+
+
+@dataclass(frozen=True)
+class RoutingSettings:
+    # try the other providers when the chosen one fails
+    fallback: bool = True
+    # race the next provider once a call, or a stream's first token, is slower
+    # than its provider's p95
+    hedge: bool = False
+    # calls older than this many seconds no longer count
+    window_seconds: float = 300.0
+    # providers failing more often than this are tried last
+    max_error_rate: float = 0.5
+    # calls a provider needs before its numbers are trusted
+    min_calls: int = 5
+
+    @classmethod
+    def from_env(cls) -> "RoutingSettings":
+        return cls(
+            fallback=os.getenv("NOTES_FALLBACK", "1") == "1",
+            hedge=os.getenv("NOTES_HEDGE", "0") == "1",
+            window_seconds=float(os.getenv("NOTES_ROUTING_WINDOW_SECONDS", "300")),
+            max_error_rate=float(os.getenv("NOTES_MAX_ERROR_RATE", "0.5")),
+            min_calls=int(os.getenv("NOTES_ROUTING_MIN_CALLS", "5")),
+        )
+
+
+def _close(tokens: Iterator[str]) -> None:
+    # generators hold a response open until closed, plain iterators hold nothing
+    close = getattr(tokens, "close", None)
+    if close is not None:
+        close()
+
+
+def _percentile(values: list[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(math.ceil(q * len(values)) - 1, len(values) - 1)]
+
+
+class ProviderStats:
+    """
+    Outcomes of one provider's calls in the last `window_seconds`.
+    """
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        # (finished at, seconds, succeeded)
+        self._calls: deque[tuple[float, float, bool]] = deque()
+        # (arrived at, seconds) of the first token of streams
+        self._first_tokens: deque[tuple[float, float]] = deque()
+
+    def record(self, seconds: float, ok: bool) -> None:
+        now = time.monotonic()
+        self._calls.append((now, seconds, ok))
+        self._trim(now)
+
+    def record_first_token(self, seconds: float) -> None:
+        now = time.monotonic()
+        self._first_tokens.append((now, seconds))
+        self._trim(now)
+
+    def _trim(self, now: float) -> None:
+        for outcomes in (self._calls, self._first_tokens):
+            while outcomes and outcomes[0][0] < now - self.window_seconds:
+                outcomes.popleft()
+
+    def snapshot(self) -> dict:
+        self._trim(time.monotonic())
+        latencies = [seconds for _, seconds, ok in self._calls if ok]
+        first_tokens = [seconds for _, seconds in self._first_tokens]
+        calls = len(self._calls)
+        return {
+            "calls": calls,
+            "error_rate": round(1 - len(latencies) / calls, 4) if calls else 0.0,
+            "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95),
+            "successes": len(latencies),
+            "streams": len(first_tokens),
+            "first_token_p95": _percentile(first_tokens, 0.95),
+        }
+
+
+class ProviderRouter:
+    """
+    Calls one of several providers that can stand in for each other.
+    The chosen provider goes first unless it has been failing, the others
+    follow by error rate then median latency. Every call fails over; async
+    calls and streams can also be hedged. Streams are raced and fail over
+    only until their first token, so notes never mix two models.
+    """
+
+    def __init__(
+        self, providers: list[str], settings: Optional[RoutingSettings] = None
+    ):
+        self.providers = list(providers)
+        self.settings = settings or RoutingSettings.from_env()
+        self._stats = {
+            name: ProviderStats(self.settings.window_seconds) for name in providers
+        }
+        self._lock = threading.Lock()
+
+    def order(self, preferred: str) -> list[str]:
+        """
+        Providers in the order a call for `preferred` tries them.
+        """
+        if not self.settings.fallback or preferred not in self._stats:
+            return [preferred]
+
+        snapshots = self.describe()
+
+        def healthy(name: str) -> bool:
+            stats = snapshots[name]
+            return (
+                stats["calls"] < self.settings.min_calls
+                or stats["error_rate"] <= self.settings.max_error_rate
+            )
+
+        others = sorted(
+            (name for name in self.providers if name != preferred),
+            key=lambda name: (
+                snapshots[name]["error_rate"],
+                snapshots[name]["p50"] or 0.0,
+            ),
+        )
+        # stable, so failing providers move to the back and keep their order
+        return sorted([preferred, *others], key=lambda name: not healthy(name))
+
+    def hedge_delay(self, name: str, first_token: bool = False) -> Optional[float]:
+        """
+        Seconds after which a call to `name`, or the first token of a stream
+        with `first_token`, is raced by the next provider. None when hedging
+        is off or the provider has too few calls to tell.
+        """
+        if not self.settings.hedge:
+            return None
+        stats = self.describe()[name]
+        if first_token:
+            if stats["streams"] < self.settings.min_calls:
+                return None
+            return stats["first_token_p95"]
+        if stats["successes"] < self.settings.min_calls:
+            return None
+        return stats["p95"]
+
+    def describe(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: stats.snapshot() for name, stats in self._stats.items()}
+
+    def call(self, preferred: str, call: Callable[[str], T]) -> T:
+        errors = []
+        for name in self.order(preferred):
+            started = time.monotonic()
+            try:
+                result = call(name)
+            except Exception as e:
+                self._record(name, started, ok=False)
+                errors.append(self._failed(name, e))
+                continue
+            self._record(name, started, ok=True)
+            return result
+        raise self._error(errors)
+
+    async def acall(self, preferred: str, call: Callable[[str], Awaitable[T]]) -> T:
+        candidates = self.order(preferred)
+        errors = []
+        running: dict[asyncio.Task, str] = {}
+        hedged = False
+
+        async def timed(name: str) -> T:
+            started = time.monotonic()
+            try:
+                result = await call(name)
+            except Exception:
+                self._record(name, started, ok=False)
+                raise
+            self._record(name, started, ok=True)
+            return result
+
+        def launch() -> None:
+            name = candidates.pop(0)
+            running[asyncio.create_task(timed(name))] = name
+
+        launch()
+        try:
+            while running:
+                timeout = None
+                if not hedged and candidates and len(running) == 1:
+                    timeout = self.hedge_delay(next(iter(running.values())))
+                done, _ = await asyncio.wait(
+                    running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedged = True
+                    logger.info(
+                        "notes from %s are slower than its p95 of %.1fs, "
+                        "also asking %s",
+                        next(iter(running.values())),
+                        timeout,
+                        candidates[0],
+                    )
+                    PROVIDER_HEDGES.inc(provider=candidates[0])
+                    launch()
+                    continue
+
+                for task in done:
+                    name = running.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(self._failed(name, task.exception()))
+                if not running and candidates:
+                    launch()
+        finally:
+            # the slower side of a hedge
+            for task, name in running.items():
+                if not task.done():
+                    task.cancel()
+                    PROVIDER_CALLS.inc(provider=name, outcome="cancelled")
+        raise self._error(errors)
+
+    def stream(
+        self, preferred: str, stream: Callable[[str], Iterator[str]]
+    ) -> Iterator[str]:
+        candidates = self.order(preferred)
+        errors = []
+        # first token future of every stream in the race: name, tokens, start
+        racing = {}
+        hedged = False
+        # the first tokens are waited for on threads, so a slow one can be raced
+        executor = ThreadPoolExecutor(max_workers=2)
+
+        def launch() -> None:
+            name = candidates.pop(0)
+            tokens = iter(stream(name))
+            racing[executor.submit(next, tokens, _END)] = (
+                name,
+                tokens,
+                time.monotonic(),
+            )
+
+        launch()
+        winner = None
+        try:
+            while racing and winner is None:
+                timeout = self._race_timeout(racing, candidates, hedged)
+                done, _ = wait(racing, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    hedged = self._hedge(racing, candidates, timeout)
+                    launch()
+                    continue
+                winner = self._race_winner(racing, done, errors)
+                if winner is None and not racing and candidates:
+                    launch()
+        finally:
+            for future, (name, tokens, _) in racing.items():
+                PROVIDER_CALLS.inc(provider=name, outcome="cancelled")
+                # a thread cannot be interrupted, the stream is closed once
+                # its first token is in
+                future.add_done_callback(lambda _, tokens=tokens: _close(tokens))
+            executor.shutdown(wait=False)
+
+        if winner is None:
+            raise self._error(errors)
+        name, tokens, started, first = winner
+        try:
+            if first is not _END:
+                yield first
+                for token in tokens:
+                    yield token
+        except Exception:
+            self._record(name, started, ok=False)
+            raise
+        finally:
+            _close(tokens)
+        self._record(name, started, ok=True)
+
+    async def astream(
+        self, preferred: str, stream: Callable[[str], AsyncIterator[str]]
+    ) -> AsyncIterator[str]:
+        candidates = self.order(preferred)
+        errors = []
+        # first token task of every stream in the race: name, tokens, start
+        racing = {}
+        hedged = False
+
+        async def first_token(tokens: AsyncIterator[str]):
+            return await anext(tokens, _END)
+
+        def launch() -> None:
+            name = candidates.pop(0)
+            tokens = stream(name)
+            racing[asyncio.create_task(first_token(tokens))] = (
+                name,
+                tokens,
+                time.monotonic(),
+            )
+
+        launch()
+        winner = None
+        try:
+            while racing and winner is None:
+                timeout = self._race_timeout(racing, candidates, hedged)
+                done, _ = await asyncio.wait(
+                    racing, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedged = self._hedge(racing, candidates, timeout)
+                    launch()
+                    continue
+                winner = self._race_winner(racing, done, errors)
+                if winner is None and not racing and candidates:
+                    launch()
+        finally:
+            for task in racing:
+                task.cancel()
+            await asyncio.gather(*racing, return_exceptions=True)
+            for name, tokens, _ in racing.values():
+                PROVIDER_CALLS.inc(provider=name, outcome="cancelled")
+                await tokens.aclose()
+
+        if winner is None:
+            raise self._error(errors)
+        name, tokens, started, first = winner
+        try:
+            if first is not _END:
+                yield first
+                async for token in tokens:
+                    yield token
+        except Exception:
+            self._record(name, started, ok=False)
+            raise
+        finally:
+            await tokens.aclose()
+        self._record(name, started, ok=True)
+
+    def _race_timeout(self, racing: dict, candidates: list, hedged: bool):
+        # only a lone stream is raced, and only once
+        if hedged or not candidates or len(racing) != 1:
+            return None
+        name, _, _ = next(iter(racing.values()))
+        return self.hedge_delay(name, first_token=True)
+
+    def _hedge(self, racing: dict, candidates: list, timeout: float) -> bool:
+        name, _, _ = next(iter(racing.values()))
+        logger.info(
+            "the first token from %s is slower than its p95 of %.1fs, "
+            "also asking %s",
+            name,
+            timeout,
+            candidates[0],
+        )
+        PROVIDER_HEDGES.inc(provider=candidates[0])
+        return True
+
+    def _race_winner(self, racing: dict, done, errors: list) -> Optional[tuple]:
+        """
+        The first stream in `done` that got a token, taken out of the race
+        with the token; failed ones are taken out and recorded.
+        """
+        for future in done:
+            name, tokens, started = racing.pop(future)
+            if future.exception() is None:
+                if name in self._stats:
+                    with self._lock:
+                        self._stats[name].record_first_token(time.monotonic() - started)
+                return name, tokens, started, future.result()
+            self._record(name, started, ok=False)
+            errors.append(self._failed(name, future.exception()))
+        return None
+
+    def _record(self, name: str, started: float, ok: bool) -> None:
+        PROVIDER_CALLS.inc(provider=name, outcome="ok" if ok else "error")
+        if name not in self._stats:
+            return
+        with self._lock:
+            self._stats[name].record(time.monotonic() - started, ok)
+
+    def _failed(self, name: str, error: Exception) -> tuple[str, Exception]:
+        logger.warning("notes provider %s failed: %s", name, error)
+        return name, error
+
+    def _error(self, errors: list[tuple[str, Exception]]) -> Exception:
+        if len(errors) == 1:
+            return errors[0][1]
+        return RuntimeError(
+            "Every notes provider failed: "
+            + "; ".join(f"{name}: {error}" for name, error in errors)
+        )
@@ -0,0 +1,275 @@
+import asyncio
+import dataclasses
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+import httpx
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# statuses worth another try: rate limited or a transient server problem
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+@dataclass(frozen=True)
+class Credentials:
+    openrouter_api_key: Optional[str]
+    alibaba_asr_appkey: Optional[str]
+    alibaba_asr_token: Optional[str]
+
+
+@lru_cache(maxsize=None)
+def get_credentials() -> Credentials:
+    """
+    Provider keys, read from the environment / .env once per process.
+    """
+    load_dotenv()
+    return Credentials(
+        openrouter_api_key=os.getenv("OPENROUTER_API_KEY"),
+        alibaba_asr_appkey=os.getenv("ALIBABA_ASR_APPKEY"),
+        alibaba_asr_token=os.getenv("ALIBABA_ASR_TOKEN"),
+    )
+
+
+@dataclass(frozen=True)
+class ClientSettings:
+    connect_timeout: float = 5.0
+    read_timeout: float = 120.0
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 30.0
+    pool_size: int = 10
+
+    @classmethod
+    def from_env(cls) -> "ClientSettings":
+        load_dotenv()
+        return cls(
+            connect_timeout=float(os.getenv("PROVIDER_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("PROVIDER_READ_TIMEOUT", "120")),
+            max_retries=int(os.getenv("PROVIDER_MAX_RETRIES", "3")),
+            backoff_base=float(os.getenv("PROVIDER_BACKOFF_BASE", "0.5")),
+            backoff_max=float(os.getenv("PROVIDER_BACKOFF_MAX", "30")),
+            pool_size=int(os.getenv("PROVIDER_POOL_SIZE", "10")),
+        )
+
+    def retry_delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        """
+        Seconds to wait before retry number `attempt` (starting at 0).
+        A `Retry-After` header from the provider wins over exponential backoff.
+        """
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                # http date form
+                try:
+                    retry_at = email.utils.parsedate_to_datetime(retry_after)
+                    delay = retry_at.timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0.0), self.backoff_max)
+
+        delay = self.backoff_base * (2**attempt)
+        # full jitter so many clients do not retry in lockstep
+        return random.uniform(0, min(delay, self.backoff_max))
+
+
+def _safe_url(url: str) -> str:
+    # the query string may carry credentials, keep it out of the logs
+    return url.split("?", 1)[0]
+
+
+def _rewind(body) -> None:
+    # file bodies are consumed by a send, start over before a retry
+    if hasattr(body, "seek"):
+        body.seek(0)
+
+
+class ProviderClient:
+    """
+    Blocking HTTP client shared by every provider call in a process.
+    Keeps connections alive in a pool, applies timeouts, and retries
+    429 / 5xx responses and connection errors with exponential backoff.
+    """
+
+    def __init__(self, settings: Optional[ClientSettings] = None):
+        self.settings = settings or ClientSettings.from_env()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.settings.pool_size,
+            pool_maxsize=self.settings.pool_size,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault(
+            "timeout", (self.settings.connect_timeout, self.settings.read_timeout)
+        )
+        attempt = 0
+        while True:
+            _rewind(kwargs.get("data"))
+            try:
+                response = self.session.post(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.settings.max_retries:
+                    raise
+                delay = self.settings.retry_delay(attempt, None)
+                logger.warning(
+                    "request to %s failed (%s), retrying in %.1fs",
+                    _safe_url(url),
+                    e,
+                    delay,
+                )
+            else:
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt >= self.settings.max_retries
+                ):
+                    return response
+                delay = self.settings.retry_delay(
+                    attempt, response.headers.get("Retry-After")
+                )
+                logger.warning(
+                    "request to %s got %s, retrying in %.1fs",
+                    _safe_url(url),
+                    response.status_code,
+                    delay,
+                )
+                response.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncProviderClient:
+    """
+    Asyncio twin of `ProviderClient`, so routes can call providers
+    directly on the event loop.
+    """
+
+    def __init__(self, settings: Optional[ClientSettings] = None):
+        self.settings = settings or ClientSettings.from_env()
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                self.settings.read_timeout, connect=self.settings.connect_timeout
+            ),
+            limits=httpx.Limits(
+                max_connections=self.settings.pool_size,
+                max_keepalive_connections=self.settings.pool_size,
+            ),
+        )
+
+    async def post(
+        self, url: str, content_factory=None, stream: bool = False, **kwargs
+    ) -> httpx.Response:
+        """
+        `content_factory` returns a fresh body for every attempt, for streamed
+        bodies that can only be sent once. With `stream` the response body is
+        left unread, for the caller to iterate and close.
+        """
+        attempt = 0
+        while True:
+            if content_factory is not None:
+                kwargs["content"] = content_factory()
+            try:
+                request = self.client.build_request("POST", url, **kwargs)
+                response = await self.client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.TimeoutException) as e:
+                if attempt >= self.settings.max_retries:
+                    raise
+                delay = self.settings.retry_delay(attempt, None)
+                logger.warning(
+                    "request to %s failed (%s), retrying in %.1fs",
+                    _safe_url(url),
+                    e,
+                    delay,
+                )
+            else:
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt >= self.settings.max_retries
+                ):
+                    return response
+                delay = self.settings.retry_delay(
+                    attempt, response.headers.get("Retry-After")
+                )
+                logger.warning(
+                    "request to %s got %s, retrying in %.1fs",
+                    _safe_url(url),
+                    response.status_code,
+                    delay,
+                )
+                await response.aclose()
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+# one client per retry count, None being PROVIDER_MAX_RETRIES
+_clients: dict[Optional[int], ProviderClient] = {}
+_client_pid: Optional[int] = None
+_async_clients: dict[Optional[int], AsyncProviderClient] = {}
+_client_lock = threading.Lock()
+
+
+def _settings(max_retries: Optional[int]) -> ClientSettings:
+    settings = ClientSettings.from_env()
+    if max_retries is None:
+        return settings
+    return dataclasses.replace(settings, max_retries=max_retries)
+
+
+def get_provider_client(max_retries: Optional[int] = None) -> ProviderClient:
+    """
+    The blocking client of this process. Callers that retry elsewhere, like
+    the notes router trying another model, ask for fewer `max_retries`.
+    """
+    global _client_pid
+    with _client_lock:
+        # a forked child must not share pooled sockets with its parent
+        if _client_pid != os.getpid():
+            _clients.clear()
+            _client_pid = os.getpid()
+        if max_retries not in _clients:
+            _clients[max_retries] = ProviderClient(_settings(max_retries))
+        return _clients[max_retries]
+
+
+def get_async_provider_client(
+    max_retries: Optional[int] = None,
+) -> AsyncProviderClient:
+    """
+    The async client of this process. Must be used from the same event loop
+    it was first used on, which is the server's loop.
+    """
+    if max_retries not in _async_clients:
+        _async_clients[max_retries] = AsyncProviderClient(_settings(max_retries))
+    return _async_clients[max_retries]
+
+
+async def close_provider_clients() -> None:
+    for client in list(_async_clients.values()):
+        await client.aclose()
+    _async_clients.clear()
+    with _client_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -0,0 +1,238 @@
+"""
+Counters, gauges and histograms kept in memory and served by `/metrics` in
+the Prometheus text format.
+"""
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from telemetry.tracing import span
+
+# seconds, from a cache lookup to a long recording on cpu
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+    600.0,
+)
+
+
+# every metric by name, in the order they are served
+REGISTRY: dict[str, "_Metric"] = {}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labelnames: tuple, values: tuple, le: Optional[str] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind: str
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{_label_text(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        if _outbox is not None:
+            _outbox.append((self.name, labels, value))
+            return
+        key = self._key(labels)
+        with self._lock:
+            # cumulative count per bucket, then the sum and count of everything
+            values = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        *counts, total, count = value
+        bounds = [*(str(bound) for bound in self.buckets), "+Inf"]
+        lines = [
+            f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {n}"
+            for le, n in zip(bounds, [*counts, count])
+        ]
+        lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "notes_agent_stage_seconds",
+    "Seconds spent in a pipeline stage, by transcription or notes method "
+    "(the operation for db)",
+    ("stage", "method"),
+)
+JOBS_FINISHED = Counter(
+    "notes_agent_jobs_finished_total",
+    "Jobs that finished, by status and methods",
+    ("status", "transcription_method", "notes_method"),
+)
+JOBS_RUNNING = Gauge("notes_agent_jobs_running", "Jobs being worked on")
+JOBS_QUEUED = Gauge("notes_agent_jobs_queued", "Jobs waiting for a running slot")
+ADMISSION_REJECTED = Counter(
+    "notes_agent_admission_rejected_total",
+    "Requests turned away by admission control, by reason",
+    ("reason",),
+)
+QUEUE_DEPTH = Gauge(
+    "notes_agent_transcription_queue_depth",
+    "Transcriptions waiting for a pool worker",
+)
+POOL_WORKERS = Gauge(
+    "notes_agent_pool_workers",
+    "Transcription pool workers by state",
+    ("state",),
+)
+PROVIDER_CALLS = Counter(
+    "notes_agent_provider_calls_total",
+    "Notes provider calls by provider and outcome (ok, error, or cancelled "
+    "when the other side of a hedge won)",
+    ("provider", "outcome"),
+)
+PROVIDER_HEDGES = Counter(
+    "notes_agent_provider_hedges_total",
+    "Hedge requests sent to a provider because another one was slow",
+    ("provider",),
+)
+
+
+@contextmanager
+def stage(name: str, method=None, **attributes):
+    """
+    Time a block as pipeline stage `name` and trace it as a span.
+    """
+    method = str(getattr(method, "value", method) or "")
+    started = time.perf_counter()
+    with span(name, method=method, **attributes):
+        try:
+            yield
+        finally:
+            STAGE_SECONDS.observe(
+                time.perf_counter() - started, stage=name, method=method
+            )
+
+
+def timed_stage(name: str, method: Optional[str] = None):
+    """
+    Decorator form of `stage`, the method label defaults to the function name.
+    """
+
+    def decorator(func):
+        label = method or func.__name__.lstrip("_")
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, label):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# pool worker processes buffer their observations here and send them to the
+# server process, which is the one serving /metrics
+_outbox: Optional[list] = None
+
+
+def buffer_observations() -> None:
+    global _outbox
+    _outbox = []
+
+
+def drain_observations() -> list[tuple]:
+    observations = list(_outbox or [])
+    if _outbox is not None:
+        _outbox.clear()
+    return observations
+
+
+def record_observations(observations: list[tuple]) -> None:
+    for name, labels, value in observations:
+        REGISTRY[name].observe(value, **labels)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
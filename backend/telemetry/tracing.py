@@ -0,0 +1,71 @@
+"""
+Optional OpenTelemetry spans. Without the opentelemetry packages, or with
+TRACING_EXPORTER unset, every span is a no-op.
+"""
+
+import logging
+import os
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+_tracer = None
+
+
+def configure_tracing() -> None:
+    """
+    Export spans as TRACING_EXPORTER says: `console`, or `otlp` to the
+    collector in the standard OTEL_EXPORTER_OTLP_* env vars.
+    """
+    global _tracer
+    exporter_name = os.getenv("TRACING_EXPORTER", "")
+    if not exporter_name or trace is None:
+        return
+
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import (
+            BatchSpanProcessor,
+            ConsoleSpanExporter,
+        )
+
+        if exporter_name == "otlp":
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter as exporter_class,
+            )
+        else:
+            exporter_class = ConsoleSpanExporter
+    except ImportError as e:
+        logger.warning("tracing is off, opentelemetry is not installed: %s", e)
+        return
+
+    provider = TracerProvider(
+        resource=Resource.create(
+            {"service.name": os.getenv("OTEL_SERVICE_NAME", "notes-agent")}
+        )
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter_class()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("notes_agent")
+    logger.info("exporting traces to %s", exporter_name)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    A span around the block, a child of the span the caller is in.
+    """
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(
+        name,
+        attributes={k: str(v) for k, v in attributes.items() if v is not None},
+    ) as current:
+        yield current
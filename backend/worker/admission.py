@@ -0,0 +1,252 @@
+"""
+Admission control for the routes that queue jobs: a bounded wait queue,
+per-client token buckets and a memory guard for jobs on local models.
+"""
+
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from telemetry.metrics import ADMISSION_REJECTED
+
+# seconds a client is asked to wait when there is nothing better to go on
+DEFAULT_RETRY_AFTER = 10
+
+# seconds a memory reading is reused, scanning /proc on every request is slow
+RSS_CACHE_SECONDS = 1.0
+
+
+class AdmissionError(Exception):
+    """
+    A request that is turned away, with the status and `Retry-After` seconds
+    to answer it with.
+    """
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class AdmissionSettings:
+    # jobs waiting for one of the runner's slots, beyond that new jobs get a 429
+    max_queue: int = 256
+    # jobs a client may queue per minute, 0 disables the limit
+    rate_per_minute: float = 0.0
+    # jobs a client may queue at once before the rate applies
+    burst: int = 10
+    # memory of the server and its worker processes above which no more jobs
+    # on local models are taken, 0 disables the guard
+    max_rss_mb: float = 0.0
+    # use the first X-Forwarded-For address as the client, behind a proxy
+    trust_forwarded: bool = False
+
+    @classmethod
+    def from_env(cls) -> "AdmissionSettings":
+        return cls(
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "256")),
+            rate_per_minute=float(os.getenv("RATE_LIMIT_PER_MINUTE", "0")),
+            burst=int(os.getenv("RATE_LIMIT_BURST", "10")),
+            max_rss_mb=float(os.getenv("ADMISSION_MAX_RSS_MB", "0")),
+            trust_forwarded=os.getenv("RATE_LIMIT_TRUST_FORWARDED", "0") == "1",
+        )
+
+
+class TokenBucket:
+    """
+    `burst` tokens, refilled at `rate` tokens per second.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, tokens: int = 1) -> float:
+        """
+        Take `tokens`, or return the seconds until they are there. More than
+        `burst` at once are taken from a full bucket, which goes into debt
+        for the rest, so later requests wait them off.
+        """
+        self._refill(time.monotonic())
+        needed = min(tokens, self.burst)
+        if self.tokens >= needed:
+            self.tokens -= tokens
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+def process_tree_rss_mb() -> Optional[float]:
+    """
+    Resident memory of this process and its children (the transcription and
+    notes workers) in MB. Reads /proc, None where there is none.
+    """
+    if not hasattr(os, "sysconf") or not os.path.isdir("/proc"):
+        # windows and macOS
+        return None
+    try:
+        page_mb = os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+    pid = os.getpid()
+    pids = [pid]
+    try:
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # the command name may hold spaces, the fields after it do not
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                # exited while we looked
+                continue
+            if int(fields[1]) == pid:
+                pids.append(int(entry))
+    except OSError:
+        return None
+
+    pages = 0
+    for child in pids:
+        try:
+            with open(f"/proc/{child}/statm") as f:
+                pages += int(f.read().split()[1])
+        except OSError:
+            continue
+    return pages * page_mb
+
+
+class Reservation:
+    """
+    Room for admitted jobs until they are submitted to the runner, which
+    counts them from then on.
+    """
+
+    def __init__(self, controller: "AdmissionController", jobs: int):
+        self.controller = controller
+        self.jobs = jobs
+
+    def __enter__(self) -> "Reservation":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        with self.controller._lock:
+            self.controller._reserved -= self.jobs
+
+
+class AdmissionController:
+    """
+    Decides whether a request may queue more jobs. Jobs beyond the runner's
+    running slots wait in its queue, which holds at most `max_queue`; every
+    client has a token bucket; and jobs on local models are refused while
+    the server and its workers use more than `max_rss_mb`.
+    """
+
+    def __init__(self, runner, settings: Optional[AdmissionSettings] = None):
+        self.runner = runner
+        self.settings = settings or AdmissionSettings.from_env()
+        self._buckets: dict[str, TokenBucket] = {}
+        # jobs admitted but not submitted to the runner yet
+        self._reserved = 0
+        self._lock = threading.Lock()
+        # last memory reading and when it was taken
+        self._rss_mb: Optional[float] = None
+        self._rss_time = -math.inf
+
+    def client_key(self, host: Optional[str], forwarded_for: Optional[str]) -> str:
+        if self.settings.trust_forwarded and forwarded_for:
+            return forwarded_for.split(",")[0].strip()
+        return host or "unknown"
+
+    def admit(self, client: str, jobs: int = 1, local: bool = False) -> Reservation:
+        """
+        Reserve room for `jobs` new jobs of `client`, or raise `AdmissionError`.
+        `local` jobs run a model in this machine's memory.
+        """
+        rss_mb = None
+        if local and self.settings.max_rss_mb > 0:
+            # read outside the lock, it may scan /proc
+            rss_mb = self._current_rss_mb()
+
+        with self._lock:
+            if rss_mb is not None and rss_mb > self.settings.max_rss_mb:
+                self._reject(
+                    "memory",
+                    503,
+                    f"Server memory is at {rss_mb:.0f} MB, over the "
+                    f"{self.settings.max_rss_mb:.0f} MB allowed for local "
+                    "models, try again later",
+                    self._queue_wait(self.runner.queued_jobs + 1),
+                )
+
+            capacity = self.runner.max_running_jobs + self.settings.max_queue
+            in_flight = self.runner.active_jobs + self._reserved
+            if in_flight + jobs > capacity:
+                self._reject(
+                    "queue_full",
+                    429,
+                    f"The job queue is full ({in_flight} of {capacity} jobs), "
+                    "try again later",
+                    self._queue_wait(in_flight + jobs - capacity),
+                )
+
+            # taken last, so a request refused above costs no tokens
+            wait = self._take_tokens(client, jobs)
+            if wait > 0:
+                self._reject(
+                    "rate_limit",
+                    429,
+                    f"Over {self.settings.rate_per_minute:g} jobs per minute, "
+                    "slow down",
+                    math.ceil(wait),
+                )
+
+            self._reserved += jobs
+            return Reservation(self, jobs)
+
+    def _current_rss_mb(self) -> Optional[float]:
+        now = time.monotonic()
+        if now - self._rss_time >= RSS_CACHE_SECONDS:
+            self._rss_mb = process_tree_rss_mb()
+            self._rss_time = now
+        return self._rss_mb
+
+    def _take_tokens(self, client: str, jobs: int) -> float:
+        if self.settings.rate_per_minute <= 0:
+            return 0.0
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= 10000:
+                # forget clients that have been quiet long enough to be full
+                self._buckets = {
+                    key: b for key, b in self._buckets.items() if not b.full()
+                }
+            bucket = self._buckets[client] = TokenBucket(
+                self.settings.rate_per_minute / 60, self.settings.burst
+            )
+        return bucket.take(jobs)
+
+    def _queue_wait(self, jobs_ahead: int) -> int:
+        # until that many jobs have finished, at the recent pace
+        seconds = self.runner.average_job_seconds
+        if seconds is None:
+            return DEFAULT_RETRY_AFTER
+        waves = math.ceil(jobs_ahead / max(self.runner.max_running_jobs, 1))
+        return min(max(math.ceil(seconds * waves), 1), 600)
+
+    def _reject(self, reason: str, status_code: int, detail: str, retry_after: int):
+        ADMISSION_REJECTED.inc(reason=reason)
+        raise AdmissionError(status_code, detail, retry_after)
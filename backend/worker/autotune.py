@@ -0,0 +1,176 @@
+"""
+Measure the faster-whisper settings that give this machine the most audio
+transcribed per second, and save them for the pool to start with:
+
+    python -m worker.autotune
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from audio.preprocess import CLIP_SECONDS, SAMPLE_RATE, decode_audio
+from audio.tuning import default_model, load_tuning, machine_key, save_tuning
+from telemetry.logs import configure_logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZES = (4, 8, 16, 32)
+
+
+def autotune_mode() -> str:
+    # "0" off, "1" tune once per machine at startup, "force" tune every start
+    return os.getenv("ASR_AUTOTUNE", "0")
+
+
+def _benchmark_audio(path: str, seconds: float) -> None:
+    # a real recording gives the truest numbers; white noise still runs the
+    # encoder and decoder on every clip, which is where the time goes
+    sample = os.getenv("ASR_AUTOTUNE_AUDIO")
+    if sample:
+        samples = decode_audio(sample, sampling_rate=SAMPLE_RATE)
+        samples = samples[: int(seconds * SAMPLE_RATE)]
+    else:
+        rng = np.random.default_rng(0)
+        samples = (rng.standard_normal(int(seconds * SAMPLE_RATE)) * 0.05).astype(
+            np.float32
+        )
+    np.save(path, samples)
+
+
+def _run_benchmark(
+    model_size: str, compute_type: str, cpu_threads: int, batch_size: int, path: str
+) -> float:
+    # runs in its own process, like a pool worker
+    from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+    model = BatchedInferencePipeline(
+        model=WhisperModel(
+            model_size, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads
+        )
+    )
+    samples = np.load(path)
+    clip = CLIP_SECONDS * SAMPLE_RATE
+    clips = [
+        {"start": start, "end": min(start + clip, len(samples))}
+        for start in range(0, len(samples), clip)
+    ]
+
+    def transcribe(audio, clip_timestamps):
+        segments, _ = model.transcribe(
+            audio,
+            batch_size=batch_size,
+            clip_timestamps=clip_timestamps,
+            without_timestamps=True,
+        )
+        for _ in segments:
+            pass
+
+    # the first call pays for allocations the later ones reuse
+    transcribe(samples[:clip], clips[:1])
+    started = time.perf_counter()
+    transcribe(samples, clips)
+    return time.perf_counter() - started
+
+
+def _throughput(
+    workers: int, cpu_threads: int, batch_size: int, path: str, seconds: float
+) -> float:
+    """
+    Seconds of audio transcribed per second by `workers` processes at once.
+    """
+    model_size, compute_type = default_model()
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        runs = [
+            executor.submit(
+                _run_benchmark, model_size, compute_type, cpu_threads, batch_size, path
+            )
+            for _ in range(workers)
+        ]
+        elapsed = [run.result() for run in runs]
+    throughput = workers * seconds / max(elapsed)
+    logger.info(
+        "autotune workers=%d cpu_threads=%d batch_size=%d: %.1fx realtime",
+        workers,
+        cpu_threads,
+        batch_size,
+        throughput,
+    )
+    return throughput
+
+
+def autotune(seconds: Optional[float] = None) -> dict:
+    """
+    Pick the batch size with one worker on every core, then the worker count
+    for that batch size, and save the winner for this machine and the
+    default model.
+    """
+    if decode_audio is None:
+        raise ImportError("faster-whisper is not installed, nothing to tune")
+
+    seconds = seconds or float(os.getenv("ASR_AUTOTUNE_SECONDS", "60"))
+    cpus = os.cpu_count() or 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "benchmark.npy")
+        _benchmark_audio(path, seconds)
+        seconds = len(np.load(path, mmap_mode="r")) / SAMPLE_RATE
+
+        batch_size = max(
+            BATCH_SIZES,
+            key=lambda batch_size: _throughput(1, cpus, batch_size, path, seconds),
+        )
+
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= cpus:
+            worker_counts.append(worker_counts[-1] * 2)
+        results = {
+            workers: _throughput(workers, cpus // workers, batch_size, path, seconds)
+            for workers in worker_counts
+        }
+        workers = max(results, key=results.get)
+
+    settings = {
+        "batch_size": batch_size,
+        "num_workers": workers,
+        "cpu_threads": cpus // workers,
+        "realtime_factor": round(results[workers], 2),
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    save_tuning(machine_key(*default_model()), settings)
+    logger.info("autotune saved %s", settings)
+    return settings
+
+
+def ensure_tuned() -> Optional[dict]:
+    """
+    Startup hook: tune when ASR_AUTOTUNE asks for it and this machine has no
+    saved settings yet. Explicit ASR_* env vars still win over the result.
+    """
+    mode = autotune_mode()
+    if mode == "0":
+        return None
+
+    tuning = load_tuning(machine_key(*default_model()))
+    if tuning is not None and mode != "force":
+        return tuning
+    try:
+        return autotune()
+    except Exception as e:
+        # a failed benchmark must not keep the server down, run untuned
+        logger.exception("autotune failed, using the defaults: %s", e)
+        return None
+
+
+if __name__ == "__main__":
+    configure_logging()
+    print(json.dumps(autotune(), indent=2))
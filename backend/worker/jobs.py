@@ -0,0 +1,1022 @@
+import asyncio
+import base64
+import datetime
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import or_
+
+from audio.audio import TranscriptionMethod, get_transcription_backend
+from audio.chunking import chunk_seconds, chunk_segments, remove_chunks, split_audio
+from audio.timestamps import (
+    FORMAT_VERSION,
+    TimedTranscript,
+    TranscriptionResult,
+    encode_segments,
+)
+from backends.base import Backend
+from model.model import (
+    NotesMethod,
+    NotesMode,
+    agenerate_notes_from_transcript,
+    astream_notes_from_transcript,
+    generate_notes_from_transcript,
+    get_notes_backend,
+    stream_notes_from_transcript,
+    warmup_notes_model,
+)
+
+from db import cache
+from db.db_setup import (
+    AudioSession,
+    Job,
+    JobStatus,
+    Output,
+    SessionLocal,
+    TranscriptTiming,
+)
+from telemetry.metrics import JOBS_FINISHED, stage, timed_stage
+from telemetry.tracing import span
+from worker.pool import PoolFullError, TranscriptionWorkerPool
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = (JobStatus.done.value, JobStatus.failed.value)
+
+# in a notes process, the queue its streamed tokens go back to the server on
+_notes_tokens: Optional[multiprocessing.Queue] = None
+
+
+def _init_notes_process(notes_tokens: multiprocessing.Queue) -> None:
+    global _notes_tokens
+    _notes_tokens = notes_tokens
+    warmup_notes_model()
+
+
+def _stream_notes_in_process(
+    stream_id: str,
+    transcription: str,
+    method: NotesMethod,
+    query_prompt=None,
+    mode: NotesMode = NotesMode.single,
+) -> None:
+    # every notes process shares one queue, tokens carry their stream's id
+    # and a None token ends the stream
+    try:
+        for token in stream_notes_from_transcript(
+            transcription, method, query_prompt, mode
+        ):
+            _notes_tokens.put((stream_id, token))
+    finally:
+        _notes_tokens.put((stream_id, None))
+
+
+@timed_stage("db")
+def _create_job(job_id: str, params: dict) -> None:
+    db = SessionLocal()
+    try:
+        audio_session = (
+            db.query(AudioSession)
+            .filter(AudioSession.id == params["audio_session_id"])
+            .first()
+        )
+        if not audio_session:
+            raise LookupError(
+                f"No AudioSession found with id {params['audio_session_id']}"
+            )
+
+        db.add(
+            Job(
+                id=job_id,
+                status=JobStatus.queued.value,
+                owner=_owner(),
+                heartbeat_time=_utcnow(),
+                **params,
+            )
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _create_audio_session() -> int:
+    db = SessionLocal()
+    try:
+        # fields are filled in from the job when it finishes
+        audio_session = AudioSession(
+            session_name="",
+            query_lang="",
+            query_file="",
+            query_prompt="",
+            query_audio_kind="",
+        )
+        db.add(audio_session)
+        db.commit()
+        return audio_session.id
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@timed_stage("db")
+def _update_job(job_id: str, **fields) -> None:
+    db = SessionLocal()
+    try:
+        db.query(Job).filter(Job.id == job_id).update(fields)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@timed_stage("db")
+def _load_job(job_id: str) -> Optional[Job]:
+    db = SessionLocal()
+    try:
+        return db.query(Job).filter(Job.id == job_id).first()
+    finally:
+        db.close()
+
+
+def store_output(
+    db, audio_session: AudioSession, transcription: str, notes: str
+) -> None:
+    """
+    Update the session's Output, or create it. The caller commits.
+    """
+    existing_output = (
+        db.query(Output).filter(Output.audio_session_id == audio_session.id).first()
+    )
+    if existing_output:
+        existing_output.transcription_text = transcription
+        existing_output.notes_text = notes
+    else:
+        db.add(
+            Output(
+                transcription_text=transcription,
+                notes_text=notes,
+                audio_session_id=audio_session.id,
+            )
+        )
+
+
+@timed_stage("db")
+def _finish_job(job_id: str, notes: str) -> None:
+    """
+    Store the job's results on its AudioSession and mark it done,
+    all in one transaction.
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id).one()
+        audio_session = (
+            db.query(AudioSession).filter(AudioSession.id == job.audio_session_id).one()
+        )
+
+        # Update session fields
+        audio_session.session_name = job.session_name
+        audio_session.query_file = job.query_file
+        audio_session.query_lang = job.query_lang
+        audio_session.query_prompt = job.query_prompt
+        audio_session.query_audio_kind = job.query_audio_kind
+
+        store_output(db, audio_session, job.transcription_text, notes)
+        job.notes_text = notes
+        job.status = JobStatus.done.value
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@timed_stage("db")
+def save_timings(audio_session_id: int, data: Optional[bytes]) -> None:
+    """
+    Store the encoded word timestamps of a session, replacing older ones.
+    None removes them, for a transcription without timestamps, so a session
+    never keeps the word times of an earlier transcription.
+    """
+    db = SessionLocal()
+    try:
+        timing = db.get(TranscriptTiming, audio_session_id)
+        if data is None:
+            if timing is not None:
+                db.delete(timing)
+                db.commit()
+            return
+
+        transcript = TimedTranscript(data)
+        if timing is None:
+            timing = TranscriptTiming(audio_session_id=audio_session_id)
+            db.add(timing)
+        timing.format_version = FORMAT_VERSION
+        timing.segment_count = transcript.segment_count
+        timing.word_count = transcript.word_count
+        timing.duration = transcript.duration
+        timing.data = data
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _batch_jobs(batch_id: str) -> list[Job]:
+    db = SessionLocal()
+    try:
+        return (
+            db.query(Job)
+            .filter(Job.batch_id == batch_id)
+            .order_by(Job.created_time, Job.id)
+            .all()
+        )
+    finally:
+        db.close()
+
+
+def _owner() -> str:
+    # the server process, as it signs the jobs it runs. Not kept at import,
+    # a server that forks its workers after importing has one per worker
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _lease_expired(lease_seconds: float):
+    expired_before = _utcnow() - datetime.timedelta(seconds=lease_seconds)
+    return or_(
+        Job.owner.is_(None),
+        Job.heartbeat_time.is_(None),
+        Job.heartbeat_time < expired_before,
+    )
+
+
+@timed_stage("db")
+def _claim_abandoned_jobs(lease_seconds: float) -> list[str]:
+    """
+    Take over the unfinished jobs whose owner stopped renewing its lease,
+    a server that stopped or crashed. Each job is claimed with a conditional
+    update, so of several servers sharing the database only one gets it.
+    """
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Job.id)
+            .filter(Job.status.not_in(FINISHED_STATUSES), _lease_expired(lease_seconds))
+            .all()
+        )
+        claimed = []
+        for row in rows:
+            taken = (
+                db.query(Job)
+                .filter(
+                    Job.id == row.id,
+                    Job.status.not_in(FINISHED_STATUSES),
+                    _lease_expired(lease_seconds),
+                )
+                .update(
+                    {"owner": _owner(), "heartbeat_time": _utcnow()},
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            if taken:
+                claimed.append(row.id)
+        return claimed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@timed_stage("db")
+def _renew_leases(job_ids: list[str]) -> None:
+    db = SessionLocal()
+    try:
+        db.query(Job).filter(Job.id.in_(job_ids), Job.owner == _owner()).update(
+            {"heartbeat_time": _utcnow()}, synchronize_session=False
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class JobRunner:
+    """
+    Runs the transcription + notes pipeline as background jobs.
+    Job state lives in the `jobs` table, so clients can poll it and unfinished
+    jobs are picked up again when the server restarts. Several servers may
+    share the table: each one holds a lease on the jobs it runs and only
+    takes over jobs whose lease ran out. Transcription runs on
+    the warm worker pool and notes on a process pool, so the event loop is
+    never blocked.
+    """
+
+    def __init__(
+        self,
+        transcription_pool: TranscriptionWorkerPool,
+        notes_workers: int = 2,
+        max_running_jobs: int = 8,
+        lease_seconds: float = 60.0,
+    ):
+        self.transcription_pool = transcription_pool
+        self.notes_workers = notes_workers
+        self.max_running_jobs = max_running_jobs
+        # a job's owner renews its lease every third of this
+        self.lease_seconds = lease_seconds
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.notes_executor: Optional[ProcessPoolExecutor] = None
+        self._notes_tokens: Optional[multiprocessing.Queue] = None
+        # token queue of every notes stream running on the notes processes
+        self._notes_streams: dict[str, asyncio.Queue] = {}
+
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._finished: dict[str, asyncio.Event] = {}
+        self._subscribers: dict[str, list[asyncio.Queue]] = {}
+        # last status and transcription of every running job, for new subscribers
+        self._latest: dict[str, dict] = {}
+        # one concurrency limit per backend, keyed by "kind:name"
+        self._limits: dict[str, asyncio.Semaphore] = {}
+        # and one for all jobs, the rest wait queued
+        self._slots = asyncio.Semaphore(max_running_jobs)
+        self._running = 0
+        # moving average of how long a job takes once it runs
+        self._job_seconds: Optional[float] = None
+
+    @classmethod
+    def from_env(cls, transcription_pool: TranscriptionWorkerPool) -> "JobRunner":
+        return cls(
+            transcription_pool,
+            notes_workers=int(os.getenv("NOTES_POOL_WORKERS", "2")),
+            max_running_jobs=int(os.getenv("MAX_RUNNING_JOBS", "8")),
+            lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "60")),
+        )
+
+    async def start(self) -> None:
+        # every notes process loads its llama model once and keeps it
+        self._notes_tokens = multiprocessing.Queue()
+        self.notes_executor = ProcessPoolExecutor(
+            max_workers=self.notes_workers,
+            initializer=_init_notes_process,
+            initargs=(self._notes_tokens,),
+        )
+        threading.Thread(
+            target=self._read_notes_tokens,
+            args=(asyncio.get_running_loop(), self._notes_tokens),
+            daemon=True,
+        ).start()
+        if os.getenv("LLAMA_PREWARM", "0") == "1":
+            # processes start on demand, give each one a task so it warms up now
+            for _ in range(self.notes_workers):
+                self.notes_executor.submit(time.sleep, 0.1)
+
+        # resume whatever was in flight when this or another server stopped
+        await self._resume_abandoned_jobs()
+        self._heartbeat = asyncio.create_task(self._keep_leases())
+
+    async def stop(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+        if self.notes_executor is not None:
+            self.notes_executor.shutdown(wait=False, cancel_futures=True)
+            self.notes_executor = None
+        if self._notes_tokens is not None:
+            # ends the reader thread
+            self._notes_tokens.put(None)
+            self._notes_tokens = None
+
+    async def submit(
+        self,
+        audio_session_id: int,
+        file_path: str,
+        query_file: str,
+        transcription_method: TranscriptionMethod,
+        notes_method: NotesMethod,
+        notes_mode: NotesMode,
+        session_name: str,
+        query_lang: str,
+        query_prompt: str,
+        query_audio_kind: str,
+        audio_hash: Optional[str] = None,
+        batch_id: Optional[str] = None,
+        model_size: Optional[str] = None,
+        compute_type: Optional[str] = None,
+    ) -> str:
+        """
+        Persist a new job and start it in the background. `model_size` and
+        `compute_type` are expected resolved, see `resolve_model`.
+        Raises `LookupError` when the AudioSession does not exist.
+        """
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(
+            _create_job,
+            job_id,
+            {
+                "audio_session_id": audio_session_id,
+                "file_path": file_path,
+                "audio_hash": audio_hash,
+                "batch_id": batch_id,
+                "query_file": query_file,
+                "transcription_method": transcription_method.value,
+                "model_size": model_size,
+                "compute_type": compute_type,
+                "notes_method": notes_method.value,
+                "notes_mode": notes_mode.value,
+                "session_name": session_name,
+                "query_lang": query_lang,
+                "query_prompt": query_prompt,
+                "query_audio_kind": query_audio_kind,
+            },
+        )
+        self._schedule(job_id)
+        return job_id
+
+    @property
+    def active_jobs(self) -> int:
+        # running or waiting for a slot
+        return len(self._tasks)
+
+    @property
+    def running_jobs(self) -> int:
+        return self._running
+
+    @property
+    def queued_jobs(self) -> int:
+        return len(self._tasks) - self._running
+
+    @property
+    def average_job_seconds(self) -> Optional[float]:
+        return self._job_seconds
+
+    async def create_audio_session(self) -> int:
+        return await asyncio.to_thread(_create_audio_session)
+
+    async def batch_progress(self, batch_id: str) -> Optional[dict]:
+        """
+        Aggregate progress of every job in a batch, or None for an unknown batch.
+        """
+        jobs = await asyncio.to_thread(_batch_jobs, batch_id)
+        if not jobs:
+            return None
+
+        counts = {status.value: 0 for status in JobStatus}
+        for job in jobs:
+            counts[job.status] += 1
+        finished = counts[JobStatus.done.value] + counts[JobStatus.failed.value]
+
+        return {
+            "batch_id": batch_id,
+            "total": len(jobs),
+            "finished": finished,
+            "progress": round(finished / len(jobs), 4),
+            "counts": counts,
+            "jobs": [
+                {
+                    "job_id": job.id,
+                    "audio_session_id": job.audio_session_id,
+                    "query_file": job.query_file,
+                    "status": job.status,
+                    "error": job.error,
+                }
+                for job in jobs
+            ],
+        }
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(_load_job, job_id)
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """
+        Wait until the job is done or failed, or until `timeout` seconds passed,
+        and return its latest state.
+        """
+        job = await self.get(job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return job
+
+        finished = self._finished.get(job_id)
+        try:
+            if finished is not None:
+                await asyncio.wait_for(finished.wait(), timeout)
+            else:
+                # job is owned by another server process, poll the db instead
+                await asyncio.wait_for(self._poll_until_finished(job_id), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        return await self.get(job_id)
+
+    def subscribe(self, job_id: str) -> Optional[asyncio.Queue]:
+        """
+        Get a queue of `(event, data)` tuples for a running job: `status`,
+        `segment`, `metrics`, `transcription`, `notes_token` for every piece
+        of notes as the model writes it, `notes`, and finally `done`, `failed`
+        or `interrupted`. The queue starts with the job's current status, and its
+        transcription once there is one, so a late subscriber misses neither.
+        Returns None when the job is not running in this process.
+        """
+        if job_id not in self._tasks:
+            return None
+        events = asyncio.Queue()
+        for event, data in self._latest.get(job_id, {}).items():
+            events.put_nowait((event, data))
+        self._subscribers.setdefault(job_id, []).append(events)
+        return events
+
+    def unsubscribe(self, job_id: str, events: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(job_id, [])
+        if events in subscribers:
+            subscribers.remove(events)
+
+    async def transcribe(
+        self,
+        path: str,
+        method: TranscriptionMethod,
+        query_lang=None,
+        query_prompt=None,
+        query_audio_kind=None,
+        model_size=None,
+        compute_type=None,
+    ) -> TranscriptionResult:
+        """
+        Transcribe a file that is not a job of its own, like a window of a
+        live recording. Local models run on the pool, remote apis from the
+        event loop.
+        """
+        backend = get_transcription_backend(method)
+        async with self._limit("transcription", backend):
+            if backend.capabilities.local:
+                return await self._wait_for_pool(
+                    path,
+                    method,
+                    query_lang=query_lang,
+                    query_prompt=query_prompt,
+                    query_audio_kind=query_audio_kind,
+                    model_size=model_size,
+                    compute_type=compute_type,
+                )
+
+            with stage("asr", backend.name):
+                transcription = await backend.atranscribe(
+                    path,
+                    query_lang=query_lang,
+                    query_prompt=query_prompt,
+                    query_audio_kind=query_audio_kind,
+                )
+            return TranscriptionResult(transcription)
+
+    async def generate_notes(
+        self,
+        transcription: str,
+        method: NotesMethod,
+        query_prompt=None,
+        mode: NotesMode = NotesMode.single,
+    ) -> str:
+        backend = get_notes_backend(method)
+        async with self._limit("notes", backend):
+            with stage("llm", method, mode=mode):
+                # remote providers are called from the event loop, only local
+                # models need a notes process
+                if not backend.capabilities.local:
+                    return await agenerate_notes_from_transcript(
+                        transcription, method, query_prompt, mode
+                    )
+
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self.notes_executor,
+                    generate_notes_from_transcript,
+                    transcription,
+                    method,
+                    query_prompt,
+                    mode,
+                )
+
+    async def stream_notes(
+        self,
+        transcription: str,
+        method: NotesMethod,
+        query_prompt=None,
+        mode: NotesMode = NotesMode.single,
+    ) -> AsyncIterator[str]:
+        """
+        `generate_notes`, yielding the notes piece by piece as the model
+        writes them. Methods that cannot stream yield their notes once.
+        """
+        backend = get_notes_backend(method)
+        async with self._limit("notes", backend):
+            with stage("llm", method, mode=mode):
+                if not backend.capabilities.local:
+                    async for token in astream_notes_from_transcript(
+                        transcription, method, query_prompt, mode
+                    ):
+                        yield token
+                    return
+
+                stream_id = uuid.uuid4().hex
+                tokens = self._notes_streams[stream_id] = asyncio.Queue()
+                try:
+                    loop = asyncio.get_running_loop()
+                    future = loop.run_in_executor(
+                        self.notes_executor,
+                        _stream_notes_in_process,
+                        stream_id,
+                        transcription,
+                        method,
+                        query_prompt,
+                        mode,
+                    )
+                    # a notes process that died never sends the end of its stream
+                    future.add_done_callback(
+                        lambda f: f.cancelled()
+                        or f.exception() is None
+                        or tokens.put_nowait(None)
+                    )
+                    while (token := await tokens.get()) is not None:
+                        yield token
+                    # raises what failed in the notes process
+                    await future
+                finally:
+                    self._notes_streams.pop(stream_id, None)
+
+    def _read_notes_tokens(
+        self, loop: asyncio.AbstractEventLoop, notes_tokens: multiprocessing.Queue
+    ) -> None:
+        # runs on its own thread, hands tokens over to the event loop
+        while (item := notes_tokens.get()) is not None:
+            loop.call_soon_threadsafe(self._deliver_notes_token, *item)
+
+    def _deliver_notes_token(self, stream_id: str, token: Optional[str]) -> None:
+        tokens = self._notes_streams.get(stream_id)
+        if tokens is not None:
+            tokens.put_nowait(token)
+
+    def _limit(self, kind: str, backend: Backend) -> asyncio.Semaphore:
+        key = f"{kind}:{backend.name}"
+        if key not in self._limits:
+            self._limits[key] = asyncio.Semaphore(backend.max_concurrency)
+        return self._limits[key]
+
+    async def _poll_until_finished(self, job_id: str, interval: float = 0.5) -> None:
+        while True:
+            job = await self.get(job_id)
+            if job is None or job.status in FINISHED_STATUSES:
+                return
+            await asyncio.sleep(interval)
+
+    def _publish(self, job_id: str, event: str, data=None) -> None:
+        if event in ("status", "transcription") and job_id in self._latest:
+            self._latest[job_id][event] = data
+        for events in self._subscribers.get(job_id, []):
+            events.put_nowait((event, data))
+
+    async def _transcribe(self, job: Job) -> TranscriptionResult:
+        """
+        Transcribe with the job's backend, at most `max_concurrency` at a time.
+        Local models run on the worker pool, remote apis from the event loop.
+        """
+        backend = get_transcription_backend(job.transcription_method)
+        async with self._limit("transcription", backend):
+            if backend.capabilities.local:
+                if backend.capabilities.timestamps and chunk_seconds() > 0:
+                    result = await self._transcribe_chunked(job)
+                    if result is not None:
+                        return result
+                return await self._transcribe_on_pool(job)
+
+            with stage("asr", backend.name):
+                transcription = await backend.atranscribe(
+                    job.file_path,
+                    query_lang=job.query_lang,
+                    query_prompt=job.query_prompt,
+                    query_audio_kind=job.query_audio_kind,
+                )
+            self._publish(job.id, "segment", transcription)
+            return TranscriptionResult(transcription)
+
+    async def _transcribe_on_pool(
+        self, job: Job, retry_interval: float = 1.0
+    ) -> TranscriptionResult:
+        """
+        Transcribe on the worker pool, publishing segments as they arrive.
+        """
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        first_segment_at = None
+
+        def on_segment(segment: str) -> None:
+            # called from a pool thread, hop back onto the event loop
+            loop.call_soon_threadsafe(handle_segment, segment)
+
+        def handle_segment(segment: str) -> None:
+            nonlocal first_segment_at
+            if first_segment_at is None:
+                first_segment_at = time.monotonic() - started
+                logger.info(
+                    "job %s time to first segment %.2fs", job.id, first_segment_at
+                )
+                self._publish(
+                    job.id, "metrics", {"time_to_first_segment": first_segment_at}
+                )
+            self._publish(job.id, "segment", segment)
+
+        result = await self._submit_to_pool(
+            job, job.file_path, on_segment, retry_interval
+        )
+        if first_segment_at is not None:
+            await asyncio.to_thread(
+                _update_job, job.id, time_to_first_segment=first_segment_at
+            )
+        return result
+
+    async def _submit_to_pool(
+        self, job: Job, path: str, on_segment=None, retry_interval: float = 1.0
+    ) -> TranscriptionResult:
+        return await self._wait_for_pool(
+            path,
+            TranscriptionMethod(job.transcription_method),
+            retry_interval,
+            query_lang=job.query_lang,
+            query_prompt=job.query_prompt,
+            query_audio_kind=job.query_audio_kind,
+            on_segment=on_segment,
+            model_size=job.model_size,
+            compute_type=job.compute_type,
+        )
+
+    async def _wait_for_pool(
+        self,
+        path: str,
+        method: TranscriptionMethod,
+        retry_interval: float = 1.0,
+        **kwargs,
+    ) -> TranscriptionResult:
+        # jobs outlive the pool's queue, so wait for room instead of failing
+        while True:
+            try:
+                future = self.transcription_pool.submit(path, method, **kwargs)
+                break
+            except PoolFullError:
+                await asyncio.sleep(retry_interval)
+
+        return await asyncio.wrap_future(future)
+
+    async def _transcribe_chunked(self, job: Job) -> Optional[TranscriptionResult]:
+        """
+        Split a long recording at silence and transcribe the chunks on every
+        pool worker at once, then stitch them into one transcription with
+        original file times. Segments are published chunk by chunk, in order.
+        Returns None when the file is too short to be worth splitting.
+        """
+        started = time.monotonic()
+        split = await asyncio.to_thread(split_audio, job.file_path)
+        if split is None:
+            return None
+        chunks, remap = split
+
+        tasks = [
+            asyncio.create_task(self._submit_to_pool(job, chunk.path))
+            for chunk in chunks
+        ]
+        segments = []
+        try:
+            for i, (chunk, task) in enumerate(zip(chunks, tasks)):
+                chunk_result = await task
+                owned = chunk_segments(chunk, chunk_result.timings, remap)
+                if i == 0:
+                    first_segment_at = time.monotonic() - started
+                    self._publish(
+                        job.id, "metrics", {"time_to_first_segment": first_segment_at}
+                    )
+                    await asyncio.to_thread(
+                        _update_job, job.id, time_to_first_segment=first_segment_at
+                    )
+                for segment in owned:
+                    self._publish(job.id, "segment", str(segment))
+                segments.extend(owned)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.to_thread(remove_chunks, chunks)
+
+        logger.info(
+            "job %s transcribed %d chunks in %.2fs",
+            job.id,
+            len(chunks),
+            time.monotonic() - started,
+        )
+        return TranscriptionResult(
+            "\n".join(str(segment) for segment in segments),
+            encode_segments(segments) if segments else None,
+        )
+
+    async def _transcribe_cached(self, job: Job) -> TranscriptionResult:
+        """
+        Transcribe through the content-addressed cache, so a re-uploaded
+        recording with the same settings skips ASR. Word timestamps are cached
+        next to the text.
+        """
+        if job.audio_hash is None:
+            job.audio_hash = await asyncio.to_thread(cache.hash_file, job.file_path)
+            await asyncio.to_thread(_update_job, job.id, audio_hash=job.audio_hash)
+
+        key = cache.transcription_cache_key(
+            job.audio_hash,
+            job.transcription_method,
+            job.query_lang,
+            job.query_prompt,
+            job.query_audio_kind,
+            job.model_size,
+            job.compute_type,
+        )
+        transcription = await asyncio.to_thread(
+            cache.cache_get, cache.TRANSCRIPTION, key
+        )
+        timings_key = cache.timings_cache_key(key)
+        if transcription is not None:
+            logger.info("job %s transcription cache hit", job.id)
+            for segment in transcription.splitlines():
+                self._publish(job.id, "segment", segment)
+            timings = await asyncio.to_thread(
+                cache.cache_get, cache.TIMINGS, timings_key
+            )
+            return TranscriptionResult(
+                transcription, base64.b64decode(timings) if timings else None
+            )
+
+        result = await self._transcribe(job)
+        # alibaba reports api errors as text, those must not be cached
+        if not result.text.startswith("Error: "):
+            await asyncio.to_thread(
+                cache.cache_put, cache.TRANSCRIPTION, key, result.text
+            )
+            if result.timings is not None:
+                await asyncio.to_thread(
+                    cache.cache_put,
+                    cache.TIMINGS,
+                    timings_key,
+                    base64.b64encode(result.timings).decode("ascii"),
+                )
+        return result
+
+    async def _generate_notes_cached(self, job: Job, transcription: str) -> str:
+        key = cache.notes_cache_key(
+            transcription, job.notes_method, job.query_prompt, job.notes_mode
+        )
+        notes = await asyncio.to_thread(cache.cache_get, cache.NOTES, key)
+        if notes is not None:
+            logger.info("job %s notes cache hit", job.id)
+            return notes
+
+        # streamed, so subscribers see the notes as they are written
+        parts = []
+        async for token in self.stream_notes(
+            transcription,
+            NotesMethod(job.notes_method),
+            job.query_prompt,
+            NotesMode(job.notes_mode),
+        ):
+            parts.append(token)
+            self._publish(job.id, "notes_token", token)
+        notes = "".join(parts).strip()
+        await asyncio.to_thread(cache.cache_put, cache.NOTES, key, notes)
+        return notes
+
+    def _count_finished(self, job: Optional[Job], status: JobStatus) -> None:
+        JOBS_FINISHED.inc(
+            status=status.value,
+            transcription_method=getattr(job, "transcription_method", ""),
+            notes_method=getattr(job, "notes_method", ""),
+        )
+
+    async def _resume_abandoned_jobs(self) -> None:
+        for job_id in await asyncio.to_thread(
+            _claim_abandoned_jobs, self.lease_seconds
+        ):
+            if job_id in self._tasks:
+                continue
+            logger.info("resuming unfinished job %s", job_id)
+            self._schedule(job_id)
+
+    async def _keep_leases(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if self._tasks:
+                    await asyncio.to_thread(_renew_leases, list(self._tasks))
+                # jobs of a server that died since
+                await self._resume_abandoned_jobs()
+            except Exception:
+                logger.exception("could not renew the job leases")
+
+    def _schedule(self, job_id: str) -> None:
+        self._finished[job_id] = asyncio.Event()
+        self._latest[job_id] = {"status": JobStatus.queued.value}
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id))
+
+    async def _run(self, job_id: str) -> None:
+        # jobs beyond MAX_RUNNING_JOBS wait here, still queued
+        async with self._slots:
+            self._running += 1
+            started = time.monotonic()
+            try:
+                # one trace per job, its stages are the child spans
+                with span("job", job_id=job_id):
+                    await self._run_job(job_id)
+            finally:
+                self._running -= 1
+
+            seconds = time.monotonic() - started
+            if self._job_seconds is None:
+                self._job_seconds = seconds
+            else:
+                self._job_seconds = 0.8 * self._job_seconds + 0.2 * seconds
+
+    async def _run_job(self, job_id: str) -> None:
+        job = None
+        try:
+            job = await self.get(job_id)
+            transcription = job.transcription_text
+
+            # Step 1: transcription, skipped when resuming a job that already has it
+            if transcription is None:
+                if not os.path.exists(job.file_path):
+                    raise FileNotFoundError(f"Uploaded file {job.query_file} is gone")
+
+                await asyncio.to_thread(
+                    _update_job, job_id, status=JobStatus.transcribing.value
+                )
+                self._publish(job_id, "status", JobStatus.transcribing.value)
+                result = await self._transcribe_cached(job)
+                transcription = result.text
+                logger.debug(
+                    "job %s transcribed %d characters", job_id, len(transcription)
+                )
+                await asyncio.to_thread(
+                    save_timings, job.audio_session_id, result.timings
+                )
+
+            # Step 2: notes generation
+            await asyncio.to_thread(
+                _update_job,
+                job_id,
+                status=JobStatus.generating_notes.value,
+                transcription_text=transcription,
+            )
+            self._publish(job_id, "transcription", transcription)
+            self._publish(job_id, "status", JobStatus.generating_notes.value)
+            notes = await self._generate_notes_cached(job, transcription)
+
+            await asyncio.to_thread(_finish_job, job_id, notes)
+            self._publish(job_id, "notes", notes)
+            self._publish(job_id, "done")
+            self._count_finished(job, JobStatus.done)
+        except asyncio.CancelledError:
+            # server is shutting down, the job is resumed on the next start
+            self._publish(job_id, "interrupted")
+            raise
+        except Exception as e:
+            logger.exception("job %s failed", job_id)
+            error = f"{type(e).__name__}: {e}"
+            await asyncio.to_thread(
+                _update_job, job_id, status=JobStatus.failed.value, error=error
+            )
+            self._publish(job_id, "failed", error)
+            self._count_finished(job, JobStatus.failed)
+        finally:
+            self._subscribers.pop(job_id, None)
+            self._latest.pop(job_id, None)
+            self._tasks.pop(job_id, None)
+            finished = self._finished.pop(job_id, None)
+            if finished is not None:
+                finished.set()
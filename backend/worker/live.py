@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import math
+import os
+import uuid
+import wave
+from typing import Optional
+
+import numpy as np
+
+from audio.audio import TranscriptionMethod
+from audio.chunking import AudioChunk, chunk_segments
+from audio.preprocess import SAMPLE_RATE, TimeRemap
+from audio.timestamps import Segment, encode_segments
+from model.chunking import estimate_tokens
+from model.model import NotesMethod
+from telemetry.metrics import timed_stage
+
+from db.db_setup import AudioSession, SessionLocal
+from worker.jobs import JobRunner, save_timings, store_output
+
+logger = logging.getLogger(__name__)
+
+# the live stream is 16 bit little endian mono pcm at SAMPLE_RATE
+SAMPLE_WIDTH = 2
+
+LIVE_NOTES_PROMPT = (
+    "This is a live recording. The transcript starts with the notes taken so "
+    "far, then the newest part of the transcript. Return the complete updated "
+    "notes: keep the existing points and add what the new part says."
+)
+
+
+def live_window_seconds() -> float:
+    # audio transcribed at a time, at least 2 seconds
+    return max(float(os.getenv("LIVE_WINDOW_SECONDS", "10")), 2.0)
+
+
+def live_notes_every() -> int:
+    # new segments between two notes updates
+    return int(os.getenv("LIVE_NOTES_EVERY", "5"))
+
+
+def live_notes_max_tokens() -> int:
+    # previous notes an update may rewrite, the older ones are kept as they are
+    return int(os.getenv("LIVE_NOTES_MAX_TOKENS", "2000"))
+
+
+def settle_notes(notes: str, max_tokens: int) -> tuple[str, str]:
+    """
+    Split notes over `max_tokens` into settled lines, which are kept as they
+    are, and the latest lines, which updates still rewrite. Half the budget
+    is left open, so the next split is a while off.
+    """
+    if max_tokens <= 0 or estimate_tokens(notes) <= max_tokens:
+        return "", notes
+
+    lines = notes.splitlines()
+    keep, tokens = 0, 0
+    for line in reversed(lines):
+        tokens += estimate_tokens(line) + 1  # + newline
+        if keep and tokens > max_tokens // 2:
+            break
+        keep += 1
+    return "\n".join(lines[:-keep]), "\n".join(lines[-keep:])
+
+
+def notes_update_input(notes: str, new_lines: list[str]) -> str:
+    """
+    What the notes model gets for one update: the latest notes and only
+    the transcript since then, so an update costs the same an hour in.
+    """
+    if not notes:
+        return "\n".join(new_lines)
+    return f"Notes so far:\n{notes}\n\nNew transcript:\n" + "\n".join(new_lines)
+
+
+def _quiet_cut(samples: np.ndarray, window: int) -> int:
+    # end the window in the quietest 100 ms of its last second, so a word is
+    # rarely split between two windows
+    frame = SAMPLE_RATE // 10
+    tail = samples[window - SAMPLE_RATE : window].astype(np.float32)
+    energy = np.square(tail.reshape(-1, frame)).mean(axis=1)
+    return window - SAMPLE_RATE + int(energy.argmin()) * frame + frame // 2
+
+
+def _write_wav(path: str, samples: np.ndarray) -> None:
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(SAMPLE_WIDTH)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.astype("<i2").tobytes())
+
+
+def audio_session_exists(audio_session_id: int) -> bool:
+    db = SessionLocal()
+    try:
+        return db.get(AudioSession, audio_session_id) is not None
+    finally:
+        db.close()
+
+
+@timed_stage("db")
+def _save_live_session(
+    audio_session_id: int, fields: dict, transcription: str, notes: str
+) -> None:
+    db = SessionLocal()
+    try:
+        audio_session = db.get(AudioSession, audio_session_id)
+        if audio_session is None:
+            raise LookupError(f"No AudioSession found with id {audio_session_id}")
+        for name, value in fields.items():
+            setattr(audio_session, name, value)
+        store_output(db, audio_session, transcription, notes)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class LiveSession:
+    """
+    Notes for a recording that is still going on. Pcm arrives in pieces of
+    any size and is transcribed one window at a time, in order. Every
+    `notes_every` new segments the notes draft is rewritten from the previous
+    draft and those segments alone; an update that comes due while the last
+    one is still running waits and takes the newer segments with it.
+    Events for the client are put on `events` as `(event, data)` tuples.
+    """
+
+    def __init__(
+        self,
+        runner: JobRunner,
+        audio_session_id: int,
+        transcription_method: TranscriptionMethod,
+        notes_method: NotesMethod,
+        upload_dir: str,
+        session_name: str = "",
+        query_lang: Optional[str] = None,
+        query_prompt: Optional[str] = None,
+        query_audio_kind: Optional[str] = None,
+        model_size: Optional[str] = None,
+        compute_type: Optional[str] = None,
+        notes_every: Optional[int] = None,
+    ):
+        self.runner = runner
+        self.audio_session_id = audio_session_id
+        self.transcription_method = transcription_method
+        self.notes_method = notes_method
+        self.session_name = session_name
+        self.query_lang = query_lang
+        self.query_prompt = query_prompt
+        self.query_audio_kind = query_audio_kind
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.notes_every = max(notes_every or live_notes_every(), 1)
+
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.lines: list[str] = []
+        self.segments: list[Segment] = []
+        self.notes = ""
+
+        # the whole recording is kept, like an upload
+        self.path = os.path.join(upload_dir, f"{uuid.uuid4().hex}_live.wav")
+        self._recording = wave.open(self.path, "wb")
+        self._recording.setnchannels(1)
+        self._recording.setsampwidth(SAMPLE_WIDTH)
+        self._recording.setframerate(SAMPLE_RATE)
+
+        self._window = int(live_window_seconds() * SAMPLE_RATE)
+        self._buffer = np.zeros(0, dtype=np.int16)
+        self._odd_byte = b""
+        # seconds of the recording before `_buffer`
+        self._offset = 0.0
+        self._windows: asyncio.Queue = asyncio.Queue()
+        self._new_lines: list[str] = []
+        self._notes_task: Optional[asyncio.Task] = None
+        self._transcriber = asyncio.create_task(self._transcribe_windows())
+
+    def add_audio(self, pcm: bytes) -> None:
+        pcm = self._odd_byte + pcm
+        # a message may end in the middle of a sample
+        cut = len(pcm) - len(pcm) % SAMPLE_WIDTH
+        self._odd_byte = pcm[cut:]
+        self._recording.writeframes(pcm[:cut])
+        self._buffer = np.concatenate(
+            [self._buffer, np.frombuffer(pcm[:cut], dtype="<i2")]
+        )
+
+        while len(self._buffer) >= self._window:
+            end = _quiet_cut(self._buffer, self._window)
+            self._queue_window(end)
+
+    async def finish(self) -> dict:
+        """
+        Transcribe what is left, bring the notes up to date and store both on
+        the AudioSession.
+        """
+        if len(self._buffer):
+            self._queue_window(len(self._buffer))
+        self._windows.put_nowait(None)
+        await self._transcriber
+        if self._notes_task is not None:
+            await self._notes_task
+        if self._new_lines:
+            await self._update_notes()
+        self._recording.close()
+
+        transcription = "\n".join(self.lines)
+        await asyncio.to_thread(
+            _save_live_session,
+            self.audio_session_id,
+            {
+                "session_name": self.session_name,
+                "query_file": os.path.basename(self.path),
+                "query_lang": self.query_lang or "",
+                "query_prompt": self.query_prompt or "",
+                "query_audio_kind": self.query_audio_kind or "",
+            },
+            transcription,
+            self.notes,
+        )
+        await asyncio.to_thread(
+            save_timings,
+            self.audio_session_id,
+            encode_segments(self.segments) if self.segments else None,
+        )
+        result = {"transcription": transcription, "notes": self.notes}
+        self.events.put_nowait(("done", result))
+        return result
+
+    async def close(self) -> None:
+        """
+        Stop without storing anything, for a connection that failed.
+        """
+        for task in (self._transcriber, self._notes_task):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(
+            *(t for t in (self._transcriber, self._notes_task) if t is not None),
+            return_exceptions=True,
+        )
+        self._recording.close()
+
+    def _queue_window(self, end: int) -> None:
+        self._windows.put_nowait((self._offset, self._buffer[:end]))
+        self._offset += end / SAMPLE_RATE
+        self._buffer = self._buffer[end:]
+
+    async def _transcribe_windows(self) -> None:
+        index = 0
+        while (window := await self._windows.get()) is not None:
+            offset, samples = window
+            path = f"{self.path}.window{index}.wav"
+            index += 1
+            await asyncio.to_thread(_write_wav, path, samples)
+            try:
+                result = await self.runner.transcribe(
+                    path,
+                    self.transcription_method,
+                    query_lang=self.query_lang,
+                    query_prompt=self.query_prompt,
+                    query_audio_kind=self.query_audio_kind,
+                    model_size=self.model_size,
+                    compute_type=self.compute_type,
+                )
+            except Exception as e:
+                # one bad window must not end the meeting's notes
+                logger.exception("live window at %.1fs failed", offset)
+                self.events.put_nowait(("error", f"{type(e).__name__}: {e}"))
+                continue
+            finally:
+                os.remove(path)
+
+            if result.timings is not None:
+                # window times shifted to recording times
+                chunk = AudioChunk(path, offset, offset, math.inf)
+                segments = chunk_segments(
+                    chunk, result.timings, TimeRemap(np.zeros(1), np.zeros(1))
+                )
+                self.segments.extend(segments)
+                lines = [str(segment) for segment in segments]
+            else:
+                lines = [line for line in result.text.splitlines() if line.strip()]
+
+            for line in lines:
+                self.events.put_nowait(("segment", line))
+            self.lines.extend(lines)
+            self._new_lines.extend(lines)
+
+            if len(self._new_lines) >= self.notes_every and (
+                self._notes_task is None or self._notes_task.done()
+            ):
+                self._notes_task = asyncio.create_task(self._update_notes())
+
+    async def _update_notes(self) -> None:
+        new_lines, self._new_lines = self._new_lines, []
+        prompt = LIVE_NOTES_PROMPT
+        if self.query_prompt:
+            prompt = f"{prompt}\n{self.query_prompt}"
+        settled, notes = settle_notes(self.notes, live_notes_max_tokens())
+        try:
+            notes = await self.runner.generate_notes(
+                notes_update_input(notes, new_lines), self.notes_method, prompt
+            )
+        except Exception as e:
+            logger.exception("live notes update failed")
+            # the next update covers these lines again
+            self._new_lines = new_lines + self._new_lines
+            self.events.put_nowait(("error", f"{type(e).__name__}: {e}"))
+            return
+        self.notes = f"{settled}\n{notes}" if settled else notes
+        self.events.put_nowait(("notes", self.notes))
@@ -0,0 +1,501 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection, wait
+from typing import Callable, Optional
+
+from audio.audio import TranscriptionMethod
+from audio.tuning import asr_pool_workers
+from telemetry.metrics import (
+    buffer_observations,
+    drain_observations,
+    record_observations,
+    stage,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PoolFullError(Exception):
+    """Raised when the job queue is full and the job cannot be accepted."""
+
+
+class WorkerCrashedError(Exception):
+    """Raised on a job's future when its worker died while running it."""
+
+
+def _load_audio(kwargs: dict):
+    from audio.audio import get_transcription_backend
+
+    return get_transcription_backend(kwargs["method"]).load_audio(kwargs["path"])
+
+
+def _worker_main(worker_id, conn, warm_methods, heartbeat_interval):
+    """
+    Entry point of a pool worker process.
+    Loads the models once, then serves jobs sent over `conn` until it gets `None`.
+    Every message sent back is a `(kind, job_id, payload)` tuple, streaming jobs
+    also send a `segment` message per decoded segment. Stage timings go back
+    in `metrics` messages, the server process serves them.
+    Jobs sent ahead of time are decoded in a background thread while the
+    current one runs, so the model goes straight from one job to the next.
+    """
+    from audio.audio import stream_transcription, warmup_transcription_model
+    from audio.timestamps import Segment, TranscriptionResult, encode_segments
+
+    buffer_observations()
+    for method in warm_methods:
+        try:
+            warmup_transcription_model(method)
+        except Exception as e:
+            logger.warning("worker %s could not warm up %s: %s", worker_id, method, e)
+
+    conn.send(("metrics", None, drain_observations()))
+    conn.send(("ready", None, None))
+
+    decoder = ThreadPoolExecutor(max_workers=1)
+    # (job, future of its decoded audio) in the order they were sent
+    queued = deque()
+
+    def receive() -> bool:
+        job = conn.recv()
+        # sentinel sent by the pool on shutdown
+        if job is None:
+            return False
+        queued.append((job, decoder.submit(_load_audio, job[1])))
+        return True
+
+    running = True
+    while running:
+        if not queued:
+            if not conn.poll(heartbeat_interval):
+                conn.send(("heartbeat", None, None))
+                continue
+            running = receive()
+        # start decoding whatever else is already waiting in the pipe
+        while running and conn.poll(0):
+            running = receive()
+        if not running:
+            break
+
+        (job_id, kwargs, stream), audio = queued.popleft()
+        try:
+            lines, segments = [], []
+            with stage("asr", kwargs["method"]):
+                parts = stream_transcription(**{**kwargs, "path": audio.result()})
+                for part in parts:
+                    # backends with timestamps yield segments, the others text
+                    if isinstance(part, Segment):
+                        segments.append(part)
+                        part = str(part)
+                    lines.append(part)
+                    if stream:
+                        conn.send(("segment", job_id, part))
+            result = TranscriptionResult(
+                "\n".join(lines), encode_segments(segments) if segments else None
+            )
+        except Exception as e:
+            conn.send(("metrics", None, drain_observations()))
+            conn.send(("error", job_id, f"{type(e).__name__}: {e}"))
+        else:
+            conn.send(("metrics", None, drain_observations()))
+            conn.send(("done", job_id, result))
+
+    decoder.shutdown(wait=False, cancel_futures=True)
+
+
+@dataclass
+class _WorkerHandle:
+    worker_id: int
+    process: Process
+    conn: Connection
+    started_at: float = field(default_factory=time.monotonic)
+    last_seen: float = field(default_factory=time.monotonic)
+    ready: bool = False
+    # jobs sent to the worker in order, the first one is running
+    jobs: list[tuple[str, dict, bool]] = field(default_factory=list)
+    # jobs handed to the worker, not yet sent over its pipe
+    outbox: deque = field(default_factory=deque)
+    # one sender at a time keeps the jobs in order
+    send_lock: threading.Lock = field(default_factory=threading.Lock)
+    job_started_at: Optional[float] = None
+    jobs_done: int = 0
+    restarts: int = 0
+
+
+class TranscriptionWorkerPool:
+    """
+    Long-lived pool of transcription processes.
+    Each worker loads its models once at startup, so jobs only pay for
+    inference. Jobs wait in a bounded queue in this process and are handed to
+    workers over a private pipe per worker, so a crashed worker can never leave
+    a shared queue locked. Each worker also gets up to `prefetch` jobs ahead
+    of time and decodes their audio while the current one runs. A monitor thread restarts
+    workers that crash, do not get ready within the warmup timeout, stop
+    sending heartbeats, or exceed the job timeout.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 1,
+        max_queue_size: int = 32,
+        warm_methods: Optional[list[TranscriptionMethod]] = None,
+        health_check_interval: float = 5.0,
+        job_timeout: Optional[float] = None,
+        prefetch: int = 1,
+        warmup_timeout: Optional[float] = 600.0,
+    ):
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.warm_methods = list(warm_methods or [])
+        self.health_check_interval = health_check_interval
+        self.job_timeout = job_timeout
+        self.prefetch = prefetch
+        self.warmup_timeout = warmup_timeout
+
+        self._pending: deque[tuple[str, dict, bool]] = deque()
+        self._workers: dict[int, _WorkerHandle] = {}
+        self._futures: dict[str, Future] = {}
+        self._segment_callbacks: dict[str, Callable[[str], None]] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    @classmethod
+    def from_env(cls) -> "TranscriptionWorkerPool":
+        warm = os.getenv("ASR_POOL_WARM_METHODS", "faster_whisper")
+        job_timeout = float(os.getenv("ASR_POOL_JOB_TIMEOUT", "0"))
+        warmup_timeout = float(os.getenv("ASR_POOL_WARMUP_TIMEOUT", "600"))
+        return cls(
+            num_workers=asr_pool_workers(),
+            max_queue_size=int(os.getenv("ASR_POOL_QUEUE_SIZE", "32")),
+            warm_methods=[TranscriptionMethod(m) for m in warm.split(",") if m],
+            health_check_interval=float(os.getenv("ASR_POOL_HEALTH_INTERVAL", "5")),
+            job_timeout=job_timeout or None,
+            prefetch=int(os.getenv("ASR_POOL_PREFETCH", "1")),
+            warmup_timeout=warmup_timeout or None,
+        )
+
+    def start(self) -> None:
+        self._stopping.clear()
+
+        for worker_id in range(self.num_workers):
+            self._spawn(worker_id)
+
+        for target in (self._collect_results, self._monitor_workers):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        logger.info("transcription pool started with %d workers", self.num_workers)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+
+        for handle in self._workers.values():
+            try:
+                handle.conn.send(None)
+            except OSError:
+                pass
+
+        for thread in self._threads:
+            thread.join(timeout)
+
+        for handle in self._workers.values():
+            handle.process.join(timeout)
+            if handle.process.is_alive():
+                handle.process.terminate()
+            handle.conn.close()
+
+        with self._lock:
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(RuntimeError("Transcription pool stopped"))
+            self._futures.clear()
+            self._segment_callbacks.clear()
+            self._pending.clear()
+
+        self._workers.clear()
+        self._threads.clear()
+
+    def submit(
+        self,
+        path: str,
+        method: TranscriptionMethod,
+        query_lang=None,
+        query_prompt=None,
+        query_audio_kind=None,
+        on_segment: Optional[Callable[[str], None]] = None,
+        model_size=None,
+        compute_type=None,
+    ) -> Future:
+        """
+        Queue a transcription job and return a future with its
+        `TranscriptionResult`.
+        When `on_segment` is given, it is called from a pool thread with each
+        segment as soon as the worker decodes it.
+        Raises `PoolFullError` right away when the queue is full.
+        """
+        job_id = uuid.uuid4().hex
+        future = Future()
+        kwargs = {
+            "path": path,
+            "method": method,
+            "query_lang": query_lang,
+            "query_prompt": query_prompt,
+            "query_audio_kind": query_audio_kind,
+            "model_size": model_size,
+            "compute_type": compute_type,
+        }
+
+        with self._lock:
+            if len(self._pending) >= self.max_queue_size:
+                raise PoolFullError("Transcription queue is full")
+            self._futures[job_id] = future
+            if on_segment is not None:
+                self._segment_callbacks[job_id] = on_segment
+            self._pending.append((job_id, kwargs, on_segment is not None))
+            assigned = self._dispatch()
+        self._send(assigned)
+
+        return future
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def health(self) -> list[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "worker_id": handle.worker_id,
+                    "pid": handle.process.pid,
+                    "alive": handle.process.is_alive(),
+                    "ready": handle.ready,
+                    "busy": bool(handle.jobs),
+                    "queued_jobs": max(len(handle.jobs) - 1, 0),
+                    "seconds_since_seen": round(now - handle.last_seen, 2),
+                    "jobs_done": handle.jobs_done,
+                    "restarts": handle.restarts,
+                }
+                for handle in self._workers.values()
+            ]
+
+    def _spawn(self, worker_id: int, restarts: int = 0) -> None:
+        parent_conn, child_conn = Pipe()
+        process = Process(
+            target=_worker_main,
+            args=(
+                worker_id,
+                child_conn,
+                self.warm_methods,
+                self.health_check_interval,
+            ),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        with self._lock:
+            self._workers[worker_id] = _WorkerHandle(
+                worker_id=worker_id,
+                process=process,
+                conn=parent_conn,
+                restarts=restarts,
+            )
+
+    def _dispatch(self) -> list[_WorkerHandle]:
+        """
+        Hand pending jobs to ready workers, idle ones first, then up to
+        `prefetch` more per busy worker. Must be called with the lock held,
+        the returned workers get their jobs from `_send` once it is released.
+        """
+        assigned = []
+        for depth in range(1 + self.prefetch):
+            for handle in self._workers.values():
+                if not self._pending:
+                    return assigned
+                if handle.ready and len(handle.jobs) == depth:
+                    if self._assign_next(handle):
+                        assigned.append(handle)
+        return assigned
+
+    def _assign_next(self, handle: _WorkerHandle) -> bool:
+        while self._pending:
+            job = self._pending.popleft()
+            job_id = job[0]
+            future = self._futures.get(job_id)
+            # the caller may have cancelled while the job was waiting
+            if future is None or future.done():
+                self._futures.pop(job_id, None)
+                self._segment_callbacks.pop(job_id, None)
+                continue
+
+            if not handle.jobs:
+                handle.job_started_at = time.monotonic()
+            handle.jobs.append(job)
+            handle.outbox.append(job)
+            return True
+        return False
+
+    def _send(self, handles: list[_WorkerHandle]) -> None:
+        """
+        Send the jobs `_dispatch` handed to workers, without the lock held so a
+        slow pipe never stalls the other pool threads.
+        """
+        for handle in handles:
+            with handle.send_lock:
+                while True:
+                    with self._lock:
+                        if not handle.outbox:
+                            break
+                        job = handle.outbox.popleft()
+                    try:
+                        handle.conn.send(job)
+                    except OSError:
+                        self._unsend(handle, job)
+                        break
+
+    def _unsend(self, handle: _WorkerHandle, job: tuple[str, dict, bool]) -> None:
+        # worker is gone, the monitor restarts it and the unsent jobs wait
+        with self._lock:
+            handle.ready = False
+            unsent = {job[0]} | {queued[0] for queued in handle.outbox}
+            handle.outbox.clear()
+            # a restart may already have taken them back
+            back = [queued for queued in handle.jobs if queued[0] in unsent]
+            handle.jobs = [queued for queued in handle.jobs if queued[0] not in unsent]
+            if not handle.jobs:
+                handle.job_started_at = None
+            self._pending.extendleft(reversed(back))
+
+    def _collect_results(self) -> None:
+        while not self._stopping.is_set():
+            with self._lock:
+                conns = {h.conn: h for h in self._workers.values()}
+
+            try:
+                ready_conns = wait(list(conns), timeout=0.5)
+            except (OSError, ValueError):
+                # a connection was closed by a restart, pick up the new one
+                continue
+
+            for conn in ready_conns:
+                handle = conns[conn]
+                try:
+                    kind, job_id, payload = conn.recv()
+                except (EOFError, OSError):
+                    # worker died, the monitor will restart it
+                    with self._lock:
+                        handle.ready = False
+                    continue
+
+                with self._lock:
+                    handle.last_seen = time.monotonic()
+                    future = None
+                    on_segment = self._segment_callbacks.get(job_id)
+
+                    if kind == "ready":
+                        handle.ready = True
+                    elif kind in ("done", "error") and job_id in (
+                        job[0] for job in handle.jobs
+                    ):
+                        handle.jobs = [job for job in handle.jobs if job[0] != job_id]
+                        # the worker starts its next job right away
+                        handle.job_started_at = (
+                            time.monotonic() if handle.jobs else None
+                        )
+                        handle.jobs_done += 1
+                        future = self._futures.pop(job_id, None)
+                        self._segment_callbacks.pop(job_id, None)
+
+                    assigned = self._dispatch()
+                self._send(assigned)
+
+                if kind == "metrics":
+                    record_observations(payload)
+                    continue
+                if kind == "segment":
+                    if on_segment is not None:
+                        try:
+                            on_segment(payload)
+                        except Exception:
+                            logger.exception(
+                                "segment callback for job %s failed", job_id
+                            )
+                    continue
+
+                # the caller may have cancelled while the job was running
+                if future is None or future.done():
+                    continue
+                if kind == "done":
+                    future.set_result(payload)
+                else:
+                    future.set_exception(RuntimeError(payload))
+
+    def _monitor_workers(self) -> None:
+        while not self._stopping.wait(self.health_check_interval):
+            now = time.monotonic()
+            with self._lock:
+                handles = list(self._workers.values())
+
+            for handle in handles:
+                reason = None
+                if not handle.process.is_alive():
+                    reason = f"exited with code {handle.process.exitcode}"
+                elif (
+                    self.warmup_timeout
+                    and not handle.ready
+                    and now - handle.started_at > self.warmup_timeout
+                ):
+                    # hung while loading or warming up its models
+                    reason = f"not ready after {self.warmup_timeout}s"
+                elif (
+                    self.job_timeout
+                    and handle.job_started_at is not None
+                    and now - handle.job_started_at > self.job_timeout
+                ):
+                    reason = f"job ran longer than {self.job_timeout}s"
+                elif (
+                    handle.ready
+                    and not handle.jobs
+                    and now - handle.last_seen > 3 * self.health_check_interval
+                ):
+                    reason = "stopped sending heartbeats"
+
+                if reason is not None and not self._stopping.is_set():
+                    self._restart(handle, reason)
+
+    def _restart(self, handle: _WorkerHandle, reason: str) -> None:
+        logger.warning(
+            "restarting transcription worker %s: %s", handle.worker_id, reason
+        )
+        with self._lock:
+            # no more jobs for this worker while it is being replaced
+            handle.ready = False
+
+        if handle.process.is_alive():
+            handle.process.terminate()
+        handle.process.join(1)
+        handle.conn.close()
+
+        with self._lock:
+            running, waiting = handle.jobs[:1], handle.jobs[1:]
+            future = None
+            for job_id, _, _ in running:
+                future = self._futures.pop(job_id, None)
+                self._segment_callbacks.pop(job_id, None)
+            # jobs the worker had not started yet go back to the front of the queue
+            self._pending.extendleft(reversed(waiting))
+            handle.jobs = []
+            handle.outbox.clear()
+        if future is not None and not future.done():
+            future.set_exception(WorkerCrashedError(f"Transcription worker {reason}"))
+
+        self._spawn(handle.worker_id, restarts=handle.restarts + 1)